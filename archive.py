@@ -0,0 +1,259 @@
+"""
+Hot/cold storage for leads.
+
+Leads older than ARCHIVE_AFTER_DAYS move out of the SQLite file into one
+gzip-compressed JSONL partition per month under ARCHIVE_DIR, next to a
+small JSON index (row count, created_at/id range, per-service counts).
+The hot DB then gives the freed pages back with an incremental vacuum, so
+its size tracks recent traffic rather than the whole history.
+
+iter_leads() reads a date range from both sides and only opens partitions
+whose index says they overlap the range (and contain the service, when
+filtering by one). Who the archived leads came from stays in the hot DB's
+archived_clients table, so broadcasts still reach them, and their phones
+and days in archived_phones, so import_leads.py still sees them as
+duplicates.
+
+    python archive.py run --days 180
+    python archive.py export --since 2025-01-01 --until 2025-07-01 --service ceramic > leads.csv
+"""
+import os
+import sys
+import csv
+import gzip
+import json
+import sqlite3
+import argparse
+from datetime import datetime, timedelta
+
+import db
+
+LEAD_FIELDS = [
+    "id", "created_at", "tg_user_id", "tg_username", "name", "phone", "car",
+    "segment_trigger", "pain_main", "services_interest", "ready_time",
+    "lead_temp", "contact_method", "comment_free", "source",
+    "assigned_to", "claimed_at", "closed_at",
+]
+
+
+# -------------------- partitions --------------------
+def _paths(archive_dir, month):
+    return (
+        os.path.join(archive_dir, f"leads-{month}.jsonl.gz"),
+        os.path.join(archive_dir, f"leads-{month}.idx.json"),
+    )
+
+def _next_month(month):
+    year, mon = int(month[:4]), int(month[5:7])
+    return f"{year + mon // 12:04d}-{mon % 12 + 1:02d}"
+
+def read_index(archive_dir, month):
+    with open(_paths(archive_dir, month)[1], encoding="utf-8") as f:
+        return json.load(f)
+
+def list_months(archive_dir):
+    if not os.path.isdir(archive_dir):
+        return []
+    return sorted(
+        name[len("leads-"):-len(".idx.json")]
+        for name in os.listdir(archive_dir)
+        if name.startswith("leads-") and name.endswith(".idx.json")
+    )
+
+def read_partition(archive_dir, month):
+    data_path = _paths(archive_dir, month)[0]
+    if not os.path.exists(data_path):
+        return
+    with gzip.open(data_path, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+def _write_partition(archive_dir, month, rows):
+    data_path, index_path = _paths(archive_dir, month)
+    services = {}
+    for r in rows:
+        for key in r.get("services") or {}:
+            services[key] = services.get(key, 0) + 1
+    index = {
+        "month": month,
+        "count": len(rows),
+        "min_created_at": rows[0]["created_at"],
+        "max_created_at": rows[-1]["created_at"],
+        "min_id": min(r["id"] for r in rows),
+        "max_id": max(r["id"] for r in rows),
+        "services": services,
+    }
+
+    # write aside and swap in, so a crash never leaves half a partition
+    tmp = data_path + ".tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=9) as f:
+        for r in rows:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    os.replace(tmp, data_path)
+    tmp = index_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp, index_path)
+
+
+# -------------------- archival job --------------------
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _with_services(conn, rows):
+    out = []
+    for r in rows:
+        lead = dict(r)
+        lead["services"] = {
+            s["service_key"]: json.loads(s["answers"]) if s["answers"] else {}
+            for s in conn.execute(
+                "SELECT service_key, answers FROM lead_services WHERE lead_id = ?", (lead["id"],)
+            )
+        }
+        out.append(lead)
+    return out
+
+def _add_to_index(conn, rows):
+    conn.executemany(
+        "INSERT OR IGNORE INTO archived_clients (service_key, tg_user_id) VALUES (?, ?)",
+        {(key, r["tg_user_id"]) for r in rows for key in ("", *(r.get("services") or ()))},
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO archived_phones (phone, day) VALUES (?, ?)",
+        {(r["phone"], r["created_at"][:10]) for r in rows if r.get("phone")},
+    )
+
+def _index_archive(conn, archive_dir):
+    # partitions written before archived_clients / archived_phones existed
+    # are read once (archived_clients keeps tg_user_id 0 of imported leads
+    # too, so it is never left empty)
+    if all(
+        conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone()
+        for table in ("archived_clients", "archived_phones")
+    ):
+        return
+    with conn:
+        for month in list_months(archive_dir):
+            _add_to_index(conn, list(read_partition(archive_dir, month)))
+
+def archive_leads(db_path, archive_dir, older_than_days, now=None):
+    """Move leads older than `older_than_days` into monthly partitions. Returns {month: moved}."""
+    cutoff = ((now or datetime.utcnow()) - timedelta(days=older_than_days)).isoformat()
+    os.makedirs(archive_dir, exist_ok=True)
+    conn = _connect(db_path)
+    moved = {}
+    try:
+        _index_archive(conn, archive_dir)
+        months = [r[0] for r in conn.execute(
+            "SELECT DISTINCT substr(created_at, 1, 7) FROM leads WHERE created_at < ?", (cutoff,)
+        )]
+        for month in months:
+            rows = _with_services(conn, conn.execute(
+                "SELECT * FROM leads WHERE created_at >= ? AND created_at < ? AND created_at < ?",
+                (month, _next_month(month), cutoff),
+            ).fetchall())
+            if not rows:
+                continue
+
+            # merge by id: a rerun after a crash between the file swap and
+            # the delete below must not duplicate anything
+            merged = {r["id"]: r for r in read_partition(archive_dir, month)}
+            merged.update((r["id"], r) for r in rows)
+            _write_partition(
+                archive_dir, month, sorted(merged.values(), key=lambda r: (r["created_at"], r["id"])),
+            )
+
+            ids = [(r["id"],) for r in rows]
+            with conn:
+                _add_to_index(conn, rows)
+                conn.executemany("DELETE FROM lead_services WHERE lead_id = ?", ids)
+                conn.executemany("DELETE FROM leads WHERE id = ?", ids)
+            moved[month] = len(rows)
+
+        if moved:
+            # auto_vacuum is switched on by db.py's migrations, so this only
+            # hands the free pages back, without rebuilding the file;
+            # execute() steps the pragma once and frees a single page, the
+            # script runs it to the end
+            conn.executescript("PRAGMA incremental_vacuum")
+    finally:
+        conn.close()
+    return moved
+
+
+# -------------------- reading --------------------
+def _archived(archive_dir, since, until, service):
+    for month in list_months(archive_dir):
+        idx = read_index(archive_dir, month)
+        if idx["max_created_at"] < since or idx["min_created_at"] >= until:
+            continue
+        if service and service not in idx["services"]:
+            continue
+        for r in read_partition(archive_dir, month):
+            if since <= r["created_at"] < until and (not service or service in r.get("services", {})):
+                yield r
+
+def _hot(db_path, since, until, service):
+    conn = _connect(db_path)
+    try:
+        if service:
+            cur = conn.execute("""
+            SELECT l.* FROM lead_services s JOIN leads l ON l.id = s.lead_id
+            WHERE s.service_key = ? AND s.created_at >= ? AND s.created_at < ?
+            ORDER BY s.created_at
+            """, (service, since, until))
+        else:
+            cur = conn.execute(
+                "SELECT * FROM leads WHERE created_at >= ? AND created_at < ? ORDER BY created_at",
+                (since, until),
+            )
+        for r in cur:
+            yield dict(r)
+    finally:
+        conn.close()
+
+def iter_leads(db_path, archive_dir, since, until=None, service=None):
+    """Leads with since <= created_at < until from archive and hot DB, oldest first."""
+    until = until or "9999"
+    yield from _archived(archive_dir, since, until, service)
+    yield from _hot(db_path, since, until, service)
+
+def export_csv(rows, out):
+    w = csv.DictWriter(out, fieldnames=LEAD_FIELDS, extrasaction="ignore")
+    w.writeheader()
+    n = 0
+    for r in rows:
+        w.writerow(r)
+        n += 1
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lead archive tools")
+    parser.add_argument("--db", default=os.getenv("DB_PATH", "rks.db"))
+    parser.add_argument("--archive-dir", default=os.getenv("ARCHIVE_DIR", "archive"))
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    run = sub.add_parser("run", help="move old leads into the archive")
+    run.add_argument("--days", type=int, default=int(os.getenv("ARCHIVE_AFTER_DAYS", "180")))
+
+    exp = sub.add_parser("export", help="write leads in a date range as CSV to stdout")
+    exp.add_argument("--since", required=True, help="ISO date, inclusive")
+    exp.add_argument("--until", help="ISO date, exclusive")
+    exp.add_argument("--service")
+
+    args = parser.parse_args()
+    if args.cmd == "run":
+        db.init_db(args.db)
+        moved = archive_leads(args.db, args.archive_dir, args.days)
+        print(json.dumps(moved))
+    else:
+        rows = iter_leads(args.db, args.archive_dir, args.since, args.until, args.service)
+        n = export_csv(rows, sys.stdout)
+        print(f"{n} leads", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+from itertools import count
+
+# -------------------- LEAD ASSIGNMENT --------------------
+# Who gets a new lead when ASSIGN_MODE is set: "round_robin" takes managers
+# in MANAGER_ID order, "least_open" the one with the fewest claimed but not
+# closed leads (ties in MANAGER_ID order). The counters live in memory, are
+# rebuilt from the leads table when the app is built and follow every claim
+# and close; they are only a hint, the claim itself is the CAS in
+# db.claim_lead. In sharded mode each worker keeps its own counters.
+
+MODES = ("", "round_robin", "least_open")
+
+
+class Assigner:
+    def __init__(self, manager_ids, mode=""):
+        if mode not in MODES:
+            raise RuntimeError(f"ASSIGN_MODE must be one of {', '.join(m for m in MODES if m)}")
+        self.manager_ids = tuple(manager_ids)
+        self.mode = mode
+        self.load = {m: 0 for m in self.manager_ids}
+        self.names = {}
+        self._turn = count()
+
+    @property
+    def auto(self):
+        return bool(self.mode) and bool(self.manager_ids)
+
+    def rebuild(self, counts, last=None):
+        for m in self.manager_ids:
+            self.load[m] = counts.get(m, 0)
+        if last in self.manager_ids:
+            self._turn = count(self.manager_ids.index(last) + 1)
+
+    def pick(self):
+        if self.mode == "least_open":
+            return min(self.manager_ids, key=lambda m: self.load[m])
+        return self.manager_ids[next(self._turn) % len(self.manager_ids)]
+
+    def claimed(self, manager_id):
+        self.load[manager_id] = self.load.get(manager_id, 0) + 1
+
+    def closed(self, manager_id):
+        self.load[manager_id] = max(0, self.load.get(manager_id, 0) - 1)
+
+    def name(self, manager_id):
+        return self.names.get(manager_id) or f"менеджер {manager_id}"
+
+    def remember(self, user):
+        self.names[user.id] = "@" + user.username if user.username else user.full_name
@@ -0,0 +1,128 @@
+"""
+Online backups of the lead database.
+
+Snapshots are taken with SQLite's backup API a few pages at a time with a
+short sleep in between, so the live writer only ever waits for one small
+step. Each snapshot is checked with PRAGMA integrity_check, gzip-compressed
+and handed to a store; only the newest BACKUP_KEEP are kept. The store is
+a local directory today; anything with put/get/list/delete can replace it.
+
+    python backup.py run
+    python backup.py list
+    python backup.py restore rks-20261019-030000.db.gz
+"""
+import os
+import gzip
+import shutil
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime
+
+PAGES_PER_STEP = 64
+SLEEP_BETWEEN_STEPS = 0.05
+
+
+class LocalStore:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def put(self, local_path, name):
+        tmp = os.path.join(self.root, name + ".tmp")
+        shutil.copyfile(local_path, tmp)
+        os.replace(tmp, os.path.join(self.root, name))
+
+    def get(self, name, local_path):
+        shutil.copyfile(os.path.join(self.root, name), local_path)
+
+    def list(self):
+        return sorted(n for n in os.listdir(self.root) if not n.endswith(".tmp"))
+
+    def delete(self, name):
+        os.remove(os.path.join(self.root, name))
+
+
+def _prefix(db_path):
+    return os.path.splitext(os.path.basename(db_path))[0] + "-"
+
+def _check(path):
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+    if result != "ok":
+        raise RuntimeError(f"integrity_check failed for {path}: {result}")
+
+
+def backup_db(db_path, store, keep=7, pages=PAGES_PER_STEP, sleep=SLEEP_BETWEEN_STEPS):
+    """Snapshot `db_path` into `store`, verify it, rotate old ones. Returns the snapshot name."""
+    name = _prefix(db_path) + datetime.utcnow().strftime("%Y%m%d-%H%M%S") + ".db.gz"
+    with tempfile.TemporaryDirectory() as tmp:
+        raw = os.path.join(tmp, "snapshot.db")
+        src = sqlite3.connect(db_path, timeout=30)
+        dst = sqlite3.connect(raw)
+        try:
+            src.backup(dst, pages=pages, sleep=sleep)
+        finally:
+            dst.close()
+            src.close()
+        _check(raw)
+
+        packed = raw + ".gz"
+        with open(raw, "rb") as f_in, gzip.open(packed, "wb", compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        store.put(packed, name)
+
+    snapshots = [n for n in store.list() if n.startswith(_prefix(db_path))]
+    for old in snapshots[:-keep] if keep > 0 else []:
+        store.delete(old)
+    return name
+
+
+def restore_db(store, name, db_path):
+    """Copy snapshot `name` into `db_path` through the backup API (safe while others have it open)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        packed = os.path.join(tmp, name)
+        raw = os.path.join(tmp, "restore.db")
+        store.get(name, packed)
+        with gzip.open(packed, "rb") as f_in, open(raw, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        _check(raw)
+
+        src = sqlite3.connect(raw)
+        dst = sqlite3.connect(db_path, timeout=30)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+    _check(db_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lead database backups")
+    parser.add_argument("--db", default=os.getenv("DB_PATH", "rks.db"))
+    parser.add_argument("--dir", default=os.getenv("BACKUP_DIR", "backups"))
+    parser.add_argument("--keep", type=int, default=int(os.getenv("BACKUP_KEEP", "7")))
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("run", help="take a snapshot now")
+    sub.add_parser("list", help="list snapshots")
+    restore = sub.add_parser("restore", help="restore a snapshot over the database")
+    restore.add_argument("name")
+    args = parser.parse_args()
+
+    store = LocalStore(args.dir)
+    if args.cmd == "run":
+        print(backup_db(args.db, store, keep=args.keep))
+    elif args.cmd == "list":
+        for name in store.list():
+            print(name)
+    else:
+        restore_db(store, args.name, args.db)
+        print(f"restored {args.name} -> {args.db}")
+
+
+if __name__ == "__main__":
+    main()
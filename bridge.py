@@ -0,0 +1,85 @@
+from collections import OrderedDict
+
+import db
+
+# -------------------- MESSAGE INDEX --------------------
+# Which lead and client chat a bot message in a manager's chat belongs to:
+# the lead cards, and client follow-ups copied under them. A manager's reply
+# to either is routed to the client; a client's follow-up goes under the
+# cards of their latest lead. Links are written to message_links and kept in
+# two LRUs, so routing a reply to a recent card never reads the DB. Only
+# hits are cached for manager messages: in sharded mode the link may have
+# been written by another worker a moment ago.
+
+LINKS_IN_MEMORY = 5000
+
+
+class _LRU(OrderedDict):
+    def __init__(self, capacity):
+        super().__init__()
+        self.capacity = capacity
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        self.move_to_end(key)
+        return super().__getitem__(key)
+
+    def put(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+        if len(self) > self.capacity:
+            self.popitem(last=False)
+
+
+class MessageIndex:
+    def __init__(self, db_path, capacity=LINKS_IN_MEMORY):
+        self.db_path = db_path
+        self._links = _LRU(capacity)   # (chat_id, message_id) -> (lead_id, client_chat_id)
+        self._cards = _LRU(capacity)   # client_chat_id -> (lead_id, [(chat_id, message_id)]) of the latest lead
+        self.hits = 0
+        self.misses = 0
+
+    async def link_cards(self, lead_id, client_chat_id, cards):
+        """Remember the card messages [(chat_id, message_id)] just sent for a new lead."""
+        await db.writer.run(self.db_path, db.add_message_links, [
+            (chat_id, message_id, lead_id, client_chat_id, "card") for chat_id, message_id in cards
+        ])
+        for key in cards:
+            self._links.put(key, (lead_id, client_chat_id))
+        self._cards.put(client_chat_id, (lead_id, list(cards)))
+
+    async def link_relays(self, lead_id, client_chat_id, messages):
+        """Remember client messages [(chat_id, message_id)] copied into manager chats."""
+        await db.writer.run(self.db_path, db.add_message_links, [
+            (chat_id, message_id, lead_id, client_chat_id, "relay") for chat_id, message_id in messages
+        ])
+        for key in messages:
+            self._links.put(key, (lead_id, client_chat_id))
+
+    async def lookup(self, chat_id, message_id):
+        """(lead_id, client_chat_id) for a message in a manager chat, or None."""
+        key = (chat_id, message_id)
+        link = self._links.get(key)
+        if link is not None:
+            self.hits += 1
+            return link
+        self.misses += 1
+        row = await db.writer.run(self.db_path, db.get_message_link, chat_id, message_id)
+        if row is None:
+            return None
+        link = tuple(row)
+        self._links.put(key, link)
+        return link
+
+    async def cards_for(self, client_chat_id):
+        """(lead_id, [(chat_id, message_id)]) of the client's latest lead; no cards -> (None, [])."""
+        cards = self._cards.get(client_chat_id)
+        if cards is not None:
+            self.hits += 1
+            return cards
+        self.misses += 1
+        rows = await db.writer.run(self.db_path, db.latest_cards, client_chat_id)
+        cards = (rows[0][0] if rows else None, [(chat_id, message_id) for _, chat_id, message_id in rows])
+        self._cards.put(client_chat_id, cards)
+        return cards
@@ -0,0 +1,264 @@
+"""
+Seasonal offers to past clients.
+
+A manager writes to the bot
+
+    /broadcast anti_rain Осень близко: антидождь со скидкой 20% до конца месяца
+    /broadcast all Перед зимними реагентами — керамика со скидкой
+
+and gets the number of recipients with "Отправить" / "Отмена" buttons.
+/broadcast stop pauses the running broadcast, /broadcast resume continues
+the last paused one, /broadcast alone shows the latest one.
+
+Once confirmed, a broadcast runs as a background task:
+
+- recipients are read from the leads table and the clients of archived
+  leads (archived_clients) a page at a time, in ascending user id, so a
+  campaign of any size never sits in memory;
+- sends are spaced to BROADCAST_RATE messages per second (Telegram lets a
+  bot send about 30 per second across all chats, and the bot keeps
+  answering clients meanwhile); a RetryAfter (flood control) holds every
+  send for as long as Telegram asks and the same client is tried again;
+- a 403 means the client blocked the bot: they go to blocked_users and no
+  later broadcast writes to them until they leave a new lead;
+- the position (last user id handled) and the counters are saved after
+  every WINDOW clients, so a restart resumes mid-campaign; after a crash
+  at most the last window may get the offer twice.
+
+A runner holds a lease on its broadcast and renews it with every save, so
+with several workers (shard.py) exactly one of them sends: the one the
+manager confirmed it in. Worker 0 also looks for running broadcasts
+nobody holds a lease on (after a restart, or when the sending worker
+died) and takes them over. Pausing is a status change in the database, so
+/broadcast stop works from any worker.
+
+The manager's message about the broadcast is edited with live counters
+every STATS_EVERY_SEC.
+
+    python broadcast.py status [ID]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import secrets
+import logging
+import argparse
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+import db
+
+logger = logging.getLogger("rks_bot.broadcast")
+
+RATE_PER_SEC = 25
+PAGE = 500
+WINDOW = 10  # sent concurrently; a round trip to Telegram is longer than 1 / rate
+LEASE_SEC = 120
+STATS_EVERY_SEC = 5
+NETWORK_RETRIES = 3
+FLOOD_RETRIES = 5
+
+STATUS_NAMES = {
+    "draft": "ждёт подтверждения",
+    "running": "идёт",
+    "paused": "на паузе",
+    "done": "завершена",
+    "cancelled": "отменена",
+}
+
+
+class Pacer:
+    """Spaces sends 1 / rate seconds apart; hold() stops them all for a while."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+
+    async def wait(self):
+        now = asyncio.get_running_loop().time()
+        at = max(now, self._next)
+        self._next = at + self.interval
+        if at > now:
+            await asyncio.sleep(at - now)
+
+    def hold(self, seconds):
+        self._next = max(self._next, asyncio.get_running_loop().time() + seconds)
+
+
+def stats_text(row, rate=None):
+    audience = "все клиенты" if row["service_key"] is None else row["service_key"]
+    done = row["sent"] + row["blocked"] + row["failed"]
+    lines = [
+        f"Рассылка #{row['id']} ({audience}): {STATUS_NAMES.get(row['status'], row['status'])}",
+        f"Обработано: {done} из {row['total']}",
+        f"Доставлено: {row['sent']}",
+        f"Заблокировали бота: {row['blocked']}",
+        f"Ошибки: {row['failed']}",
+    ]
+    if rate:
+        lines.append(f"Скорость: {rate:.1f} сообщ./с")
+    return "\n".join(lines)
+
+
+class Broadcaster:
+    def __init__(self, bot, db_path, rate=RATE_PER_SEC):
+        self.bot = bot
+        self.db_path = db_path
+        self.pacer = Pacer(rate)
+        self.runner = secrets.token_hex(8)
+        self._task = None
+        self.current = None
+
+    @property
+    def busy(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self, broadcast_id):
+        """Run a broadcast in status "running" here, unless another runner has it."""
+        if self.busy:
+            return False
+        lease = time.time() + LEASE_SEC
+        if not await db.writer.run(self.db_path, db.claim_broadcast, broadcast_id, self.runner, lease):
+            return False
+        self.current = broadcast_id
+        self._task = asyncio.create_task(self._run(broadcast_id))
+        return True
+
+    async def resume(self):
+        for broadcast_id in await db.writer.run(self.db_path, db.running_broadcasts):
+            if await self.start(broadcast_id):
+                logger.info("Broadcast resumed", extra={"broadcast_id": broadcast_id})
+                return
+
+    async def run(self):
+        """Background job: pick up running broadcasts nobody holds a lease on."""
+        try:
+            while True:
+                try:
+                    await self.resume()
+                except Exception:
+                    logger.exception("Broadcast resume failed")
+                await asyncio.sleep(LEASE_SEC)
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        try:
+            # let a restarted process take over without waiting for the lease
+            await db.writer.run(self.db_path, db.release_broadcast, self.current, self.runner)
+        except Exception:
+            logger.exception("Broadcast lease not released", extra={"broadcast_id": self.current})
+
+    async def _deliver(self, user_id, text):
+        """"sent", "blocked" or "failed"."""
+        network_tries = flood_tries = 0
+        while True:
+            await self.pacer.wait()
+            try:
+                await self.bot.send_message(chat_id=user_id, text=text)
+                return "sent"
+            except RetryAfter as e:
+                flood_tries += 1
+                logger.warning("Flood control, holding sends for %s s", e.retry_after)
+                self.pacer.hold(e.retry_after)
+                if flood_tries >= FLOOD_RETRIES:
+                    return "failed"
+            except Forbidden:
+                await db.writer.run(self.db_path, db.mark_blocked, user_id)
+                return "blocked"
+            except BadRequest as e:
+                logger.warning("Broadcast message not sent: %s", e, extra={"user_id": user_id})
+                return "failed"
+            except TelegramError as e:  # NetworkError, TimedOut
+                network_tries += 1
+                if network_tries >= NETWORK_RETRIES:
+                    logger.warning("Broadcast message not sent: %s", e, extra={"user_id": user_id})
+                    return "failed"
+                await asyncio.sleep(network_tries)
+
+    async def _show(self, row, rate=None):
+        if not row["stats_message_id"]:
+            return
+        try:
+            await self.pacer.wait()
+            await self.bot.edit_message_text(
+                stats_text(row, rate), chat_id=row["stats_chat_id"], message_id=row["stats_message_id"],
+            )
+        except TelegramError as e:
+            if "not modified" not in str(e):
+                logger.warning("Broadcast stats not updated: %s", e, extra={"broadcast_id": row["id"]})
+
+    async def _run(self, broadcast_id):
+        row = await db.writer.run(self.db_path, db.get_broadcast, broadcast_id)
+        logger.info("Broadcast started", extra={"broadcast_id": broadcast_id, "from_user_id": row["last_user_id"]})
+        loop = asyncio.get_running_loop()
+        started, started_done = loop.time(), row["sent"] + row["blocked"] + row["failed"]
+        shown = started
+        try:
+            while True:
+                page = await db.writer.run(
+                    self.db_path, db.broadcast_recipients, row["service_key"], row["last_user_id"], PAGE,
+                )
+                if not page:
+                    break
+                for i in range(0, len(page), WINDOW):
+                    window = page[i:i + WINDOW]
+                    for result in await asyncio.gather(*(self._deliver(u, row["text"]) for u in window)):
+                        row[result] += 1
+                    row["last_user_id"] = window[-1]
+                    status = await db.writer.run(
+                        self.db_path, db.save_broadcast_progress, broadcast_id, self.runner,
+                        time.time() + LEASE_SEC, row["last_user_id"], row["sent"], row["blocked"], row["failed"],
+                    )
+                    if status != "running":
+                        # paused or cancelled meanwhile, or the lease was lost
+                        row = await db.writer.run(self.db_path, db.get_broadcast, broadcast_id)
+                        logger.info("Broadcast stopped", extra={"broadcast_id": broadcast_id, "status": row["status"]})
+                        await self._show(row)
+                        return
+                    now = loop.time()
+                    if now - shown >= STATS_EVERY_SEC:
+                        shown = now
+                        done = row["sent"] + row["blocked"] + row["failed"] - started_done
+                        await self._show(row, done / (now - started))
+
+            await db.writer.run(self.db_path, db.set_broadcast_status, broadcast_id, "done", ("running",))
+            row["status"] = "done"
+            logger.info("Broadcast done", extra={
+                "broadcast_id": broadcast_id, "sent": row["sent"], "blocked": row["blocked"], "failed": row["failed"],
+            })
+            await self._show(row)
+        except Exception:
+            logger.exception("Broadcast failed", extra={"broadcast_id": broadcast_id})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Broadcast tools")
+    parser.add_argument("--db", default=os.getenv("DB_PATH", "rks.db"))
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    status = sub.add_parser("status", help="counters of a broadcast (the latest by default)")
+    status.add_argument("id", nargs="?", type=int)
+    args = parser.parse_args()
+
+    db.init_db(args.db)
+    conn = db._connect(args.db)
+    try:
+        row = db.get_broadcast(conn, args.id) if args.id else db.latest_broadcast(conn)
+        if row is None:
+            print("no such broadcast", file=sys.stderr)
+            sys.exit(1)
+        row["remaining"] = db.count_broadcast_recipients(conn, row["service_key"], row["last_user_id"])
+    finally:
+        conn.close()
+    print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
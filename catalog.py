@@ -0,0 +1,446 @@
+from datetime import datetime, timedelta
+
+import helpers
+
+# -------------------- SERVICES --------------------
+SERVICES = [
+    ("toning", "Тонировка"),
+    ("body_polish", "Полировка кузова"),
+    ("ceramic", "Керамика (защита)"),
+    ("water_spots", "Удаление водного камня (стёкла)"),
+    ("anti_rain", "Антидождь"),
+    ("headlights", "Полировка фар"),
+    ("glass_polish", "Шлифовка/полировка стекла"),
+    ("interior", "Химчистка салона"),
+    ("engine_wash", "Мойка мотора с консервацией"),
+]
+
+SERVICE_LABEL = {k: v for k, v in SERVICES}
+
+TONING_AREAS = [
+    ("rear_hemi", "Полусфера зад"),
+    ("front_hemi", "Полусфера перед"),
+    ("side_rear", "Боковые зад"),
+    ("side_front", "Боковые перед"),
+    ("windshield", "Лобовое"),
+    ("rear_window", "Заднее стекло"),
+]
+
+TONING_AREA_LABEL = {k: v for k, v in TONING_AREAS}
+
+TONING_PERCENTS = ["2%", "5%", "15%", "20%", "35%", "Не знаю"]
+
+# -------------------- SCORING --------------------
+# Points per signal; the sum decides the temperature. A catalogue file may
+# override any of these (see hotreload.py).
+SCORING = {
+    "phone": 2,              # left a phone number
+    "within_1_day": 2,       # wants to come within a day
+    "within_3_days": 1,
+    "services": {"ceramic": 2, "body_polish": 2, "glass_polish": 2, "interior": 2},
+    "service_default": 1,    # any other selected service
+    "two_services": 1,
+    "three_services": 1,
+    "hot": 7,
+    "warm": 4,
+}
+
+def lead_temperature(data, scoring=SCORING):
+    score = 0
+
+    # contact
+    if data.get("contact_method") == "phone" and data.get("phone"):
+        score += scoring["phone"]
+
+    # time proximity
+    dt = data.get("visit_dt")
+    if isinstance(dt, datetime):
+        diff = dt - helpers.now_local()
+        if diff <= timedelta(days=1):
+            score += scoring["within_1_day"]
+        elif diff <= timedelta(days=3):
+            score += scoring["within_3_days"]
+
+    # services weight
+    selected = data.get("services_selected", [])
+    weights = scoring["services"]
+    for svc in selected:
+        score += weights.get(svc, scoring["service_default"])
+
+    if len(selected) >= 2:
+        score += scoring["two_services"]
+    if len(selected) >= 3:
+        score += scoring["three_services"]
+
+    if score >= scoring["hot"]:
+        return "ГОРЯЧИЙ 🔥"
+    if score >= scoring["warm"]:
+        return "ТЁПЛЫЙ 🙂"
+    return "ХОЛОДНЫЙ ❄️"
+
+# -------------------- UPSELLS --------------------
+# Offer `service` when `if` is selected and `service` is not, unless one of
+# the answers in `unless_answer` was given.
+UPSELLS = [
+    {"if": "body_polish", "service": "ceramic",
+     "title": "Керамика после полировки", "reason": "блеск и защита держатся дольше"},
+    {"if": "water_spots", "service": "anti_rain",
+     "title": "Антидождь после удаления налёта", "reason": "стекло дольше чистое, вода скатывается"},
+    {"if": "glass_polish", "service": "anti_rain", "unless_answer": {"glass_has_chips": "Да"},
+     "title": "Антидождь после полировки стекла", "reason": "на ровном стекле работает лучше"},
+]
+
+def compute_upsells(user_data, rules=UPSELLS):
+    selected = set(user_data.get("services_selected", []))
+    ans = user_data.get("services_answers", {}) or {}
+
+    upsells = []
+    for rule in rules:
+        if rule["if"] not in selected or rule["service"] in selected:
+            continue
+        for k, v in rule.get("unless_answer", {}).items():
+            if ans.get(k) == v:
+                break
+        else:
+            upsells.append({"service": rule["service"], "title": rule["title"], "reason": rule["reason"]})
+    return upsells
+
+def format_upsells_for_client(upsells, limit=3):
+    if not upsells:
+        return ""
+    items = upsells[:limit]
+    lines = [f"• {u['title']} — {u['reason']}" for u in items]
+    return "Кстати, часто берут вместе:\n" + "\n".join(lines)
+
+def format_upsells_for_manager(upsells):
+    if not upsells:
+        return "—"
+    return "\n".join([f"• {u['title']} — {u['reason']}" for u in upsells])
+
+# -------------------- LEAD CARD --------------------
+def lead_card_text(data, catalog, tg_username, tg_id, temp, upsells, studio="RKS studio"):
+    """Manager card for a finished form; `data` as returned by LeadDraft.to_data()."""
+    selected = data["services_selected"]
+    answers = data["services_answers"]
+
+    svc_lines = []
+    for svc in selected:
+        label = catalog.labels.get(svc, svc)
+        svc_lines.append("• " + label)
+
+        # every answered step that has a card label, in flow order
+        for key, prefix, notes in catalog.card_steps.get(svc, ()):
+            v = answers.get(key)
+            if not v:
+                continue
+            if isinstance(v, list):
+                v = ", ".join(v)
+            svc_lines.append(prefix + v)
+            if notes and v in notes:
+                svc_lines.append(notes[v])
+
+    dt = data["visit_dt"]
+    dt_str = dt.strftime("%d.%m.%Y %H:%M") if isinstance(dt, datetime) else "—"
+
+    contact_method = data["contact_method"] or "—"
+    phone = data["phone"] or ""
+
+    upsells_text = format_upsells_for_manager(upsells)
+    photos = data.get("photos")
+    photos_text = f"Фото от клиента: {len(photos)} (ответом на карточку)\n\n" if photos else ""
+
+    return (
+        f"НОВАЯ ЗАЯВКА ({studio})\n\n"
+        f"Клиент: {data['name'] or '—'}\n"
+        f"Авто: {data['car'] or '—'}\n"
+        f"Когда удобно: {dt_str}\n"
+        f"TG: {tg_username}\n"
+        f"TG ID: {tg_id}\n"
+        f"Контакт: {'Телефон' if contact_method=='phone' else 'Telegram'}\n"
+        f"Номер: {phone if phone else '—'}\n\n"
+        "Услуги:\n" + "\n".join(svc_lines) + "\n\n"
+        + photos_text +
+        f"Рекомендовано (апселл):\n{upsells_text}\n\n"
+        f"Лид: {temp}"
+    )
+
+# -------------------- FLOW ENGINE --------------------
+# Question steps for every service are built once per catalogue; a
+# customer's flow is then just the concatenation for the services they picked.
+# Besides what the bot asks, a step may carry "card" (its line label on the
+# manager's card), "card_notes" (answer -> extra card line) and "when"
+# ({question key: answer} that must hold for the step to be shown).
+# A "photos" step asks for pictures of the car. Flows put them after all the
+# questions and show only the first, with the texts of all of them, so the
+# client is asked for photos once whatever services they picked.
+def _service_steps(svc, label):
+    steps = []
+    if svc == "toning":
+        steps.append({
+            "type": "toning_areas",
+            "key": "toning_areas",
+            "card": "Зоны",
+            "text": (
+                f"**{label}**\n"
+                "Какие зоны нужно затонировать? (можно несколько)\n\n"
+                "Нажимай по кнопкам и затем **Готово ✅**."
+            ),
+        })
+        steps.append({
+            "type": "toning_percent",
+            "key": "toning_percent",
+            "card": "Процент",
+            "text": (
+                f"**{label}**\n"
+                "Какой процент затемнения хочешь?\n\n"
+                "Если не уверен — выбери «Не знаю»."
+            ),
+        })
+        steps.append({
+            "type": "yesno",
+            "key": "toning_old_film",
+            "card": "Старая плёнка",
+            "text": f"**{label}**\nЕсть старая плёнка, которую нужно снять?",
+            "kb_prefix": "toning_old",
+        })
+
+    elif svc == "body_polish":
+        steps.append({
+            "type": "choice",
+            "key": "body_polish_goal",
+            "card": "Цель",
+            "text": f"**{label}**\nКакая цель полировки?",
+            "options": [
+                "Убрать мелкие царапины/паутинку",
+                "Вернуть блеск/глубину цвета",
+                "Подготовка под керамику",
+                "Не знаю, нужна диагностика",
+            ],
+        })
+        steps.append({
+            "type": "photos",
+            "key": "body_polish_photos",
+            "text": f"**{label}**\nСфотографируй кузов при дневном свете: общий вид и места с царапинами крупно.",
+        })
+
+    elif svc == "ceramic":
+        steps.append({
+            "type": "choice",
+            "key": "ceramic_stage",
+            "card": "Впервые/обновление",
+            "text": f"**{label}**\nКерамика делается **впервые** или это **обновление**?",
+            "options": ["Впервые", "Обновление (керамика уже была)", "Не знаю"],
+        })
+        steps.append({
+            "type": "choice",
+            "key": "ceramic_need",
+            "card": "Приоритет",
+            "text": f"**{label}**\nЧто важнее всего от керамики?",
+            "options": ["Максимальный блеск", "Защита от реагентов/грязи", "Легче мыть авто", "Не знаю, посоветуй"],
+        })
+        steps.append({
+            "type": "info",
+            "key": "ceramic_tip",
+            "text": "Совет: перед керамикой лучше сделать подготовку/полировку — покрытие ляжет идеально и эффект будет заметнее.",
+        })
+
+    elif svc == "water_spots":
+        steps.append({
+            "type": "choice",
+            "key": "water_spots_where",
+            "card": "Где сильнее",
+            "text": f"**{label}**\nНа каких стёклах налёт/водный камень сильнее?",
+            "options": ["Лобовое", "Боковые", "Заднее", "Везде"],
+        })
+
+    elif svc == "anti_rain":
+        steps.append({
+            "type": "choice",
+            "key": "anti_rain_where",
+            "card": "Куда нанести",
+            "text": f"**{label}**\nКуда нанести антидождь?",
+            "options": ["Только лобовое", "Лобовое + боковые", "Все стёкла", "Не знаю, посоветуй"],
+        })
+
+    elif svc == "headlights":
+        steps.append({
+            "type": "choice",
+            "key": "headlights_state",
+            "card": "Состояние",
+            "text": f"**{label}**\nФары мутные/желтые или просто мелкие царапины?",
+            "options": ["Сильно мутные/желтые", "Есть царапины/потёртости", "Хочу профилактику", "Не знаю"],
+        })
+        steps.append({
+            "type": "photos",
+            "key": "headlights_photos",
+            "text": f"**{label}**\nСфотографируй фары спереди, чтобы было видно мутность и царапины.",
+        })
+
+    elif svc == "glass_polish":
+        steps.append({
+            "type": "choice",
+            "key": "glass_polish_problem",
+            "card": "Проблема",
+            "text": f"**{label}**\nЧто на стекле беспокоит больше всего?",
+            "options": ["Дворники оставляют следы/затиры", "Мелкие царапины", "Пескоструй/мутность", "Не знаю, нужна диагностика"],
+        })
+        steps.append({
+            "type": "yesno",
+            "key": "glass_has_chips",
+            "card": "Сколы/трещины",
+            "text": f"**{label}**\nЕсть **сколы/трещины** на стекле?",
+            "kb_prefix": "glass_chips",
+            "card_notes": {"Да": "Важно: полировка/шлифовка невозможна, нужна замена стекла (можем заменить)."},
+        })
+        steps.append({
+            "type": "info",
+            "key": "glass_chips_tip",
+            "when": {"glass_has_chips": "Да"},  # only shown for chipped glass
+            "text": (
+                "Важно: если есть **сколы/трещины**, то **шлифовка/полировка не делается** — нужна **замена стекла**.\n"
+                "Мы можем заменить — оставьте заявку, менеджер всё подскажет."
+            ),
+        })
+        steps.append({
+            "type": "photos",
+            "key": "glass_polish_photos",
+            "text": f"**{label}**\nСфотографируй стекло под углом к свету, чтобы были видны следы и царапины.",
+        })
+
+    elif svc == "interior":
+        steps.append({
+            "type": "choice",
+            "key": "interior_type",
+            "card": "Что нужно",
+            "text": f"**{label}**\nЧто именно нужно по салону?",
+            "options": ["Экспресс уборка", "Полная химчистка салона", "Чистка кожи + пропитка", "Не знаю, посоветуй"],
+        })
+        steps.append({
+            "type": "photos",
+            "key": "interior_photos",
+            "text": f"**{label}**\nСфотографируй сиденья и самые грязные места салона.",
+        })
+
+    elif svc == "engine_wash":
+        steps.append({
+            "type": "yesno",
+            "key": "engine_recent",
+            "card": "Делали ранее",
+            "text": f"**{label}**\nМойку мотора делали ранее?",
+            "kb_prefix": "engine_prev",
+        })
+        steps.append({
+            "type": "info",
+            "key": "engine_tip",
+            "text": "Совет: делаем аккуратно + консервация — это защищает разъёмы и резинки, моторный отсек выглядит аккуратно дольше.",
+        })
+    return steps
+
+# -------------------- CATALOG --------------------
+class Catalog:
+    """The services one studio offers, with their flows built up front.
+
+    Without `flows` the built-in questions are used; hotreload.py builds
+    catalogues from a file and gives each a `version`."""
+
+    def __init__(self, services, flows=None, toning_areas=TONING_AREAS, toning_percents=TONING_PERCENTS,
+                 upsells=UPSELLS, scoring=SCORING, version="builtin"):
+        self.services = tuple((key, label) for key, label in services)
+        self.labels = dict(self.services)
+        self.bits = {key: 1 << i for i, (key, _) in enumerate(self.services)}
+        if flows is None:
+            flows = {key: _service_steps(key, label) for key, label in self.services}
+        self.flows = {key: tuple(flows.get(key, ())) for key, _ in self.services}
+        # the card lines of each flow as (answer key, line prefix, {answer: note line})
+        self.card_steps = {
+            key: tuple(
+                (step["key"], f"   - {step['card']}: ",
+                 {answer: "   - " + note for answer, note in step.get("card_notes", {}).items()})
+                for step in flow if "card" in step
+            )
+            for key, flow in self.flows.items()
+        }
+        self.toning_areas = tuple((key, label) for key, label in toning_areas)
+        self.area_bits = {key: 1 << i for i, (key, _) in enumerate(self.toning_areas)}
+        self.toning_percents = tuple(toning_percents)
+        self.upsells = tuple(upsells)
+        # compute_upsells runs per form: rules for services this studio does
+        # not do are dropped here, the rest kept as tuples with a ready offer
+        self._upsell_rules = tuple(
+            (r["if"], r["service"], tuple(r.get("unless_answer", {}).items()),
+             {"service": r["service"], "title": r["title"], "reason": r["reason"]})
+            for r in self.upsells if r["service"] in self.labels
+        )
+        self.scoring = scoring
+        self.version = version
+        self._flow_cache = {}
+
+    @classmethod
+    def from_spec(cls, spec):
+        """spec: service keys and/or [key, label] pairs; a bare key keeps the default label."""
+        services = []
+        for item in spec:
+            if isinstance(item, str):
+                if item not in SERVICE_LABEL:
+                    raise ValueError(f"unknown service {item!r}")
+                services.append((item, SERVICE_LABEL[item]))
+            else:
+                key, label = item
+                services.append((key, label))
+        return cls(services)
+
+    def ordered(self, selected):
+        return [key for key, _ in self.services if key in selected]
+
+    def keys_of(self, mask):
+        """Service keys of a LeadDraft bitmask, in catalogue order."""
+        return [key for key, _ in self.services if mask & self.bits[key]]
+
+    def build_flow(self, selected_services):
+        # one shared tuple per selection, so sessions only keep an index into it
+        key = tuple(selected_services)
+        flow = self._flow_cache.get(key)
+        if flow is None:
+            steps = [step for svc in key for step in self.flows.get(svc, ())]
+            flow = self._flow_cache[key] = tuple(
+                [s for s in steps if s["type"] != "photos"] + [s for s in steps if s["type"] == "photos"]
+            )
+        return flow
+
+    def answers_by_service(self, selected, answers):
+        """Split the flat answers dict into {service_key: {question_key: answer}}."""
+        out = {}
+        for svc in selected:
+            keys = [step["key"] for step in self.flows.get(svc, ()) if step["type"] != "info"]
+            out[svc] = {k: answers[k] for k in keys if k in answers}
+        return out
+
+    def area_keys(self, mask):
+        return [key for key, _ in self.toning_areas if mask & self.area_bits[key]]
+
+    def area_labels(self, mask):
+        return [label for key, label in self.toning_areas if mask & self.area_bits[key]]
+
+    def lead_temperature(self, data):
+        return lead_temperature(data, self.scoring)
+
+    def compute_upsells(self, user_data):
+        """Offers for a form, like compute_upsells(); the dicts are shared, do not change them."""
+        selected = user_data.get("services_selected", ())
+        ans = user_data.get("services_answers") or {}
+        upsells = []
+        for if_service, service, unless, offer in self._upsell_rules:
+            if if_service not in selected or service in selected:
+                continue
+            for k, v in unless:
+                if ans.get(k) == v:
+                    break
+            else:
+                upsells.append(offer)
+        return upsells
+
+DEFAULT_CATALOG = Catalog(SERVICES)
+SERVICE_FLOWS = DEFAULT_CATALOG.flows
+
+def build_service_flow(selected_services):
+    return DEFAULT_CATALOG.build_flow(selected_services)
@@ -1,21 +1,87 @@
 import os
 from dataclasses import dataclass
+
 from dotenv import load_dotenv
 
 load_dotenv()
 
+DEFAULT_MANAGER_ID = 327140660
+DEFAULT_WORKS_CHANNEL_URL = "https://t.me/+7nQ-MkqFk_BmZTZi"
+DEFAULT_API_BASE_URL = "https://api.telegram.org/bot"
+DEFAULT_STUDIO_NAME = "RKS studio"
+
 @dataclass(frozen=True)
 class Config:
     bot_token: str
-    manager_password: str
+    manager_ids: tuple[int, ...]
+    port: int
+    works_channel_url: str
+    studio_name: str
+    db_path: str
+    api_base_url: str
+    workers: int
+    tenants_file: str
+    archive_dir: str
+    archive_after_days: int
+    backup_dir: str
+    backup_every_hours: float
+    backup_keep: int
+    trace: bool
+    session_timeout_min: float
+    session_nudge: bool
+    sessions_in_memory: int
+    record_updates: str
+    crm_url: str
+    crm_token: str
+    crm_batch: int
+    crm_interval_sec: float
+    assign_mode: str
+    catalog_file: str
+    catalog_poll_sec: float
+    broadcast_rate: float
+    api_pool_size: int
+    api_keepalive_sec: float
+    api_http2: bool
+
+def parse_ids(value: str) -> tuple[int, ...]:
+    # MANAGER_ID may list several managers: "111,222"
+    return tuple(int(x) for x in value.replace(" ", "").split(",") if x)
 
 def load_config() -> Config:
     token = os.getenv("BOT_TOKEN", "").strip()
-    pwd = os.getenv("MANAGER_PASSWORD", "").strip()
-
-    if not token:
-        raise RuntimeError("BOT_TOKEN is missing in environment variables")
-    if not pwd:
-        raise RuntimeError("MANAGER_PASSWORD is missing in environment variables")
+    tenants_file = os.getenv("TENANTS_FILE", "").strip()
+    if not token and not tenants_file:
+        raise RuntimeError("BOT_TOKEN not set")
 
-    return Config(bot_token=token, manager_password=pwd)
\ No newline at end of file
+    return Config(
+        bot_token=token,
+        manager_ids=parse_ids(os.getenv("MANAGER_ID", str(DEFAULT_MANAGER_ID))),
+        port=int(os.getenv("PORT", "10000")),  # Render Web Service needs an open port
+        works_channel_url=os.getenv("WORKS_CHANNEL_URL", DEFAULT_WORKS_CHANNEL_URL),
+        studio_name=os.getenv("STUDIO_NAME", DEFAULT_STUDIO_NAME),  # in the manager card header
+        db_path=os.getenv("DB_PATH", "rks.db"),
+        api_base_url=os.getenv("BOT_API_BASE_URL", DEFAULT_API_BASE_URL),
+        workers=max(1, int(os.getenv("WORKERS", "1"))),  # >1 enables sharded mode
+        tenants_file=tenants_file,  # set -> host every studio from that file
+        archive_dir=os.getenv("ARCHIVE_DIR", "archive"),
+        archive_after_days=int(os.getenv("ARCHIVE_AFTER_DAYS", "180")),  # 0 disables archival
+        backup_dir=os.getenv("BACKUP_DIR", "backups"),
+        backup_every_hours=float(os.getenv("BACKUP_EVERY_HOURS", "6")),  # 0 disables backups
+        backup_keep=int(os.getenv("BACKUP_KEEP", "7")),
+        trace=os.getenv("TRACE", "") == "1",  # per-update span logs (also on during /profile)
+        session_timeout_min=float(os.getenv("SESSION_TIMEOUT_MIN", "30")),  # 0 keeps forms open forever
+        session_nudge=os.getenv("SESSION_NUDGE", "1") == "1",  # offer to continue when a form times out
+        sessions_in_memory=int(os.getenv("SESSIONS_IN_MEMORY", "1000")),  # the rest are spilled to the DB
+        record_updates=os.getenv("RECORD_UPDATES", ""),  # JSONL path; see replay.py
+        crm_url=os.getenv("CRM_URL", "").strip(),  # empty disables the CRM sync; see crm.py
+        crm_token=os.getenv("CRM_TOKEN", "").strip(),
+        crm_batch=max(1, int(os.getenv("CRM_BATCH", "50"))),
+        crm_interval_sec=float(os.getenv("CRM_INTERVAL_SEC", "30")),  # idle poll; new leads wake it sooner
+        assign_mode=os.getenv("ASSIGN_MODE", "").strip(),  # "", round_robin or least_open; see assign.py
+        catalog_file=os.getenv("CATALOG_FILE", "").strip(),  # JSON catalogue, reloaded on change; see hotreload.py
+        catalog_poll_sec=float(os.getenv("CATALOG_POLL_SEC", "5")),
+        broadcast_rate=float(os.getenv("BROADCAST_RATE", "25")),  # messages/s; Telegram allows ~30; see broadcast.py
+        api_pool_size=max(1, int(os.getenv("API_POOL_SIZE", "256"))),  # Bot API connections, getUpdates has its own
+        api_keepalive_sec=float(os.getenv("API_KEEPALIVE_SEC", "60")),
+        api_http2=os.getenv("API_HTTP2", "") == "1",  # needs httpx[http2]; see transport.py
+    )
@@ -0,0 +1,236 @@
+"""
+Pushes saved leads to the studio's CRM.
+
+The conversation only ever writes the lead to SQLite; this runs next to it
+as a background task (started by jobs.start_jobs when CRM_URL is set) and
+sends every lead with an id above the stored cursor to the CRM endpoint in
+batches of CRM_BATCH, oldest first:
+
+    POST CRM_URL
+    Authorization: Bearer CRM_TOKEN
+    Idempotency-Key: <hash of the external ids in the batch>
+    {"leads": [{"external_id": "rks-lead-42", "name": ..., "services": {...}}, ...]}
+
+Every lead carries a stable external_id, so a batch that is sent again
+after a timeout (the CRM may have stored it) updates rather than duplicates
+on any CRM that dedupes by external id, which is what amoCRM/Bitrix
+integrations key on. The cursor moves only after a 2xx and lives in the
+sync_cursors table, so a restart or a CRM outage resumes where it stopped.
+Timeouts, connection errors, 408/429 and 5xx are retried with exponential
+backoff (Retry-After is honoured); any other 4xx means the CRM will never
+take that batch, so it is logged with its lead ids and skipped.
+
+One httpx client with a small keep-alive pool is used for the life of the
+task. handlers.send_lead_to_manager only calls wake(), which sets an event.
+In sharded mode the sync runs in worker 0 only, so leads saved by other
+workers are picked up on its next poll (CRM_INTERVAL_SEC).
+
+    python crm.py status
+    python crm.py push                 # send everything pending now and exit
+    python crm.py reset --to 0         # resend from the start
+"""
+import os
+import json
+import random
+import asyncio
+import hashlib
+import logging
+import argparse
+
+import db
+
+logger = logging.getLogger("rks_bot.crm")
+
+CURSOR = "crm"
+BACKOFF_BASE_SEC = 2
+BACKOFF_MAX_SEC = 600
+TIMEOUT_SEC = 15
+
+
+class CrmUnavailable(Exception):
+    """The CRM may take the batch later; retry it."""
+
+    def __init__(self, reason, retry_after=None):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+def _prefix(db_path):
+    return os.path.splitext(os.path.basename(db_path))[0] + "-lead-"
+
+def to_crm(lead, prefix):
+    """CRM payload for one leads row (with "services" from db.leads_after)."""
+    return {
+        "external_id": prefix + str(lead["id"]),
+        "created_at": lead["created_at"],
+        "name": lead["name"],
+        "phone": lead["phone"],
+        "car": lead["car"],
+        "services": lead["services"],
+        "ready_time": lead["ready_time"],
+        "lead_temp": lead["lead_temp"],
+        "contact_method": lead["contact_method"],
+        "telegram": {"user_id": lead["tg_user_id"], "username": lead["tg_username"]},
+        "source": lead["source"],
+    }
+
+def idempotency_key(payload):
+    ids = ",".join(item["external_id"] for item in payload)
+    return hashlib.sha256(ids.encode("utf-8")).hexdigest()[:32]
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+
+class CrmSync:
+    def __init__(self, url, db_path, token="", batch=50, interval=30.0):
+        self.url = url
+        self.db_path = db_path
+        self.token = token
+        self.batch = batch
+        self.interval = interval
+        self.prefix = _prefix(db_path)
+        self.sent = 0
+        self.skipped = 0
+        self._wake = asyncio.Event()
+        self._client = None
+
+    def wake(self):
+        self._wake.set()
+
+    def _http(self):
+        if self._client is None:
+            import httpx
+
+            headers = {"Authorization": "Bearer " + self.token} if self.token else {}
+            self._client = httpx.AsyncClient(
+                headers=headers,
+                timeout=httpx.Timeout(TIMEOUT_SEC, connect=5),
+                limits=httpx.Limits(max_connections=2, max_keepalive_connections=2, keepalive_expiry=120),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _post(self, payload):
+        """True when the CRM stored the batch, False when it refused it for good."""
+        import httpx
+
+        try:
+            response = await self._http().post(
+                self.url, json={"leads": payload},
+                headers={"Idempotency-Key": idempotency_key(payload)},
+            )
+        except httpx.TransportError as e:
+            raise CrmUnavailable(f"{type(e).__name__}: {e}") from None
+        if response.is_success:
+            return True
+        if response.status_code in (408, 429) or response.status_code >= 500:
+            raise CrmUnavailable(f"HTTP {response.status_code}", _retry_after(response))
+        logger.error(
+            "CRM rejected leads, skipped",
+            extra={"status": response.status_code, "body": response.text[:500],
+                   "external_ids": [item["external_id"] for item in payload]},
+        )
+        return False
+
+    async def push_pending(self):
+        """Send batches until nothing is left. Returns the number of leads sent."""
+        sent = 0
+        while True:
+            # the cursor is read again every batch: import_leads.py may move it
+            leads = await db.writer.run(self.db_path, db.leads_after_cursor, CURSOR, self.batch)
+            if not leads:
+                return sent
+            payload = [to_crm(lead, self.prefix) for lead in leads]
+            if await self._post(payload):
+                sent += len(leads)
+                self.sent += len(leads)
+            else:
+                self.skipped += len(leads)
+            await db.writer.run(self.db_path, db.set_cursor, CURSOR, leads[-1]["id"])
+
+    async def run(self):
+        failures = 0
+        try:
+            while True:
+                self._wake.clear()
+                try:
+                    sent = await self.push_pending()
+                except Exception as e:
+                    failures += 1
+                    delay = min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * 2 ** (failures - 1))
+                    delay = getattr(e, "retry_after", None) or delay * random.uniform(0.5, 1.0)
+                    if isinstance(e, CrmUnavailable):
+                        logger.warning("CRM unavailable, retry in %.0f s: %s", delay, e)
+                    else:
+                        logger.exception("CRM sync failed, retry in %.0f s", delay)
+                    await asyncio.sleep(delay)
+                    continue
+                if sent:
+                    logger.info("Leads pushed to CRM", extra={"sent": sent})
+                failures = 0
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await self.close()
+
+
+def _status(db_path):
+    conn = db._connect(db_path)
+    try:
+        cursor = db.get_cursor(conn, CURSOR)
+        return {"cursor": cursor, "pending": db.count_leads_after(conn, cursor)}
+    finally:
+        conn.close()
+
+def _reset(db_path, last_id):
+    conn = db._connect(db_path)
+    try:
+        with conn:
+            db.set_cursor(conn, CURSOR, last_id)
+    finally:
+        conn.close()
+
+async def _push(sync):
+    try:
+        return await sync.push_pending()
+    finally:
+        await sync.close()
+        db.writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CRM sync tools")
+    parser.add_argument("--db", default=os.getenv("DB_PATH", "rks.db"))
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("status", help="show the cursor and how many leads are waiting")
+    sub.add_parser("push", help="send everything pending to CRM_URL now")
+    reset = sub.add_parser("reset", help="move the cursor (leads after it are sent again)")
+    reset.add_argument("--to", type=int, required=True, help="last lead id the CRM already has")
+    args = parser.parse_args()
+
+    db.init_db(args.db)
+    if args.cmd == "status":
+        print(json.dumps(_status(args.db)))
+    elif args.cmd == "reset":
+        _reset(args.db, args.to)
+        print(json.dumps(_status(args.db)))
+    else:
+        url = os.getenv("CRM_URL", "").strip()
+        if not url:
+            parser.error("CRM_URL is not set")
+        sync = CrmSync(url, args.db, os.getenv("CRM_TOKEN", "").strip(), int(os.getenv("CRM_BATCH", "50")))
+        print(json.dumps({"sent": asyncio.run(_push(sync)), "skipped": sync.skipped}))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,28 @@
+import json
+import time
+import asyncio
 import sqlite3
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
 
 DB_PATH = "rks.db"
 
-def init_db() -> None:
-    conn = sqlite3.connect(DB_PATH)
+def _connect(db_path: str | None = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path or DB_PATH)
+    # off by default in SQLite and per connection: without it the
+    # lead_services ON DELETE CASCADE never fires
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+def init_db(db_path: str | None = None) -> None:
+    conn = _connect(db_path)
+    # only takes effect on a new, empty file; migration 11 covers older ones
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # WAL: readers (exports, online backups) never block the writer
+    conn.execute("PRAGMA journal_mode=WAL")
     cur = conn.cursor()
 
     cur.execute("""
@@ -38,19 +55,215 @@ def init_db() -> None:
     """)
 
     conn.commit()
+    migrate(conn)
     conn.close()
 
-def save_lead(data: Dict[str, Any]) -> int:
-    conn = sqlite3.connect(DB_PATH)
+# -------------------- MIGRATIONS --------------------
+# init_db() creates the original schema (version 0); every later change is
+# a function appended to MIGRATIONS. PRAGMA user_version stores how many of
+# them a database file has seen, so each runs exactly once, in order, inside
+# its own transaction (unless it sets transaction = False).
+
+def _m1_lead_indexes(conn: sqlite3.Connection) -> None:
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_leads_created_at ON leads(created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_leads_tg_user_id ON leads(tg_user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_leads_phone ON leads(phone)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_leads_lead_temp ON leads(lead_temp)")
+
+def _m2_lead_services(conn: sqlite3.Connection) -> None:
+    # created_at is copied from the lead so that "leads for X in a date range"
+    # is answered from the index alone
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS lead_services (
+        lead_id INTEGER NOT NULL REFERENCES leads(id) ON DELETE CASCADE,
+        service_key TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        answers TEXT,
+        PRIMARY KEY (lead_id, service_key)
+    )
+    """)
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_lead_services_key_created
+    ON lead_services(service_key, created_at, lead_id)
+    """)
+
+    # backfill from the old comma-separated column
+    rows = conn.execute(
+        "SELECT id, created_at, services_interest FROM leads WHERE services_interest IS NOT NULL"
+    ).fetchall()
+    conn.executemany(
+        "INSERT OR IGNORE INTO lead_services (lead_id, service_key, created_at) VALUES (?, ?, ?)",
+        [
+            (lead_id, key.strip(), created_at)
+            for lead_id, created_at, interest in rows
+            for key in interest.split(",")
+            if key.strip()
+        ],
+    )
+
+def _m3_sessions(conn: sqlite3.Connection) -> None:
+    # conversation data evicted from memory (see sessions.SessionStore)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sessions (
+        user_id INTEGER PRIMARY KEY,
+        updated_at REAL NOT NULL,
+        data BLOB NOT NULL
+    )
+    """)
+
+def _m4_sync_cursors(conn: sqlite3.Connection) -> None:
+    # how far each outbound sync (see crm.py) has got, by lead id
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sync_cursors (
+        name TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    """)
+
+def _m5_message_links(conn: sqlite3.Connection) -> None:
+    # bot messages in manager chats (lead cards, relayed client messages)
+    # and the lead / client chat they belong to; see bridge.py
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS message_links (
+        chat_id INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        lead_id INTEGER,
+        client_chat_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (chat_id, message_id)
+    )
+    """)
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_message_links_client
+    ON message_links(client_chat_id, kind, created_at)
+    """)
+
+def _m6_lead_owner(conn: sqlite3.Connection) -> None:
+    # which manager works the lead (claimed by button or auto-assigned)
+    conn.execute("ALTER TABLE leads ADD COLUMN assigned_to INTEGER")
+    conn.execute("ALTER TABLE leads ADD COLUMN claimed_at TEXT")
+    conn.execute("ALTER TABLE leads ADD COLUMN closed_at TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_leads_open ON leads(assigned_to, closed_at)")
+
+def _m7_broadcasts(conn: sqlite3.Connection) -> None:
+    # manager broadcasts to past clients (see broadcast.py); recipients go in
+    # ascending tg_user_id and last_user_id is how far a campaign has got
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at TEXT NOT NULL,
+        created_by INTEGER NOT NULL,
+        service_key TEXT,
+        text TEXT NOT NULL,
+        status TEXT NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        last_user_id INTEGER NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0,
+        blocked INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        runner TEXT,
+        lease_until REAL NOT NULL DEFAULT 0,
+        stats_chat_id INTEGER,
+        stats_message_id INTEGER,
+        finished_at TEXT
+    )
+    """)
+    # clients the bot can no longer write to (Telegram answered 403)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS blocked_users (
+        user_id INTEGER PRIMARY KEY,
+        blocked_at TEXT NOT NULL
+    )
+    """)
+
+def _m8_lead_photos(conn: sqlite3.Connection) -> None:
+    # JSON list of Telegram file_ids from the form's photo step; the images
+    # themselves are never downloaded
+    conn.execute("ALTER TABLE leads ADD COLUMN photos TEXT")
+
+def _m9_archived_clients(conn: sqlite3.Connection) -> None:
+    # who the leads moved out by archive.py came from, so broadcasts still
+    # reach last season's clients: one row per client and service asked
+    # for, plus one with service_key '' for every client
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS archived_clients (
+        service_key TEXT NOT NULL,
+        tg_user_id INTEGER NOT NULL,
+        PRIMARY KEY (service_key, tg_user_id)
+    ) WITHOUT ROWID
+    """)
+
+def _m10_archived_phones(conn: sqlite3.Connection) -> None:
+    # phone and day of every archived lead, so import_leads.py finds
+    # duplicates of leads that are no longer in the leads table
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS archived_phones (
+        phone TEXT NOT NULL,
+        day TEXT NOT NULL,
+        PRIMARY KEY (phone, day)
+    ) WITHOUT ROWID
+    """)
+
+def _m11_incremental_vacuum(conn: sqlite3.Connection) -> None:
+    # archive.py hands freed pages back with PRAGMA incremental_vacuum, which
+    # needs auto_vacuum; once a file has tables only a full VACUUM switches
+    # it on, so this runs here, at startup, and not under the bot's writes
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.execute("VACUUM")
+
+_m11_incremental_vacuum.transaction = False  # VACUUM cannot run inside one
+
+MIGRATIONS: List[Callable[[sqlite3.Connection], None]] = [
+    _m1_lead_indexes,
+    _m2_lead_services,
+    _m3_sessions,
+    _m4_sync_cursors,
+    _m5_message_links,
+    _m6_lead_owner,
+    _m7_broadcasts,
+    _m8_lead_photos,
+    _m9_archived_clients,
+    _m10_archived_phones,
+    _m11_incremental_vacuum,
+]
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn: sqlite3.Connection) -> int:
+    version = schema_version(conn)
+    for target, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        if not getattr(step, "transaction", True):
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+            version = target
+            continue
+        conn.execute("BEGIN")
+        try:
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        version = target
+    return version
+
+# -------------------- LEADS --------------------
+def insert_lead(conn: sqlite3.Connection, data: Dict[str, Any]) -> int:
+    created_at = data.get("created_at") or datetime.utcnow().isoformat()
     cur = conn.cursor()
     cur.execute("""
     INSERT INTO leads (
         created_at, tg_user_id, tg_username, name, phone, car,
         segment_trigger, pain_main, services_interest, ready_time,
-        lead_temp, contact_method, comment_free, source
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        lead_temp, contact_method, comment_free, source, photos
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """, (
-        data.get("created_at") or datetime.utcnow().isoformat(),
+        created_at,
         data["tg_user_id"],
         data.get("tg_username"),
         data.get("name"),
@@ -64,14 +277,83 @@ def save_lead(data: Dict[str, Any]) -> int:
         data.get("contact_method"),
         data.get("comment_free"),
         data.get("source"),
+        json.dumps(data["photos"]) if data.get("photos") else None,
     ))
-    conn.commit()
     lead_id = cur.lastrowid
+    # a new lead means the client talks to the bot again
+    cur.execute("DELETE FROM blocked_users WHERE user_id = ?", (data["tg_user_id"],))
+
+    # data["services"]: {service_key: {question_key: answer}}
+    services = data.get("services") or {}
+    cur.executemany(
+        "INSERT INTO lead_services (lead_id, service_key, created_at, answers) VALUES (?, ?, ?, ?)",
+        [
+            (lead_id, key, created_at, json.dumps(answers, ensure_ascii=False) if answers else None)
+            for key, answers in services.items()
+        ],
+    )
+    return lead_id
+
+def save_lead(data: Dict[str, Any], db_path: str | None = None) -> int:
+    conn = _connect(db_path)
+    lead_id = insert_lead(conn, data)
+    conn.commit()
     conn.close()
     return lead_id
 
-def add_manager(tg_user_id: int, tg_username: str | None, name: str | None) -> None:
-    conn = sqlite3.connect(DB_PATH)
+def leads_for_service(
+    service_key: str, since: str, until: str | None = None, db_path: str | None = None
+) -> List[dict]:
+    """Leads that asked for `service_key` with since <= created_at < until (ISO strings).
+
+    Only the hot table: archive.iter_leads(..., service=...) also reads the
+    leads archive.py has moved out."""
+    conn = _connect(db_path)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute("""
+    SELECT l.*, s.answers AS service_answers
+    FROM lead_services s JOIN leads l ON l.id = s.lead_id
+    WHERE s.service_key = ? AND s.created_at >= ? AND s.created_at < ?
+    ORDER BY s.created_at
+    """, (service_key, since, until or "9999")).fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def claim_lead(conn: sqlite3.Connection, lead_id: int, manager_id: int) -> int | None:
+    """Give the lead to manager_id unless someone has it already. Returns the
+    owner after the call (manager_id when the claim won), None if no such lead."""
+    cur = conn.execute(
+        "UPDATE leads SET assigned_to = ?, claimed_at = ? WHERE id = ? AND assigned_to IS NULL",
+        (manager_id, datetime.utcnow().isoformat(), lead_id),
+    )
+    if cur.rowcount:
+        return manager_id
+    row = conn.execute("SELECT assigned_to FROM leads WHERE id = ?", (lead_id,)).fetchone()
+    return row[0] if row else None
+
+def close_lead(conn: sqlite3.Connection, lead_id: int, manager_id: int) -> bool:
+    """Only the owner closes, and only once."""
+    return conn.execute(
+        "UPDATE leads SET closed_at = ? WHERE id = ? AND assigned_to = ? AND closed_at IS NULL",
+        (datetime.utcnow().isoformat(), lead_id, manager_id),
+    ).rowcount == 1
+
+def assignment_state(db_path: str | None = None) -> tuple[Dict[int, int], int | None]:
+    """Open (claimed, not closed) leads per manager and the manager who got the latest lead."""
+    conn = _connect(db_path)
+    counts = dict(conn.execute(
+        "SELECT assigned_to, COUNT(*) FROM leads "
+        "WHERE assigned_to IS NOT NULL AND closed_at IS NULL GROUP BY assigned_to"
+    ).fetchall())
+    row = conn.execute(
+        "SELECT assigned_to FROM leads WHERE assigned_to IS NOT NULL ORDER BY claimed_at DESC LIMIT 1"
+    ).fetchone()
+    conn.close()
+    return counts, row[0] if row else None
+
+# -------------------- MANAGERS --------------------
+def add_manager(tg_user_id: int, tg_username: str | None, name: str | None, db_path: str | None = None) -> None:
+    conn = _connect(db_path)
     cur = conn.cursor()
     cur.execute("""
     INSERT OR REPLACE INTO managers (tg_user_id, tg_username, name, added_at)
@@ -80,15 +362,15 @@ def add_manager(tg_user_id: int, tg_username: str | None, name: str | None) -> N
     conn.commit()
     conn.close()
 
-def remove_manager(tg_user_id: int) -> None:
-    conn = sqlite3.connect(DB_PATH)
+def remove_manager(tg_user_id: int, db_path: str | None = None) -> None:
+    conn = _connect(db_path)
     cur = conn.cursor()
     cur.execute("DELETE FROM managers WHERE tg_user_id = ?", (tg_user_id,))
     conn.commit()
     conn.close()
 
-def list_managers() -> List[dict]:
-    conn = sqlite3.connect(DB_PATH)
+def list_managers(db_path: str | None = None) -> List[dict]:
+    conn = _connect(db_path)
     cur = conn.cursor()
     cur.execute("SELECT tg_user_id, tg_username, name, added_at FROM managers ORDER BY added_at DESC")
     rows = cur.fetchall()
@@ -104,10 +386,251 @@ def list_managers() -> List[dict]:
         })
     return out
 
-def list_manager_ids() -> List[int]:
-    conn = sqlite3.connect(DB_PATH)
+def list_manager_ids(db_path: str | None = None) -> List[int]:
+    conn = _connect(db_path)
     cur = conn.cursor()
     cur.execute("SELECT tg_user_id FROM managers")
     rows = cur.fetchall()
     conn.close()
-    return [int(r[0]) for r in rows]
\ No newline at end of file
+    return [int(r[0]) for r in rows]
+
+# -------------------- SESSIONS --------------------
+def put_sessions(conn: sqlite3.Connection, items: List[tuple]) -> None:
+    now = time.time()
+    conn.executemany(
+        "INSERT OR REPLACE INTO sessions (user_id, updated_at, data) VALUES (?, ?, ?)",
+        [(user_id, now, data) for user_id, data in items],
+    )
+
+def take_session(conn: sqlite3.Connection, user_id: int) -> bytes | None:
+    row = conn.execute("SELECT data FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+    if row is None:
+        return None
+    conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+    return row[0]
+
+def delete_session(conn: sqlite3.Connection, user_id: int) -> None:
+    conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+def purge_sessions(conn: sqlite3.Connection, older_than: float) -> int:
+    return conn.execute("DELETE FROM sessions WHERE updated_at < ?", (older_than,)).rowcount
+
+def session_ids(conn: sqlite3.Connection, older_than: float | None = None) -> List[int]:
+    if older_than is not None:
+        purge_sessions(conn, older_than)
+    return [r[0] for r in conn.execute("SELECT user_id FROM sessions")]
+
+# -------------------- SYNC CURSORS --------------------
+def get_cursor(conn: sqlite3.Connection, name: str) -> int:
+    row = conn.execute("SELECT last_id FROM sync_cursors WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+def set_cursor(conn: sqlite3.Connection, name: str, last_id: int) -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO sync_cursors (name, last_id, updated_at) VALUES (?, ?, ?)",
+        (name, last_id, time.time()),
+    )
+
+def leads_after(conn: sqlite3.Connection, last_id: int, limit: int) -> List[dict]:
+    """Up to `limit` leads with id > last_id, oldest first, each with its
+    "services" mapping ({service_key: {question_key: answer}})."""
+    cur = conn.cursor()
+    cur.row_factory = sqlite3.Row
+    leads = [dict(r) for r in cur.execute(
+        "SELECT * FROM leads WHERE id > ? ORDER BY id LIMIT ?", (last_id, limit),
+    ).fetchall()]
+    if not leads:
+        return leads
+    by_id = {lead["id"]: lead for lead in leads}
+    for lead in leads:
+        lead["services"] = {}
+    for lead_id, key, answers in conn.execute(
+        "SELECT lead_id, service_key, answers FROM lead_services WHERE lead_id BETWEEN ? AND ?",
+        (leads[0]["id"], leads[-1]["id"]),
+    ):
+        if lead_id in by_id:
+            by_id[lead_id]["services"][key] = json.loads(answers) if answers else {}
+    return leads
+
+def leads_after_cursor(conn: sqlite3.Connection, name: str, limit: int) -> List[dict]:
+    """leads_after() the cursor `name`, both read in one snapshot: a cursor
+    that import_leads.py moves past its leads is never read stale."""
+    conn.execute("BEGIN")  # the writer's `with conn` ends it
+    return leads_after(conn, get_cursor(conn, name), limit)
+
+def count_leads_after(conn: sqlite3.Connection, last_id: int) -> int:
+    return conn.execute("SELECT COUNT(*) FROM leads WHERE id > ?", (last_id,)).fetchone()[0]
+
+# -------------------- MESSAGE LINKS --------------------
+def add_message_links(conn: sqlite3.Connection, links: List[tuple]) -> None:
+    """links: (chat_id, message_id, lead_id, client_chat_id, kind) tuples."""
+    now = time.time()
+    conn.executemany(
+        "INSERT OR REPLACE INTO message_links VALUES (?, ?, ?, ?, ?, ?)",
+        [link + (now,) for link in links],
+    )
+
+def get_message_link(conn: sqlite3.Connection, chat_id: int, message_id: int) -> tuple | None:
+    """(lead_id, client_chat_id) of a linked message, or None."""
+    return conn.execute(
+        "SELECT lead_id, client_chat_id FROM message_links WHERE chat_id = ? AND message_id = ?",
+        (chat_id, message_id),
+    ).fetchone()
+
+def latest_cards(conn: sqlite3.Connection, client_chat_id: int) -> List[tuple]:
+    """(lead_id, chat_id, message_id) of every card sent for the client's most recent lead."""
+    return conn.execute("""
+    SELECT lead_id, chat_id, message_id FROM message_links
+    WHERE client_chat_id = ? AND kind = 'card' AND lead_id IS (
+        SELECT lead_id FROM message_links
+        WHERE client_chat_id = ? AND kind = 'card'
+        ORDER BY created_at DESC LIMIT 1
+    )
+    """, (client_chat_id, client_chat_id)).fetchall()
+
+def lead_cards(conn: sqlite3.Connection, lead_id: int) -> List[tuple]:
+    """(chat_id, message_id) of the cards sent for a lead."""
+    return conn.execute(
+        "SELECT chat_id, message_id FROM message_links WHERE lead_id = ? AND kind = 'card'", (lead_id,),
+    ).fetchall()
+
+# -------------------- BROADCASTS --------------------
+def _recipients_sql(service_key: str | None) -> str:
+    # clients of the hot table and of the archive (see archive.py)
+    if service_key is None:
+        hot = "SELECT l.tg_user_id FROM leads l WHERE l.tg_user_id > :after"
+    else:
+        hot = """SELECT l.tg_user_id FROM lead_services s JOIN leads l ON l.id = s.lead_id
+        WHERE s.service_key = :service AND l.tg_user_id > :after"""
+    return f"""
+    FROM ({hot}
+          UNION
+          SELECT tg_user_id FROM archived_clients
+          WHERE service_key = coalesce(:service, '') AND tg_user_id > :after) r
+    WHERE r.tg_user_id NOT IN (SELECT user_id FROM blocked_users)
+    """
+
+def broadcast_recipients(conn: sqlite3.Connection, service_key: str | None, after: int, limit: int) -> List[int]:
+    """Next `limit` distinct client ids above `after` (optionally only those who
+    asked for service_key), archived clients included, skipping clients who
+    blocked the bot."""
+    rows = conn.execute(
+        "SELECT r.tg_user_id" + _recipients_sql(service_key) + "ORDER BY r.tg_user_id LIMIT :limit",
+        {"service": service_key, "after": after, "limit": limit},
+    ).fetchall()
+    return [r[0] for r in rows]
+
+def count_broadcast_recipients(conn: sqlite3.Connection, service_key: str | None, after: int = 0) -> int:
+    return conn.execute(
+        "SELECT COUNT(*)" + _recipients_sql(service_key),
+        {"service": service_key, "after": after},
+    ).fetchone()[0]
+
+def mark_blocked(conn: sqlite3.Connection, user_id: int) -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO blocked_users (user_id, blocked_at) VALUES (?, ?)",
+        (user_id, datetime.utcnow().isoformat()),
+    )
+
+def create_broadcast(conn: sqlite3.Connection, created_by: int, service_key: str | None, text: str) -> int:
+    total = count_broadcast_recipients(conn, service_key)
+    return conn.execute(
+        "INSERT INTO broadcasts (created_at, created_by, service_key, text, status, total) "
+        "VALUES (?, ?, ?, ?, 'draft', ?)",
+        (datetime.utcnow().isoformat(), created_by, service_key, text, total),
+    ).lastrowid
+
+def get_broadcast(conn: sqlite3.Connection, broadcast_id: int) -> dict | None:
+    cur = conn.cursor()
+    cur.row_factory = sqlite3.Row
+    row = cur.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+    return dict(row) if row else None
+
+def latest_broadcast(conn: sqlite3.Connection, statuses: tuple | None = None) -> dict | None:
+    where = f"WHERE status IN ({', '.join('?' * len(statuses))})" if statuses else ""
+    row = conn.execute(f"SELECT id FROM broadcasts {where} ORDER BY id DESC LIMIT 1", statuses or ()).fetchone()
+    return get_broadcast(conn, row[0]) if row else None
+
+def running_broadcasts(conn: sqlite3.Connection) -> List[int]:
+    return [r[0] for r in conn.execute("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id")]
+
+def set_broadcast_status(conn: sqlite3.Connection, broadcast_id: int, status: str, allowed_from: tuple) -> bool:
+    """Move a broadcast to `status` if it is in one of allowed_from now."""
+    marks = ", ".join("?" * len(allowed_from))
+    finished = datetime.utcnow().isoformat() if status in ("done", "cancelled") else None
+    return conn.execute(
+        f"UPDATE broadcasts SET status = ?, finished_at = ?, lease_until = 0 "
+        f"WHERE id = ? AND status IN ({marks})",
+        (status, finished, broadcast_id, *allowed_from),
+    ).rowcount == 1
+
+def set_broadcast_stats_message(conn: sqlite3.Connection, broadcast_id: int, chat_id: int, message_id: int) -> None:
+    conn.execute(
+        "UPDATE broadcasts SET stats_chat_id = ?, stats_message_id = ? WHERE id = ?",
+        (chat_id, message_id, broadcast_id),
+    )
+
+def claim_broadcast(conn: sqlite3.Connection, broadcast_id: int, runner: str, lease_until: float) -> bool:
+    """Take a running broadcast whose lease has expired (or is ours already)."""
+    return conn.execute(
+        "UPDATE broadcasts SET runner = ?, lease_until = ? "
+        "WHERE id = ? AND status = 'running' AND (runner IS ? OR lease_until < ?)",
+        (runner, lease_until, broadcast_id, runner, time.time()),
+    ).rowcount == 1
+
+def release_broadcast(conn: sqlite3.Connection, broadcast_id: int, runner: str) -> None:
+    conn.execute("UPDATE broadcasts SET lease_until = 0 WHERE id = ? AND runner = ?", (broadcast_id, runner))
+
+def save_broadcast_progress(
+    conn: sqlite3.Connection, broadcast_id: int, runner: str, lease_until: float,
+    last_user_id: int, sent: int, blocked: int, failed: int,
+) -> str | None:
+    """Store the counters and renew the lease. Returns the broadcast's status
+    (anything but "running" means stop), None if another runner took it over."""
+    cur = conn.execute(
+        "UPDATE broadcasts SET last_user_id = ?, sent = ?, blocked = ?, failed = ?, "
+        "lease_until = CASE status WHEN 'running' THEN ? ELSE 0 END "
+        "WHERE id = ? AND runner = ?",
+        (last_user_id, sent, blocked, failed, lease_until, broadcast_id, runner),
+    )
+    if not cur.rowcount:
+        return None
+    return conn.execute("SELECT status FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()[0]
+
+# -------------------- POOLED WRITER --------------------
+# All writes from the event loop go through one thread that keeps a single
+# open connection per database file. SQLite allows one writer per file
+# anyway, and several bots (tenants) can share the thread instead of each
+# paying for its own connections and threads.
+
+class Writer:
+    def __init__(self) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rks-db-writer")
+        self._conns: Dict[str, sqlite3.Connection] = {}
+
+    def _conn(self, db_path: str) -> sqlite3.Connection:
+        conn = self._conns.get(db_path)
+        if conn is None:
+            conn = _connect(db_path)
+            self._conns[db_path] = conn
+        return conn
+
+    def _call(self, db_path: str, fn: Callable, args: tuple) -> Any:
+        conn = self._conn(db_path)
+        with conn:  # commit, or roll back on error
+            return fn(conn, *args)
+
+    async def run(self, db_path: str | None, fn: Callable, *args: Any) -> Any:
+        """Run fn(conn, *args) in a transaction on the writer thread."""
+        loop = asyncio.get_running_loop()
+        with tracing.span("db." + fn.__name__):
+            return await loop.run_in_executor(self._executor, self._call, db_path or DB_PATH, fn, args)
+
+    def close(self) -> None:
+        def _close_all() -> None:
+            for conn in self._conns.values():
+                conn.close()
+            self._conns.clear()
+        self._executor.submit(_close_all).result()
+
+writer = Writer()
@@ -0,0 +1,155 @@
+import struct
+from datetime import datetime, timedelta
+
+# -------------------- LEAD DRAFT --------------------
+# Everything a client has filled in so far, used as PTB's user_data type
+# (ContextTypes(user_data=LeadDraft)), so context.user_data is a draft.
+# Multi-selects are bitmasks: services by position in the studio's catalogue
+# (Catalog.bits), toning areas by position in Catalog.toning_areas. Both only
+# mean something together with the catalogue version the draft was filled
+# against, which is kept in catalog_version. to_bytes() is what SessionStore
+# writes when a session is evicted from memory. Photos are kept as Telegram
+# file_ids only; the images stay on Telegram's servers.
+
+CONTACT_METHODS = (None, "phone", "telegram")
+
+# 1: name, car, phone strings; 2: + catalog_version; 3: + photo file_ids
+_VERSION = 3
+_EPOCH = datetime(1970, 1, 1)
+# version, services, areas, flow_i, contact method, visit (s since epoch, 0 = none), answers
+_HEAD = struct.Struct("<BQBhBqB")
+_LEN = struct.Struct("<H")
+_FIXED_STRINGS = {1: 3, 2: 4, 3: 5}
+
+MAX_PHOTOS = 10  # one media group
+
+
+class LeadDraft:
+    __slots__ = (
+        "name", "car", "services", "areas", "flow_i", "answers",
+        "visit_dt", "phone", "contact_method", "catalog_version", "photos", "photo_group",
+    )
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.name = None
+        self.car = None
+        self.services = 0     # Catalog.bits mask
+        self.areas = 0        # Catalog.area_bits mask of the toning step
+        self.flow_i = -1      # -1 until the services are confirmed
+        self.answers = None   # question key -> answer text, created on first answer
+        self.visit_dt = None
+        self.phone = None
+        self.contact_method = None
+        self.catalog_version = None  # pinned by handlers.catalog_for() on first use
+        self.photos = None    # file_ids of the photo step, created on first photo
+        self.photo_group = None  # media_group_id of the last album; not saved
+
+    def __bool__(self):
+        return self.name is not None
+
+    # ---------- services ----------
+    @property
+    def confirmed(self):
+        return self.flow_i >= 0
+
+    def selected(self, catalog):
+        return catalog.keys_of(self.services)
+
+    def toggle_service(self, catalog, key):
+        self.services ^= catalog.bits[key]
+
+    # ---------- toning areas ----------
+    def toggle_area(self, catalog, key):
+        self.areas ^= catalog.area_bits[key]
+
+    def area_keys(self, catalog):
+        return catalog.area_keys(self.areas)
+
+    # ---------- answers ----------
+    def answer(self, key, value):
+        if self.answers is None:
+            self.answers = {}
+        self.answers[key] = value
+
+    def get_answer(self, key):
+        return self.answers.get(key) if self.answers else None
+
+    # ---------- photos ----------
+    def add_photo(self, file_id):
+        """False once MAX_PHOTOS are in."""
+        if self.photos is None:
+            self.photos = []
+        if len(self.photos) >= MAX_PHOTOS:
+            return False
+        self.photos.append(file_id)
+        return True
+
+    def all_answers(self, catalog):
+        """Answers with the toning areas spelled out, as stored on the lead."""
+        out = dict(self.answers or {})
+        if self.areas:
+            out["toning_areas"] = catalog.area_labels(self.areas)
+        return out
+
+    def to_data(self, catalog):
+        """Plain-dict view for the scoring and upsell rules in catalog.py."""
+        return {
+            "name": self.name,
+            "car": self.car,
+            "services_selected": self.selected(catalog),
+            "services_answers": self.all_answers(catalog),
+            "visit_dt": self.visit_dt,
+            "phone": self.phone,
+            "contact_method": self.contact_method,
+            "photos": list(self.photos or ()),
+        }
+
+    # ---------- binary form ----------
+    def to_bytes(self):
+        visit = int((self.visit_dt - _EPOCH).total_seconds()) if self.visit_dt else 0
+        answers = self.answers or {}
+        out = [_HEAD.pack(
+            _VERSION, self.services, self.areas, self.flow_i,
+            CONTACT_METHODS.index(self.contact_method), visit, len(answers),
+        )]
+        # file_ids are URL-safe base64, so a comma can separate them
+        strings = [self.name, self.car, self.phone, self.catalog_version, ",".join(self.photos) if self.photos else None]
+        for key, value in answers.items():
+            strings += (key, value)
+        for s in strings:
+            # one piece per string: the list held until the join is half as long
+            raw = s.encode("utf-8") if s else b""
+            out.append(_LEN.pack(len(raw)) + raw)
+        return b"".join(out)
+
+    @classmethod
+    def from_bytes(cls, blob):
+        if not blob or blob[0] not in _FIXED_STRINGS:
+            raise ValueError("unknown lead draft format")
+        version, services, areas, flow_i, contact, visit, n_answers = _HEAD.unpack_from(blob)
+        fixed = _FIXED_STRINGS[version]
+        pos = _HEAD.size
+        strings = []
+        for _ in range(fixed + 2 * n_answers):
+            end = pos + 2 + (blob[pos] | blob[pos + 1] << 8)  # _LEN, little-endian
+            strings.append(blob[pos + 2:end].decode("utf-8"))
+            pos = end
+
+        # every slot is set here, so clear() is not run first
+        d = cls.__new__(cls)
+        d.name = strings[0] or None
+        d.car = strings[1] or None
+        d.phone = strings[2] or None
+        d.catalog_version = (strings[3] or None) if version > 1 else None
+        d.photos = strings[4].split(",") if version > 2 and strings[4] else None
+        d.photo_group = None
+        d.services = services
+        d.areas = areas
+        d.flow_i = flow_i
+        d.contact_method = CONTACT_METHODS[contact]
+        d.visit_dt = _EPOCH + timedelta(seconds=visit) if visit else None
+        d.answers = dict(zip(strings[fixed::2], strings[fixed + 1::2])) if n_answers else None
+        return d
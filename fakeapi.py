@@ -0,0 +1,338 @@
+"""
+Local stand-in for the Telegram Bot API.
+
+Used by the startup benchmark, the sharded-mode smoke run and other local
+tooling. It answers the methods the bot calls with plausible objects and
+records every call, either in-process (FakeRequest, no sockets at all) or
+over HTTP (serve(), point BOT_API_BASE_URL at it).
+
+    python fakeapi.py --port 8081
+"""
+import json
+import time
+import asyncio
+import argparse
+import threading
+from collections import deque
+from urllib.parse import parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOT_USER = {"id": 1000000001, "is_bot": True, "first_name": "RKS", "username": "rks_fake_bot"}
+
+# parameters that must stay strings even when they look like JSON
+_TEXT_PARAMS = {"text", "caption", "callback_query_id", "url", "phone_number"}
+
+
+_SEND_METHODS = {"sendMessage", "sendPhoto", "sendDocument", "sendMediaGroup", "forwardMessage", "copyMessage"}
+
+
+class ApiError(Exception):
+    """Answered as {"ok": false, ...} with this HTTP status."""
+
+    def __init__(self, code, description, retry_after=None):
+        super().__init__(description)
+        self.code = code
+        self.retry_after = retry_after
+
+    def body(self):
+        out = {"ok": False, "error_code": self.code, "description": str(self)}
+        if self.retry_after is not None:
+            out["parameters"] = {"retry_after": self.retry_after}
+        return json.dumps(out).encode("utf-8")
+
+
+class FakeBotAPI:
+    def __init__(self, latency=0.0, send_limit=None):
+        self.latency = latency
+        self.send_limit = send_limit  # sends per second before 429, like Telegram's global limit
+        self.blocked = set()          # chat ids that blocked the bot (403 on sends)
+        self.rejected = 0
+        self.connections = 0          # TCP connections accepted by serve()
+        self._floods = 0
+        self._sends = deque()
+        self.calls = []
+        self._updates = deque()
+        self._cond = threading.Condition()
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._listeners = []
+
+    # ---------- updates ----------
+    def push_update(self, update):
+        with self._cond:
+            update = dict(update, update_id=self._next_update_id)
+            self._next_update_id += 1
+            self._updates.append(update)
+            self._cond.notify_all()
+        return update
+
+    def flood(self, times=1, retry_after=1):
+        """The next `times` sends get 429 with this retry_after."""
+        self._floods = times
+        self._flood_after = retry_after
+
+    def on_call(self, fn):
+        """fn(method, params) is called after every recorded API call."""
+        self._listeners.append(fn)
+
+    def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                while self._updates and self._updates[0]["update_id"] < offset:
+                    self._updates.popleft()
+                if self._updates:
+                    limit = int(params.get("limit") or 100)
+                    return list(self._updates)[:limit]
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return []
+                self._cond.wait(left)
+
+    # ---------- responses ----------
+    def _message(self, params, **extra):
+        with self._cond:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+        chat_id = params.get("chat_id") or 0
+        msg = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        if "text" in params:
+            msg["text"] = params["text"]
+        if params.get("reply_markup") and "inline_keyboard" in params["reply_markup"]:
+            msg["reply_markup"] = params["reply_markup"]
+        msg.update(extra)
+        return msg
+
+    def _check_send(self, method, params):
+        if method not in _SEND_METHODS:
+            return
+        with self._cond:
+            if self._floods:
+                self._floods -= 1
+                raise ApiError(429, f"Too Many Requests: retry after {self._flood_after}", self._flood_after)
+            if self.send_limit:
+                now = time.monotonic()
+                while self._sends and self._sends[0] <= now - 1:
+                    self._sends.popleft()
+                if len(self._sends) >= self.send_limit:
+                    raise ApiError(429, "Too Many Requests: retry after 1", 1)
+                self._sends.append(now)
+        if params.get("chat_id") in self.blocked:
+            raise ApiError(403, "Forbidden: bot was blocked by the user")
+
+    def handle(self, method, params):
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            self._check_send(method, params)
+        except ApiError:
+            self.rejected += 1
+            raise
+        result = self._dispatch(method, params)
+        self.calls.append((time.time(), method, params))
+        for fn in self._listeners:
+            fn(method, params)
+        return result
+
+    def _dispatch(self, method, params):
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return self._get_updates(params)
+        if method == "deleteWebhook":
+            if params.get("drop_pending_updates"):
+                with self._cond:
+                    self._updates.clear()
+            return True
+        if method in ("sendMessage", "sendPhoto", "sendDocument", "forwardMessage"):
+            return self._message(params)
+        if method == "copyMessage":
+            return {"message_id": self._message(params)["message_id"]}
+        if method == "sendMediaGroup":
+            return [self._message(params) for _ in params.get("media") or []]
+        if method in ("editMessageText", "editMessageReplyMarkup"):
+            if params.get("inline_message_id"):
+                return True
+            msg = self._message(params)
+            msg["message_id"] = params.get("message_id")
+            return msg
+        return True
+
+    @staticmethod
+    def decode_params(pairs):
+        out = {}
+        for key, value in pairs:
+            if key in _TEXT_PARAMS:
+                out[key] = value
+                continue
+            try:
+                out[key] = json.loads(value)
+            except ValueError:
+                out[key] = value
+        return out
+
+
+# -------------------- in-process transport --------------------
+def _load_base_request():
+    from telegram.request import BaseRequest
+
+    class FakeRequest(BaseRequest):
+        """python-telegram-bot request object answering from a FakeBotAPI."""
+
+        def __init__(self, api):
+            self.api = api
+
+        @property
+        def read_timeout(self):
+            return None
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None):
+            api_method = url.rsplit("/", 1)[-1]
+            params = request_data.parameters if request_data else {}
+            try:
+                if api_method == "getUpdates":
+                    result = await asyncio.to_thread(self.api.handle, api_method, params)
+                else:
+                    result = self.api.handle(api_method, params)
+            except ApiError as e:
+                return e.code, e.body()
+            return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+    return FakeRequest
+
+
+def __getattr__(name):
+    # telegram is only imported when the in-process transport is used
+    if name == "FakeRequest":
+        cls = _load_base_request()
+        globals()["FakeRequest"] = cls
+        return cls
+    raise AttributeError(name)
+
+
+# -------------------- HTTP server --------------------
+def serve(api, host="127.0.0.1", port=0):
+    """Start serving `api` in a daemon thread; returns the server (see .server_port)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive, like the real API, so client pooling shows up in benchmarks;
+        # headers and body leave in one segment (no Nagle / delayed-ACK stall)
+        protocol_version = "HTTP/1.1"
+        wbufsize = 1 << 16
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            super().setup()
+            with api._cond:
+                api.connections += 1
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length).decode("utf-8") if length else ""
+            ctype = self.headers.get("Content-Type", "")
+            if ctype.startswith("application/json"):
+                params = json.loads(raw or "{}")
+            else:
+                params = api.decode_params(parse_qsl(raw, keep_blank_values=True))
+
+            method = self.path.rsplit("/", 1)[-1]
+            try:
+                status, body = 200, json.dumps({"ok": True, "result": api.handle(method, params)}).encode("utf-8")
+            except ApiError as e:
+                status, body = e.code, e.body()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # client went away mid long-poll
+
+        do_GET = do_POST
+
+        def log_message(self, format, *args):
+            return
+
+    class Server(ThreadingHTTPServer):
+        request_queue_size = 256  # the default 5 drops connections in a burst
+
+    server = Server((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# -------------------- update builders --------------------
+def _user(chat_id):
+    return {"id": chat_id, "is_bot": False, "first_name": "Клиент", "username": f"client{chat_id}"}
+
+def message_update(chat_id, text=None, contact=None, message_id=None, photo=None, media_group_id=None):
+    msg = {
+        "message_id": message_id or int(time.time() * 1000) % 2_000_000_000,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": _user(chat_id),
+    }
+    if text is not None:
+        msg["text"] = text
+        if text.startswith("/"):
+            cmd = text.split()[0]
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(cmd)}]
+    if contact is not None:
+        msg["contact"] = {"phone_number": contact, "first_name": "Клиент", "user_id": chat_id}
+    if photo is not None:
+        msg["photo"] = [{"file_id": photo, "file_unique_id": photo[-8:], "width": 1280, "height": 960}]
+        if media_group_id is not None:
+            msg["media_group_id"] = media_group_id
+    return {"message": msg}
+
+def callback_update(chat_id, message_id, data):
+    return {
+        "callback_query": {
+            "id": f"{chat_id}-{time.monotonic_ns()}",
+            "chat_instance": str(chat_id),
+            "from": _user(chat_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "…",
+            },
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument("--send-limit", type=int, default=None, help="sends per second before 429")
+    args = parser.parse_args()
+
+    api = FakeBotAPI(latency=args.latency, send_limit=args.send_limit)
+    api.on_call(lambda method, params: print(method, json.dumps(params, ensure_ascii=False)[:200]))
+    server = serve(api, args.host, args.port)
+    print(f"Fake Bot API on http://{args.host}:{server.server_port}/bot<token>/")
+    threading.Event().wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Local stand-in for the CRM endpoint crm.py pushes to.
+
+Stores leads by external_id (a resent lead replaces the stored one), keeps
+every request it got, and can be told to misbehave: fail the next N
+requests with a given status (and Retry-After), reject them with a 4xx, or
+answer slowly. It speaks HTTP/1.1 keep-alive, and `connections` counts the
+TCP connections clients opened, so pooling can be checked too.
+
+    python fakecrm.py --port 8082        # then CRM_URL=http://127.0.0.1:8082/leads
+"""
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeCRM:
+    def __init__(self, token="", latency=0.0):
+        self.token = token
+        self.latency = latency
+        self.leads = {}
+        self.requests = []
+        self.connections = 0
+        self._fail = []
+        self._lock = threading.Lock()
+
+    def fail(self, times=1, status=503, retry_after=None):
+        """Answer the next `times` requests with `status` instead of storing them."""
+        with self._lock:
+            self._fail += [(status, retry_after)] * times
+
+    def handle(self, headers, body):
+        """Returns (status, extra headers, response object)."""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests.append({
+                "time": time.time(),
+                "idempotency_key": headers.get("Idempotency-Key"),
+                "size": len(body.get("leads") or []),
+            })
+            if self._fail:
+                status, retry_after = self._fail.pop(0)
+                extra = {"Retry-After": str(retry_after)} if retry_after is not None else {}
+                return status, extra, {"ok": False, "error": "injected failure"}
+            if self.token and headers.get("Authorization") != "Bearer " + self.token:
+                return 401, {}, {"ok": False, "error": "bad token"}
+
+            leads = body.get("leads")
+            if not isinstance(leads, list) or not all(isinstance(x, dict) and x.get("external_id") for x in leads):
+                return 422, {}, {"ok": False, "error": "leads[].external_id required"}
+            created = updated = 0
+            for lead in leads:
+                if lead["external_id"] in self.leads:
+                    updated += 1
+                else:
+                    created += 1
+                self.leads[lead["external_id"]] = lead
+        return 200, {}, {"ok": True, "created": created, "updated": updated}
+
+
+def serve(crm, host="127.0.0.1", port=0):
+    """Start serving `crm` in a daemon thread; returns the server (see .server_port)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            with crm._lock:
+                crm.connections += 1
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            try:
+                body = json.loads(raw or b"{}")
+            except ValueError:
+                status, extra, result = 400, {}, {"ok": False, "error": "invalid JSON"}
+            else:
+                status, extra, result = crm.handle(self.headers, body)
+
+            out = json.dumps(result, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            for key, value in extra.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(out)
+
+        def log_message(self, format, *args):
+            return
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake CRM endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--token", default="", help="require this bearer token")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    args = parser.parse_args()
+
+    crm = FakeCRM(token=args.token, latency=args.latency)
+    server = serve(crm, args.host, args.port)
+    print(f"Fake CRM on http://{args.host}:{server.server_port}/leads")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"{len(crm.leads)} leads, {len(crm.requests)} requests, {crm.connections} connections")
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1054 @@
+import io
+import re
+import asyncio
+import logging
+import threading
+from datetime import datetime
+
+from telegram import InputMediaPhoto, Update
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden, TelegramError
+from telegram.ext import (
+    Application,
+    ApplicationHandlerStop,
+    CommandHandler,
+    MessageHandler,
+    CallbackQueryHandler,
+    ConversationHandler,
+    ContextTypes,
+    TypeHandler,
+    filters,
+)
+
+import db
+import jobs
+import logs
+import keyboards
+import tracing
+from assign import Assigner
+from bridge import MessageIndex
+from broadcast import LEASE_SEC, Broadcaster, stats_text
+from catalog import (
+    DEFAULT_CATALOG,
+    format_upsells_for_client,
+    lead_card_text,
+)
+from draft import MAX_PHOTOS, LeadDraft
+from hotreload import CatalogStore, load_catalog
+from helpers import clean_text, normalize_phone, parse_datetime_ru, is_future_time
+from keyboards import (
+    services_keyboard,
+    yes_no_kb,
+    contact_kb,
+    channel_kb,
+    choice_kb,
+    toning_areas_kb,
+    toning_percent_kb,
+    photos_kb,
+    resume_kb,
+    claim_kb,
+    close_kb,
+    broadcast_kb,
+)
+from outbox import coalesce, pipelined, reply, schedule_markup_edit, flush_markup_edit
+from profiler import SamplingProfiler
+from replay import Recorder
+from sessions import SessionContext, SessionStore, memory_report
+from transport import TracedRequest, api_request, polling_request
+
+logger = logging.getLogger("rks_bot")
+
+# -------------------- STATES --------------------
+(
+    S_NAME,
+    S_CAR,
+    S_SERVICES,
+    S_SVC_FLOW,
+    S_TIME,
+    S_CONTACT,
+    S_DONE,
+) = range(7)
+
+STATE_NAMES = {
+    S_NAME: "name",
+    S_CAR: "car",
+    S_SERVICES: "services",
+    S_SVC_FLOW: "svc_flow",
+    S_TIME: "time",
+    S_CONTACT: "contact",
+    S_DONE: "done",
+    ConversationHandler.TIMEOUT: "timeout",
+}
+
+# -------------------- CORE HANDLERS --------------------
+async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    _cancel_expiry(context, update.effective_user.id)
+    context.user_data.clear()
+    await update.message.reply_text(
+        "Привет! Я помогу быстро подобрать услуги и записать тебя.\n\nКак тебя зовут?"
+    )
+    return S_NAME
+
+async def cmd_restart(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    _cancel_expiry(context, update.effective_user.id)
+    context.user_data.clear()
+    await update.message.reply_text("Ок! Давай заново.\n\nКак тебя зовут?")
+    return S_NAME
+
+@coalesce
+async def cb_restart(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await pipelined(q.answer())
+    _cancel_expiry(context, update.effective_user.id)
+    context.user_data.clear()
+    await q.message.reply_text("Ок! Давай заново.\n\nКак тебя зовут?")
+    return S_NAME
+
+async def on_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    name = clean_text(update.message.text)
+    if len(name) < 2 or not re.search(r"[A-Za-zА-Яа-яЁё]", name):
+        await update.message.reply_text("Напиши имя понятнее.")
+        return S_NAME
+
+    context.user_data.name = name
+    return await ask_car(update.message)
+
+async def ask_car(message):
+    await message.reply_text(
+        "Отлично.\nНапиши: **марка, модель, год выпуска**.\nПример: `Toyota Camry 2018`",
+        parse_mode=ParseMode.MARKDOWN,
+    )
+    return S_CAR
+
+async def on_car(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    txt = clean_text(update.message.text)
+    if len(txt) < 4:
+        await update.message.reply_text("Чуть подробнее. Например: `Toyota Camry 2018`", parse_mode=ParseMode.MARKDOWN)
+        return S_CAR
+
+    context.user_data.car = txt
+    context.user_data.services = 0
+    return await ask_services(update.message, context)
+
+async def ask_services(message, context: ContextTypes.DEFAULT_TYPE):
+    catalog = catalog_for(context)
+    await message.reply_text(
+        "Выбери услуги (можно несколько) и нажми «Готово ✅».",
+        reply_markup=services_keyboard(context.user_data.selected(catalog), catalog),
+    )
+    return S_SERVICES
+
+@coalesce
+async def cb_services(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await pipelined(q.answer())
+
+    catalog = catalog_for(context)
+    draft = context.user_data
+    data = q.data
+
+    if data.startswith("svc:"):
+        svc = data.split(":", 1)[1]
+        if svc not in catalog.labels:
+            return S_SERVICES
+        draft.toggle_service(catalog, svc)
+        schedule_markup_edit(context, q.message, services_keyboard(draft.selected(catalog), catalog))
+        return S_SERVICES
+
+    if data == "svc_reset":
+        draft.services = 0
+        schedule_markup_edit(context, q.message, services_keyboard(draft.selected(catalog), catalog))
+        return S_SERVICES
+
+    if data == "svc_done":
+        await pipelined(flush_markup_edit(q.message))
+        if not draft.services:
+            await q.message.reply_text("Выбери хотя бы одну услугу 🙂")
+            return S_SERVICES
+
+        draft.answers = None
+        draft.areas = 0
+        draft.flow_i = 0
+
+        await reply(q.message, "Отлично! Уточню пару моментов по выбранным услугам.")
+        return await ask_next_flow_step(q.message, context)
+
+    return S_SERVICES
+
+def catalog_for(context: ContextTypes.DEFAULT_TYPE):
+    """The catalogue version the client's form started with, pinned on first use."""
+    store = context.bot_data["catalogs"]
+    draft = context.user_data
+    catalog = store.get(draft.catalog_version) if draft.catalog_version else None
+    if catalog is None:
+        if draft.catalog_version:
+            # spilled before a restart with another catalogue file: its service
+            # and area bits do not mean the same things any more
+            logger.info("Form catalogue gone, services reset", extra={"version": draft.catalog_version})
+            draft.services = draft.areas = 0
+            draft.flow_i = -1
+            draft.answers = None
+        catalog = store.current
+        draft.catalog_version = catalog.version
+    return catalog
+
+def current_flow(context: ContextTypes.DEFAULT_TYPE):
+    catalog = catalog_for(context)
+    return catalog.build_flow(context.user_data.selected(catalog))
+
+def step_applies(step, draft):
+    when = step.get("when")
+    return not when or all(draft.get_answer(k) == v for k, v in when.items())
+
+PHOTOS_FOOTER = (
+    f"\n\nМожно несколько фото, до {MAX_PHOTOS}. Когда закончишь — «Готово ✅».\n"
+    "Нет фото под рукой — «Пропустить ➡️»."
+)
+
+async def ask_next_flow_step(message, context: ContextTypes.DEFAULT_TYPE):
+    draft = context.user_data
+    catalog = catalog_for(context)
+    flow = current_flow(context)
+    i = draft.flow_i
+
+    if i >= len(flow):
+        upsells = catalog.compute_upsells(draft.to_data(catalog))
+        tip = format_upsells_for_client(upsells, limit=3)
+        if tip:
+            await reply(message, tip)
+
+        await reply(
+            message,
+            "Когда тебе удобно подъехать? Напиши **день/время**.\n"
+            "Примеры:\n"
+            "• `сегодня 18:00`\n"
+            "• `завтра 12:00`\n"
+            "• `25.12 14:00`",
+            parse_mode=ParseMode.MARKDOWN,
+        )
+        return S_TIME
+
+    step = flow[i]
+    stype = step["type"]
+
+    # шаг с условием (например, "замена стекла" только если сколы == Да)
+    if not step_applies(step, draft):
+        draft.flow_i = i + 1
+        return await ask_next_flow_step(message, context)
+
+    if stype == "info":
+        await reply(message, step["text"], parse_mode=ParseMode.MARKDOWN)
+        draft.flow_i = i + 1
+        return await ask_next_flow_step(message, context)
+
+    if stype == "choice":
+        kb = choice_kb("ch:" + step["key"], step["options"])
+        await reply(message, step["text"], parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+        return S_SVC_FLOW
+
+    if stype == "yesno":
+        kb = yes_no_kb(step["kb_prefix"])
+        await reply(message, step["text"], parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+        return S_SVC_FLOW
+
+    if stype == "toning_areas":
+        draft.areas = 0
+        kb = toning_areas_kb((), catalog)
+        await reply(message, step["text"], parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+        return S_SVC_FLOW
+
+    if stype == "toning_percent":
+        kb = toning_percent_kb(catalog)
+        await reply(message, step["text"], parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+        return S_SVC_FLOW
+
+    if stype == "photos":
+        # asked once per form, for all the selected services at once
+        if any(s["type"] == "photos" and step_applies(s, draft) for s in flow[:i]):
+            draft.flow_i = i + 1
+            return await ask_next_flow_step(message, context)
+        hints = [s["text"] for s in flow[i:] if s["type"] == "photos" and step_applies(s, draft)]
+        kb = photos_kb(bool(draft.photos))
+        await reply(message, "\n\n".join(hints) + PHOTOS_FOOTER, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+        return S_SVC_FLOW
+
+    await reply(message, step["text"], parse_mode=ParseMode.MARKDOWN)
+    return S_SVC_FLOW
+
+@coalesce
+async def cb_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await pipelined(q.answer())
+
+    draft = context.user_data
+    catalog = catalog_for(context)
+    flow = current_flow(context)
+    i = draft.flow_i
+    if not 0 <= i < len(flow):
+        return S_TIME
+
+    step = flow[i]
+    data = q.data
+    logger.debug("Flow answer", extra={"step": step["key"], "data": data})
+
+    # --- Toning areas multi ---
+    if step["type"] == "toning_areas":
+        if data.startswith("ta:"):
+            k = data.split(":", 1)[1]
+            if k not in catalog.area_bits:
+                return S_SVC_FLOW
+            draft.toggle_area(catalog, k)
+            schedule_markup_edit(context, q.message, toning_areas_kb(draft.area_keys(catalog), catalog))
+            return S_SVC_FLOW
+
+        if data == "ta_reset":
+            draft.areas = 0
+            schedule_markup_edit(context, q.message, toning_areas_kb(draft.area_keys(catalog), catalog))
+            return S_SVC_FLOW
+
+        if data == "ta_done":
+            await pipelined(flush_markup_edit(q.message))
+            if not draft.areas:
+                await q.message.reply_text("Выбери хотя бы одну зону 🙂")
+                return S_SVC_FLOW
+
+            draft.flow_i = i + 1
+            return await ask_next_flow_step(q.message, context)
+
+        return S_SVC_FLOW
+
+    # --- Toning percent ---
+    if step["type"] == "toning_percent":
+        if data.startswith("tp:"):
+            val = data.split(":", 1)[1]
+            draft.answer(step["key"], val)
+            draft.flow_i = i + 1
+            await pipelined(q.edit_message_reply_markup(reply_markup=None))
+            return await ask_next_flow_step(q.message, context)
+        return S_SVC_FLOW
+
+    # --- Choice ---
+    if step["type"] == "choice":
+        prefix = "ch:" + step["key"] + ":"
+        if data.startswith(prefix):
+            idx = int(data.split(":")[-1])
+            opt = step["options"][idx]
+            draft.answer(step["key"], opt)
+            draft.flow_i = i + 1
+            await pipelined(q.edit_message_reply_markup(reply_markup=None))
+            return await ask_next_flow_step(q.message, context)
+        return S_SVC_FLOW
+
+    # --- Yes/No ---
+    if step["type"] == "yesno":
+        pref = step["kb_prefix"] + ":"
+        if data.startswith(pref):
+            val = data.split(":")[-1]
+            draft.answer(step["key"], "Да" if val == "yes" else "Нет")
+            draft.flow_i = i + 1
+            await pipelined(q.edit_message_reply_markup(reply_markup=None))
+            return await ask_next_flow_step(q.message, context)
+        return S_SVC_FLOW
+
+    # --- Photos ---
+    if step["type"] == "photos":
+        if data == "ph_done":
+            draft.flow_i = i + 1
+            await pipelined(q.edit_message_reply_markup(reply_markup=None))
+            return await ask_next_flow_step(q.message, context)
+        return S_SVC_FLOW
+
+    return S_SVC_FLOW
+
+async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    draft = context.user_data
+    flow = current_flow(context)
+    i = draft.flow_i
+    if not 0 <= i < len(flow) or flow[i]["type"] != "photos":
+        return S_SVC_FLOW
+
+    msg = update.message
+    # the largest size; only the file_id is kept, the photo stays on Telegram
+    added = draft.add_photo(msg.photo[-1].file_id)
+    # an album arrives as one update per photo: answer the first of them only
+    group = msg.media_group_id
+    if group is not None and group == draft.photo_group:
+        return S_SVC_FLOW
+    draft.photo_group = group
+    if added:
+        await msg.reply_text(
+            f"Фото получил 👍 Можно прислать ещё (до {MAX_PHOTOS}) или нажать «Готово ✅».",
+            reply_markup=photos_kb(True),
+        )
+    else:
+        await msg.reply_text(f"Больше {MAX_PHOTOS} фото не нужно 🙂 Нажми «Готово ✅».", reply_markup=photos_kb(True))
+    return S_SVC_FLOW
+
+async def on_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    txt = clean_text(update.message.text)
+    dt = parse_datetime_ru(txt)
+    if not dt:
+        logger.debug("Unparsed visit time", extra={"text_len": len(txt)})
+        await update.message.reply_text(
+            "Не понял дату/время.\n"
+            "Напиши в формате:\n"
+            "• `сегодня 18:00`\n"
+            "• `завтра 12:00`\n"
+            "• `25.12 14:00`",
+            parse_mode=ParseMode.MARKDOWN,
+        )
+        return S_TIME
+
+    if not is_future_time(dt):
+        await update.message.reply_text(
+            "Нужно выбрать время **в будущем**.\nНапример: `сегодня 18:00` или `завтра 12:00`",
+            parse_mode=ParseMode.MARKDOWN,
+        )
+        return S_TIME
+
+    context.user_data.visit_dt = dt
+    return await ask_contact(update.message)
+
+async def ask_contact(message):
+    await message.reply_text(
+        "Ок! Осталось оставить удобный контакт:\n"
+        "• нажми «Отправить контакт ☎️»\n"
+        "• или напиши номер текстом\n"
+        "• или скажи «можно сюда в Telegram»",
+        reply_markup=contact_kb(),
+    )
+    return S_CONTACT
+
+@coalesce
+async def on_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # contact button
+    if update.message.contact and update.message.contact.phone_number:
+        phone = normalize_phone(update.message.contact.phone_number)
+        if not phone:
+            await update.message.reply_text("Не смог распознать номер. Напиши номер текстом: +7XXXXXXXXXX или 8XXXXXXXXXX")
+            return S_CONTACT
+        context.user_data.phone = phone
+        context.user_data.contact_method = "phone"
+    else:
+        txt = clean_text(update.message.text)
+        if any(x in txt.lower() for x in ["телег", "telegram", "tg", "сюда"]):
+            context.user_data.contact_method = "telegram"
+            context.user_data.phone = None
+        else:
+            phone = normalize_phone(txt)
+            if not phone:
+                logger.debug("Unparsed phone", extra={"text_len": len(txt)})
+                await update.message.reply_text(
+                    "Номер некорректный.\nНапиши `+7XXXXXXXXXX` или `8XXXXXXXXXX`, либо нажми «Отправить контакт ☎️».",
+                    parse_mode=ParseMode.MARKDOWN,
+                )
+                return S_CONTACT
+            context.user_data.phone = phone
+            context.user_data.contact_method = "phone"
+
+    await send_lead_to_manager(update, context)
+
+    glass_has_chips = context.user_data.get_answer("glass_has_chips") == "Да"
+    extra = ""
+    if glass_has_chips:
+        extra = (
+            "По стеклу: если есть сколы/трещины — полировка/шлифовка не делается. "
+            "Нужна замена стекла. Мы можем заменить — менеджер подскажет."
+        )
+
+    await reply(
+        update.message,
+        "Заявка принята! Я передал её менеджеру.\n"
+        "Он свяжется с тобой.\n\n"
+        "Пока ждёшь — можешь посмотреть наши работы:",
+        reply_markup=channel_kb(context.bot_data["config"].works_channel_url),
+    )
+    if extra:
+        await reply(update.message, extra)
+    return S_DONE
+
+CARD_REPLY_HINT = "\n\n↩️ Ответ на эту карточку уйдёт клиенту."
+CARD_STATUS = "\n\n📌 "
+
+def card_with_status(text, status):
+    return text.split(CARD_STATUS)[0] + CARD_STATUS + status
+
+def card_markup(lead_id, owner, manager_id):
+    """Claim button until someone owns the lead, then a close button for the owner only."""
+    if lead_id is None:
+        return None
+    if owner is None:
+        return claim_kb(lead_id)
+    return close_kb(lead_id) if manager_id == owner else None
+
+async def _send_photos(context: ContextTypes.DEFAULT_TYPE, lead_id, client_chat_id, cards: list, photos: list):
+    """The client's photos (by file_id) as a reply to each card [(chat_id, message_id)]."""
+    async def send(manager_id, card_id):
+        if len(photos) == 1:  # a media group needs at least two
+            return (await context.bot.send_photo(manager_id, photos[0], reply_to_message_id=card_id),)
+        return await context.bot.send_media_group(
+            manager_id, [InputMediaPhoto(p) for p in photos], reply_to_message_id=card_id,
+        )
+
+    sent = await asyncio.gather(*(send(manager_id, card_id) for manager_id, card_id in cards), return_exceptions=True)
+    links = []
+    for (manager_id, _), media in zip(cards, sent):
+        if isinstance(media, BaseException):
+            logger.error("Lead photos not sent: %s", media, extra={"lead_id": lead_id, "manager_id": manager_id})
+            continue
+        links += [(manager_id, m.message_id) for m in media]
+    if links and client_chat_id is not None:
+        try:
+            # a reply to a photo reaches the client like a reply to the card
+            await context.bot_data["bridge"].link_relays(lead_id, client_chat_id, links)
+        except Exception:
+            logger.exception("Failed to link lead photos for lead %s", lead_id)
+
+async def send_lead_to_manager(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    draft = context.user_data
+    user = update.effective_user
+    config = context.bot_data["config"]
+    catalog = catalog_for(context)
+    data = draft.to_data(catalog)
+
+    tg_username = ("@" + user.username) if user and user.username else "—"
+    tg_id = str(user.id) if user else "—"
+
+    selected = data["services_selected"]
+    answers = data["services_answers"]
+    dt = draft.visit_dt
+    contact_method = draft.contact_method or "—"
+    phone = draft.phone or ""
+
+    temp = catalog.lead_temperature(data)
+    upsells = catalog.compute_upsells(data)
+    text = lead_card_text(data, catalog, tg_username, tg_id, temp, upsells, config.studio_name)
+
+    lead = {
+        "tg_user_id": user.id if user else 0,
+        "tg_username": user.username if user else None,
+        "name": draft.name,
+        "phone": phone or None,
+        "car": draft.car,
+        "services_interest": ",".join(selected),
+        "services": catalog.answers_by_service(selected, answers),
+        "ready_time": dt.isoformat() if isinstance(dt, datetime) else None,
+        "lead_temp": temp,
+        "contact_method": contact_method,
+        "source": "telegram",
+        "photos": data["photos"],
+    }
+    lead_id = None
+    try:
+        lead_id = await db.writer.run(config.db_path, db.insert_lead, lead)
+        logger.info("Lead saved", extra={"lead_id": lead_id, "services": lead["services_interest"], "lead_temp": temp})
+        crm = context.bot_data.get("crm")
+        if crm is not None:
+            crm.wake()
+    except Exception:
+        logger.exception("Failed to save lead", extra={"tg_user_id": tg_id})
+
+    text += CARD_REPLY_HINT
+    owner = None
+    assigner = context.bot_data["assigner"]
+    if lead_id is not None and assigner.auto:
+        try:
+            owner = await db.writer.run(config.db_path, db.claim_lead, lead_id, assigner.pick())
+            assigner.claimed(owner)
+            text = card_with_status(text, "Назначена: " + assigner.name(owner))
+            logger.info("Lead assigned", extra={"lead_id": lead_id, "manager_id": owner, "mode": assigner.mode})
+        except Exception:
+            logger.exception("Failed to assign lead %s", lead_id)
+
+    # one card per manager chat, so the sends do not have to wait for each other
+    sent = await asyncio.gather(*(
+        context.bot.send_message(chat_id=manager_id, text=text, reply_markup=card_markup(lead_id, owner, manager_id))
+        for manager_id in config.manager_ids
+    ), return_exceptions=True)
+    cards = []
+    for manager_id, card in zip(config.manager_ids, sent):
+        if isinstance(card, BaseException):
+            logger.error("Lead card not sent: %s", card, extra={"lead_id": lead_id, "manager_id": manager_id})
+            continue
+        cards.append((manager_id, card.message_id))
+        logger.info("Lead card sent", extra={"lead_id": lead_id, "manager_id": manager_id})
+    client_chat_id = update.effective_chat.id if update.effective_chat else None
+    if cards and client_chat_id is not None:
+        try:
+            await context.bot_data["bridge"].link_cards(lead_id, client_chat_id, cards)
+        except Exception:
+            logger.exception("Failed to link lead cards", extra={"tg_user_id": tg_id})
+    if cards and lead["photos"]:
+        # they need the card ids, but the client's confirmation does not need them
+        await pipelined(_send_photos(context, lead_id, client_chat_id, cards, lead["photos"]))
+
+async def cmd_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data.clear()
+    await update.message.reply_text("Ок, остановил. Если нужно — /start")
+    return ConversationHandler.END
+
+# -------------------- ABANDONED FORMS --------------------
+# A form idle for SESSION_TIMEOUT_MIN ends the conversation. With
+# SESSION_NUDGE the client is asked once whether to continue, and the
+# answers are kept for one more timeout; otherwise they are dropped at once.
+
+def _session_timeout(context: ContextTypes.DEFAULT_TYPE):
+    return context.bot_data["config"].session_timeout_min * 60
+
+async def on_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not user:
+        return
+    draft = context.user_data
+    # nothing to come back to, or the lead is already sent
+    if not context.bot_data["config"].session_nudge or not draft or draft.contact_method:
+        context.bot_data["sessions"].pop(user.id)
+        return
+
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text=f"{draft.name}, заявка осталась незаконченной. Продолжим с того же места?",
+        reply_markup=resume_kb(),
+    )
+    context.job_queue.run_once(
+        _expire_session, _session_timeout(context), data=user.id, name=f"expire:{user.id}",
+    )
+    logger.info("Form timed out, client nudged")
+
+async def _expire_session(context: ContextTypes.DEFAULT_TYPE):
+    context.bot_data["sessions"].pop(context.job.data)
+
+def _cancel_expiry(context: ContextTypes.DEFAULT_TYPE, user_id: int):
+    if context.job_queue is None:
+        return
+    for job in context.job_queue.get_jobs_by_name(f"expire:{user_id}"):
+        job.schedule_removal()
+
+@coalesce
+async def cb_resume(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await pipelined(q.answer())
+    _cancel_expiry(context, update.effective_user.id)
+    await pipelined(q.edit_message_reply_markup(reply_markup=None))
+    return await resume_form(q.message, context)
+
+async def resume_form(message, context: ContextTypes.DEFAULT_TYPE):
+    """Ask again whatever the form is missing; returns the state to continue in."""
+    draft = context.user_data
+    if not draft or draft.contact_method:
+        draft.clear()
+        await message.reply_text("Начнём заново.\n\nКак тебя зовут?")
+        return S_NAME
+    if not draft.car:
+        return await ask_car(message)
+    if not draft.confirmed:
+        return await ask_services(message, context)
+    if not draft.visit_dt:
+        return await ask_next_flow_step(message, context)
+    return await ask_contact(message)
+
+
+# -------------------- MANAGER ↔ CLIENT BRIDGE --------------------
+# A manager's reply to a lead card (or to a client message relayed under it)
+# is copied to the client; whatever the client writes after the form is done
+# is copied under the cards of their latest lead. bridge.MessageIndex knows
+# which card belongs to whom.
+
+async def on_manager_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # runs in a group ahead of the form: a reply to a card or relayed message
+    # goes to the client and stops there, any other reply falls through to
+    # the form the manager may be filling in themselves
+    msg = update.message
+    link = await context.bot_data["bridge"].lookup(msg.chat_id, msg.reply_to_message.message_id)
+    if link is None:
+        if context.bot_data["conversation"].check_update(update) is None:
+            await msg.reply_text("Это сообщение не относится к заявке. Ответь на карточку клиента.")
+        return
+    lead_id, client_chat_id = link
+    try:
+        await msg.copy(chat_id=client_chat_id)
+    except Forbidden:
+        await msg.reply_text("Клиент заблокировал бота, сообщение не доставлено.")
+        raise ApplicationHandlerStop
+    logger.info("Manager reply relayed", extra={"lead_id": lead_id, "manager_id": msg.chat_id})
+    try:
+        await msg.set_reaction("👍")
+    except TelegramError:
+        pass  # only a delivery mark
+    raise ApplicationHandlerStop
+
+async def on_client_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    draft = context.user_data
+    if draft and not draft.contact_method:
+        return  # mid-form: the conversation has its reasons to ignore this
+    msg = update.message
+    bridge = context.bot_data["bridge"]
+    lead_id, cards = await bridge.cards_for(msg.chat_id)
+    if not cards:
+        return
+
+    copies = await asyncio.gather(*(
+        msg.copy(chat_id=chat_id, reply_to_message_id=card_id, allow_sending_without_reply=True)
+        for chat_id, card_id in cards
+    ), return_exceptions=True)
+    relayed = []
+    for (chat_id, _), copy in zip(cards, copies):
+        if isinstance(copy, TelegramError):
+            logger.error("Failed to relay a client message: %s", copy, extra={"lead_id": lead_id, "manager_id": chat_id})
+            continue
+        if isinstance(copy, BaseException):
+            raise copy
+        relayed.append((chat_id, copy.message_id))
+    if relayed:
+        await bridge.link_relays(lead_id, msg.chat_id, relayed)
+        logger.info("Client message relayed", extra={"lead_id": lead_id, "managers": len(relayed)})
+
+
+# -------------------- LEAD CLAIMING --------------------
+# "Взять в работу" on a card is a compare-and-set on leads.assigned_to
+# (db.claim_lead): the first manager wins and every card of the lead is
+# edited to show the owner; the owner's card gets "Закрыть заявку".
+
+async def _update_cards(context: ContextTypes.DEFAULT_TYPE, lead_id: int, text: str, owner: int | None):
+    config = context.bot_data["config"]
+    cards = await db.writer.run(config.db_path, db.lead_cards, lead_id)
+    results = await asyncio.gather(*(
+        context.bot.edit_message_text(
+            text, chat_id=chat_id, message_id=message_id,
+            reply_markup=close_kb(lead_id) if chat_id == owner else None,
+        )
+        for chat_id, message_id in cards
+    ), return_exceptions=True)
+    for (chat_id, _), result in zip(cards, results):
+        if isinstance(result, BadRequest):
+            logger.warning("Lead card not updated: %s", result, extra={"lead_id": lead_id, "manager_id": chat_id})
+        elif isinstance(result, BaseException):
+            raise result
+
+async def cb_claim(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    user = update.effective_user
+    config = context.bot_data["config"]
+    if user.id not in config.manager_ids:
+        await q.answer("Только для менеджеров.")
+        return
+    assigner = context.bot_data["assigner"]
+    assigner.remember(user)
+    lead_id = int(q.data.split(":", 1)[1])
+
+    owner = await db.writer.run(config.db_path, db.claim_lead, lead_id, user.id)
+    if owner is None:
+        await q.answer("Заявка не найдена.")
+        return
+    text = card_with_status(q.message.text, "В работе: " + assigner.name(owner))
+    if owner != user.id:
+        await q.answer("Уже в работе у " + assigner.name(owner), show_alert=True)
+        try:
+            await q.edit_message_text(text, reply_markup=None)
+        except BadRequest:
+            pass  # already shows the owner
+        return
+
+    assigner.claimed(user.id)
+    logger.info("Lead claimed", extra={"lead_id": lead_id, "manager_id": user.id})
+    await q.answer("Заявка твоя.")
+    await _update_cards(context, lead_id, text, owner)
+
+async def cb_close(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    user = update.effective_user
+    config = context.bot_data["config"]
+    lead_id = int(q.data.split(":", 1)[1])
+    if not await db.writer.run(config.db_path, db.close_lead, lead_id, user.id):
+        await q.answer("Закрыть может только тот, у кого заявка в работе.")
+        return
+
+    assigner = context.bot_data["assigner"]
+    assigner.remember(user)
+    assigner.closed(user.id)
+    logger.info("Lead closed", extra={"lead_id": lead_id, "manager_id": user.id})
+    await q.answer("Заявка закрыта.")
+    await _update_cards(context, lead_id, card_with_status(q.message.text, "Закрыта: " + assigner.name(user.id)), None)
+
+
+# -------------------- MANAGER COMMANDS --------------------
+PROFILE_MAX_SECONDS = 600
+
+async def cmd_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/profile N — sample the event loop for N seconds (60 by default) and trace every update."""
+    user = update.effective_user
+    if not user or user.id not in context.bot_data["config"].manager_ids:
+        return
+
+    running = context.bot_data.get("profiler")
+    if running and running.running:
+        await update.message.reply_text("Профилирование уже идёт.")
+        return
+
+    try:
+        seconds = int(context.args[0]) if context.args else 60
+    except ValueError:
+        await update.message.reply_text("Формат: /profile 60")
+        return
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+
+    # handlers run on the event loop thread, which is what we want to sample
+    prof = SamplingProfiler(threading.get_ident())
+    context.bot_data["profiler"] = prof
+    tracing.reset_stats()
+    tracing.enable()
+    prof.start()
+    context.application.create_task(_finish_profile(context, update.effective_chat.id, prof, seconds))
+    await update.message.reply_text(f"Профилирую {seconds} с, отчёт пришлю сюда.")
+
+async def _finish_profile(context: ContextTypes.DEFAULT_TYPE, chat_id: int, prof: SamplingProfiler, seconds: int):
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        await asyncio.to_thread(prof.stop)
+        tracing.disable()
+
+    text = prof.report() + "\n\nСпаны апдейтов:\n" + tracing.format_stats()
+    await context.bot.send_message(chat_id=chat_id, text=text[:4096])
+    if prof.stacks:
+        name = "profile-" + datetime.fromtimestamp(prof.started).strftime("%Y%m%d-%H%M%S") + ".folded"
+        await context.bot.send_document(
+            chat_id=chat_id,
+            document=io.BytesIO(prof.collapsed().encode("utf-8")),
+            filename=name,
+            caption="Collapsed stacks: flamegraph.pl или speedscope.app",
+        )
+
+async def cmd_memory(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/memory — how much the in-memory client sessions cost."""
+    user = update.effective_user
+    if not user or user.id not in context.bot_data["config"].manager_ids:
+        return
+
+    store = context.bot_data["catalogs"]
+    r = memory_report(context.bot_data["sessions"], shared=[c.__dict__ for c in store.versions.values()])
+    await update.message.reply_text(
+        f"Сессии в памяти: {r['in_memory']} (лимит {r['capacity']}), с данными: {r['active']}\n"
+        f"На диске: {r['on_disk']} (выгружено {r['spilled']}, поднято {r['loaded']})\n"
+        f"На сессию: в среднем {r['bytes_avg']} Б, максимум {r['bytes_max']} Б, "
+        f"всего {r['bytes_total'] / 1024:.1f} КБ\n"
+        f"Пик RSS процесса: {r['max_rss_kb'] / 1024:.1f} МБ"
+    )
+
+BROADCAST_USAGE = (
+    "Рассылка клиентам, которые оставляли заявки:\n"
+    "/broadcast all Текст — всем\n"
+    "/broadcast услуга Текст — тем, кто спрашивал услугу ({keys})\n"
+    "/broadcast stop — пауза, /broadcast resume — продолжить"
+)
+
+async def _start_broadcast(context: ContextTypes.DEFAULT_TYPE, broadcast_id: int, allowed_from: tuple, stats_message):
+    """None when the broadcast is running here, otherwise what to tell the manager."""
+    config = context.bot_data["config"]
+    broadcaster = context.bot_data["broadcaster"]
+    # one at a time: they all share the bot's send limit
+    running = await db.writer.run(config.db_path, db.latest_broadcast, ("running",))
+    if running is not None:
+        return f"Уже идёт рассылка #{running['id']}. Пауза: /broadcast stop"
+    if broadcaster.busy:
+        # a paused broadcast stops after its current window
+        return "Предыдущая рассылка ещё останавливается, попробуйте через минуту."
+    if not await db.writer.run(config.db_path, db.set_broadcast_status, broadcast_id, "running", allowed_from):
+        return "Рассылка уже запущена или отменена."
+    await db.writer.run(
+        config.db_path, db.set_broadcast_stats_message, broadcast_id, stats_message.chat_id, stats_message.message_id,
+    )
+    if not await broadcaster.start(broadcast_id):
+        # another worker claimed it first, or the resume loop in worker 0 will
+        logger.info("Broadcast queued", extra={"broadcast_id": broadcast_id, "manager_id": stats_message.chat_id})
+        return f"Рассылка #{broadcast_id} в очереди: начнётся в течение {LEASE_SEC // 60} мин."
+    logger.info("Broadcast confirmed", extra={"broadcast_id": broadcast_id, "manager_id": stats_message.chat_id})
+    return None
+
+async def cmd_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/broadcast all|<service> text — an offer to past clients; /broadcast stop|resume."""
+    user = update.effective_user
+    config = context.bot_data["config"]
+    if not user or user.id not in config.manager_ids:
+        return
+
+    msg = update.message
+    # split the raw text, context.args would lose the line breaks
+    parts = msg.text.split(None, 2)
+    action = parts[1] if len(parts) > 1 else ""
+
+    if action == "stop":
+        row = await db.writer.run(config.db_path, db.latest_broadcast, ("running",))
+        if row is None or not await db.writer.run(
+            config.db_path, db.set_broadcast_status, row["id"], "paused", ("running",),
+        ):
+            await msg.reply_text("Сейчас ничего не рассылается.")
+            return
+        await msg.reply_text(f"Рассылка #{row['id']} на паузе. Продолжить: /broadcast resume")
+        return
+
+    if action == "resume":
+        row = await db.writer.run(config.db_path, db.latest_broadcast, ("paused",))
+        if row is None:
+            await msg.reply_text("Нет рассылок на паузе.")
+            return
+        row["status"] = "running"
+        stats = await msg.reply_text(stats_text(row))
+        error = await _start_broadcast(context, row["id"], ("paused",), stats)
+        if error:
+            await stats.edit_text(error)
+        return
+
+    catalog = context.bot_data["catalogs"].current
+    if action != "all" and action not in catalog.labels or len(parts) < 3:
+        row = await db.writer.run(config.db_path, db.latest_broadcast)
+        text = BROADCAST_USAGE.format(keys=", ".join(key for key, _ in catalog.services))
+        await msg.reply_text(stats_text(row) + "\n\n" + text if row else text)
+        return
+
+    service = None if action == "all" else action
+    text = parts[2]
+    broadcast_id = await db.writer.run(config.db_path, db.create_broadcast, user.id, service, text)
+    row = await db.writer.run(config.db_path, db.get_broadcast, broadcast_id)
+    audience = "все клиенты" if service is None else catalog.labels[service]
+    await msg.reply_text(
+        f"Рассылка #{broadcast_id} ({audience}), получателей: {row['total']}. Текст:\n\n{text}",
+        reply_markup=broadcast_kb(broadcast_id),
+    )
+
+async def cb_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    config = context.bot_data["config"]
+    if update.effective_user.id not in config.manager_ids:
+        await q.answer("Только для менеджеров.")
+        return
+    _, action, raw_id = q.data.split(":")
+    broadcast_id = int(raw_id)
+
+    if action == "cancel":
+        if not await db.writer.run(config.db_path, db.set_broadcast_status, broadcast_id, "cancelled", ("draft",)):
+            await q.answer("Рассылка уже запущена или отменена.")
+            return
+        await q.answer("Отменено.")
+        await q.edit_message_reply_markup(None)
+        return
+
+    error = await _start_broadcast(context, broadcast_id, ("draft",), q.message)
+    if error:
+        await q.answer(error, show_alert=True)
+        return
+    await q.answer("Рассылка запущена.")
+    row = await db.writer.run(config.db_path, db.get_broadcast, broadcast_id)
+    await q.edit_message_text(stats_text(row))
+
+# -------------------- APP --------------------
+def build_app(config, catalog=DEFAULT_CATALOG, request=None, get_updates_request=None):
+    db.init_db(config.db_path)
+    if config.catalog_file:
+        catalog = load_catalog(config.catalog_file)  # a broken file stops the start, not a reload
+    keyboards.precompute(catalog, config.works_channel_url)
+
+    if config.trace:
+        tracing.enable()
+
+    builder = (
+        Application.builder()
+        .token(config.bot_token)
+        # context.user_data comes from the bounded SessionStore, not from
+        # PTB's user_data defaultdict, which never shrinks
+        .context_types(ContextTypes(context=SessionContext, user_data=LeadDraft))
+        .base_url(config.api_base_url)
+        .post_init(jobs.start_jobs)
+        .post_stop(jobs.stop_jobs)
+    )
+    if request is None:
+        request = api_request(config.api_pool_size, config.api_keepalive_sec, config.api_http2)
+    builder = builder.request(TracedRequest(request))
+    builder = builder.get_updates_request(get_updates_request or polling_request(config.api_keepalive_sec))
+    app = builder.build()
+    app.bot_data["config"] = config
+    app.bot_data["catalogs"] = CatalogStore(catalog, config.catalog_file or None)
+    app.bot_data["bridge"] = MessageIndex(config.db_path)
+    app.bot_data["broadcaster"] = Broadcaster(app.bot, config.db_path, config.broadcast_rate)
+    assigner = Assigner(config.manager_ids, config.assign_mode)
+    assigner.rebuild(*db.assignment_state(config.db_path))
+    for m in db.list_managers(config.db_path):
+        assigner.names[m["tg_user_id"]] = "@" + m["tg_username"] if m["tg_username"] else m["name"]
+    app.bot_data["assigner"] = assigner
+
+    timeout = config.session_timeout_min * 60 or None
+    store = SessionStore(
+        config.db_path, config.sessions_in_memory, max_age=timeout and 2 * timeout,
+        factory=LeadDraft, dumps=LeadDraft.to_bytes, loads=LeadDraft.from_bytes,
+    )
+    app.bot_data["sessions"] = store
+
+    conv = ConversationHandler(
+        entry_points=[
+            CommandHandler("start", cmd_start),
+            CommandHandler("restart", cmd_restart),
+            CallbackQueryHandler(cb_resume, pattern=r"^resume$"),
+            CallbackQueryHandler(cb_restart, pattern=r"^restart$"),
+        ],
+        states={
+            S_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, on_name)],
+            S_CAR: [MessageHandler(filters.TEXT & ~filters.COMMAND, on_car)],
+
+            # ВАЖНО: fixed pattern — теперь ловит svc:toning и т.д.
+            S_SERVICES: [CallbackQueryHandler(cb_services, pattern=r"^(svc:.*|svc_done|svc_reset)$")],
+
+            S_SVC_FLOW: [
+                CallbackQueryHandler(cb_flow),
+                MessageHandler(filters.PHOTO, on_photo),
+            ],
+
+            S_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, on_time)],
+
+            S_CONTACT: [
+                MessageHandler(filters.CONTACT, on_contact),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, on_contact),
+            ],
+
+            S_DONE: [
+                CallbackQueryHandler(cb_restart, pattern=r"^restart$"),
+                CommandHandler("start", cmd_start),
+            ],
+
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, on_timeout)],
+        },
+        fallbacks=[CommandHandler("cancel", cmd_cancel)],
+        allow_reentry=True,
+        conversation_timeout=timeout,
+    )
+
+    app.bot_data["conversation"] = conv
+    for state, handlers in conv.states.items():
+        for h in handlers:
+            h.callback = logs.traced(tracing.traced(h.callback), STATE_NAMES[state])
+    for h in conv.entry_points + conv.fallbacks:
+        h.callback = logs.traced(tracing.traced(h.callback), None)
+
+    # a spilled form is back in memory before any handler reads user_data
+    app.add_handler(TypeHandler(Update, store.prefetch), group=-4)
+    if config.record_updates:
+        recorder = app.bot_data["recorder"] = Recorder(config.record_updates, config.manager_ids)
+        app.add_handler(TypeHandler(Update, recorder), group=-3)
+    app.add_handler(TypeHandler(Update, logs.bind_update), group=-2)
+    managers = filters.User(user_id=config.manager_ids)
+    private = filters.UpdateType.MESSAGE & filters.ChatType.PRIVATE & ~filters.COMMAND
+    app.add_handler(MessageHandler(
+        private & managers & filters.REPLY, logs.traced(tracing.traced(on_manager_reply), None),
+    ), group=-1)
+    app.add_handler(CallbackQueryHandler(logs.traced(tracing.traced(cb_claim), None), pattern=r"^claim:\d+$"))
+    app.add_handler(CallbackQueryHandler(logs.traced(tracing.traced(cb_close), None), pattern=r"^close:\d+$"))
+    app.add_handler(CallbackQueryHandler(
+        logs.traced(tracing.traced(cb_broadcast), None), pattern=r"^bcast:(go|cancel):\d+$",
+    ))
+    app.add_handler(conv)
+    app.add_handler(MessageHandler(
+        private & ~managers, logs.traced(tracing.traced(on_client_message), None),
+    ))
+    app.add_handler(CommandHandler("profile", logs.traced(cmd_profile, None)))
+    app.add_handler(CommandHandler("memory", logs.traced(cmd_memory, None)))
+    app.add_handler(CommandHandler("broadcast", logs.traced(cmd_broadcast, None)))
+    return app
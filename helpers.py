@@ -0,0 +1,98 @@
+import re
+from datetime import datetime, timedelta
+
+# -------------------- HELPERS --------------------
+def now_local():
+    return datetime.now()
+
+def clean_text(s):
+    return (s or "").strip()
+
+def normalize_phone(s):
+    if not s:
+        return None
+    s = s.strip()
+    digits_plus = re.sub(r"[^\d+]", "", s)
+    only_digits = re.sub(r"\D", "", digits_plus)
+
+    if len(only_digits) < 10:
+        return None
+
+    # RU normalize
+    if digits_plus.startswith("8") and len(only_digits) == 11:
+        return "+7" + only_digits[1:]
+    if digits_plus.startswith("7") and len(only_digits) == 11:
+        return "+7" + only_digits[1:]
+    if digits_plus.startswith("+7") and len(only_digits) == 11:
+        return "+7" + only_digits[-10:]
+    if len(only_digits) == 10:
+        return "+7" + only_digits
+
+    return None
+
+def parse_datetime_ru(s):
+    """
+    Support:
+    - "сегодня 18:00"
+    - "завтра 12:30"
+    - "25.12 14:00" or "25.12.2025 14:00"
+    """
+    txt = clean_text(s).lower()
+    if not txt:
+        return None
+    if "вчера" in txt:
+        return None
+
+    base = now_local()
+    date = base.date()
+
+    if "сегодня" in txt:
+        date = base.date()
+        txt = txt.replace("сегодня", "").strip()
+    elif "завтра" in txt:
+        date = (base + timedelta(days=1)).date()
+        txt = txt.replace("завтра", "").strip()
+    elif "послезавтра" in txt:
+        date = (base + timedelta(days=2)).date()
+        txt = txt.replace("послезавтра", "").strip()
+
+    m_time = re.search(r"(\d{1,2})[:.](\d{2})", txt)
+    if not m_time:
+        return None
+    hh = int(m_time.group(1))
+    mm = int(m_time.group(2))
+    if hh > 23 or mm > 59:
+        return None
+
+    m_date = re.search(r"(\d{1,2})[./-](\d{1,2})(?:[./-](\d{2,4}))?", txt)
+    if m_date:
+        dd = int(m_date.group(1))
+        mo = int(m_date.group(2))
+        yy = m_date.group(3)
+        if yy:
+            yy = int(yy)
+            if yy < 100:
+                yy += 2000
+        else:
+            yy = base.year
+        try:
+            date = datetime(yy, mo, dd).date()
+        except ValueError:
+            return None
+
+    try:
+        dt = datetime(date.year, date.month, date.day, hh, mm)
+    except ValueError:
+        return None
+
+    # if entered dd.mm without year and date already past -> next year
+    if m_date and not m_date.group(3) and dt.date() < base.date():
+        try:
+            dt = datetime(base.year + 1, dt.month, dt.day, dt.hour, dt.minute)
+        except ValueError:
+            pass
+
+    return dt
+
+def is_future_time(dt):
+    return dt > now_local() + timedelta(minutes=5)
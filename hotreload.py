@@ -0,0 +1,318 @@
+"""
+Catalogue from a file, reloaded while the bot runs.
+
+CATALOG_FILE points at a JSON file with the services and their questions,
+the toning areas and percentages, the upsell rules and the scoring weights
+(start from `python hotreload.py dump`):
+
+    {
+      "services": [
+        {"key": "toning", "label": "Тонировка", "steps": [
+          {"type": "toning_areas", "key": "toning_areas", "card": "Зоны", "text": "Какие зоны ..."},
+          {"type": "yesno", "key": "toning_old_film", "kb_prefix": "toning_old", "text": "..."}
+        ]},
+        ...
+      ],
+      "toning_areas": [["rear_hemi", "Полусфера зад"], ...],
+      "toning_percents": ["2%", "5%", ...],
+      "upsells": [{"if": "body_polish", "service": "ceramic", "title": "...", "reason": "..."}],
+      "scoring": {"phone": 2, "services": {"ceramic": 2}, "hot": 7, ...}
+    }
+
+Question texts are written without the "**Service**" heading; it is added
+when the file is compiled. Anything left out of "scoring" keeps the
+built-in weight.
+
+The watcher checks the file's mtime every CATALOG_POLL_SEC. A changed file
+is parsed, validated and compiled (keyboards included) in a worker thread,
+and only a catalogue that passed everything replaces the current one, in a
+single assignment on the event loop. A broken file is logged and ignored.
+Every version stays in CatalogStore for the life of the process, and a
+form keeps the version it started with (LeadDraft.catalog_version), so
+edits only reach forms started after them. The version is a hash of the
+file, so the same file gives the same version after a restart.
+
+    python hotreload.py dump > catalog.json     # the built-in catalogue as a file
+    python hotreload.py check catalog.json
+"""
+import os
+import re
+import sys
+import json
+import asyncio
+import hashlib
+import logging
+import argparse
+
+import keyboards
+from catalog import DEFAULT_CATALOG, SCORING, Catalog
+
+logger = logging.getLogger("rks_bot.catalog")
+
+POLL_SEC = 5
+STEP_TYPES = {"info", "choice", "yesno", "toning_areas", "toning_percent", "photos"}
+
+_KEY = re.compile(r"^[a-z0-9_]+$")
+# Telegram limits callback_data to 64 bytes
+_CALLBACK_MAX = 64
+# LeadDraft packs services into 64 bits and toning areas into 8
+_MAX_SERVICES = 64
+_MAX_AREAS = 8
+
+
+# -------------------- validation --------------------
+def _fail(where, msg):
+    raise ValueError(f"{where}: {msg}")
+
+def _text(where, value):
+    if not isinstance(value, str) or not value.strip():
+        _fail(where, "must be a non-empty string")
+    return value
+
+def _callback(where, data):
+    if len(data.encode("utf-8")) > _CALLBACK_MAX:
+        _fail(where, f"too long for a button ({data!r})")
+
+def _markdown(where, text):
+    # the flow is sent with legacy Markdown; an unpaired marker fails the send
+    for mark in "*_`":
+        if text.count(mark) % 2:
+            _fail(where, f"unpaired {mark!r} in text")
+
+def _pairs(where, value):
+    if not isinstance(value, list) or not value:
+        _fail(where, "must be a non-empty list of [key, label]")
+    out, seen = [], set()
+    for i, item in enumerate(value):
+        if not (isinstance(item, list) and len(item) == 2):
+            _fail(f"{where}[{i}]", "must be [key, label]")
+        key, label = item
+        if not isinstance(key, str) or not _KEY.match(key) or key in seen:
+            _fail(f"{where}[{i}]", f"bad or duplicate key {key!r}")
+        seen.add(key)
+        out.append((key, _text(f"{where}[{i}]", label)))
+    return out
+
+def _step(where, raw, label, question_keys, prefixes):
+    if not isinstance(raw, dict):
+        _fail(where, "must be an object")
+    stype = raw.get("type")
+    if stype not in STEP_TYPES:
+        _fail(where, f"type must be one of {sorted(STEP_TYPES)}")
+    key = raw.get("key")
+    if not isinstance(key, str) or not _KEY.match(key) or key in question_keys:
+        # answers are one flat dict per form, so keys are unique catalogue-wide
+        _fail(where, f"bad or duplicate key {key!r}")
+    question_keys.add(key)
+    text = _text(where + ".text", raw.get("text"))
+
+    step = {"type": stype, "key": key}
+    if stype == "info":
+        step["text"] = text
+    else:
+        step["text"] = f"**{label}**\n{text}"
+    _markdown(where + ".text", step["text"])
+
+    if stype == "choice":
+        options = raw.get("options")
+        if not isinstance(options, list) or not options:
+            _fail(where + ".options", "must be a non-empty list")
+        step["options"] = [_text(f"{where}.options[{i}]", o) for i, o in enumerate(options)]
+        _callback(where, f"ch:{key}:{len(options) - 1}")
+    elif stype == "yesno":
+        prefix = raw.get("kb_prefix")
+        if not isinstance(prefix, str) or not _KEY.match(prefix) or prefix in prefixes:
+            _fail(where + ".kb_prefix", f"bad or duplicate prefix {prefix!r}")
+        prefixes.add(prefix)
+        step["kb_prefix"] = prefix
+        _callback(where, prefix + ":yes")
+
+    for name in ("when", "card_notes"):
+        if name in raw:
+            value = raw[name]
+            if not isinstance(value, dict) or not all(isinstance(v, str) for v in value.values()):
+                _fail(f"{where}.{name}", "must map strings to strings")
+            step[name] = dict(value)
+    if "card" in raw:
+        step["card"] = _text(where + ".card", raw["card"])
+    return step
+
+def compile_spec(spec, version="file"):
+    """A Catalog from a parsed catalogue file; ValueError says what is wrong."""
+    if not isinstance(spec, dict):
+        _fail("catalog", "must be an object")
+    raw_services = spec.get("services")
+    if not isinstance(raw_services, list) or not raw_services:
+        _fail("services", "must be a non-empty list")
+    if len(raw_services) > _MAX_SERVICES:
+        _fail("services", f"at most {_MAX_SERVICES}")
+
+    services, flows = [], {}
+    question_keys, prefixes = set(), set()
+    for i, raw in enumerate(raw_services):
+        where = f"services[{i}]"
+        if not isinstance(raw, dict):
+            _fail(where, "must be an object")
+        key = raw.get("key")
+        if not isinstance(key, str) or not _KEY.match(key) or key in flows:
+            _fail(where, f"bad or duplicate key {key!r}")
+        _callback(where, "svc:" + key)
+        label = _text(where + ".label", raw.get("label"))
+        services.append((key, label))
+        flows[key] = [
+            _step(f"{where}.steps[{j}]", step, label, question_keys, prefixes)
+            for j, step in enumerate(raw.get("steps") or [])
+        ]
+
+    for key, steps in flows.items():
+        for step in steps:
+            for ref in step.get("when", {}):
+                if ref not in question_keys:
+                    _fail(f"{key}.{step['key']}.when", f"unknown question {ref!r}")
+
+    areas = _pairs("toning_areas", spec.get("toning_areas", [list(a) for a in DEFAULT_CATALOG.toning_areas]))
+    if len(areas) > _MAX_AREAS:
+        _fail("toning_areas", f"at most {_MAX_AREAS}")
+    for key, _ in areas:
+        _callback("toning_areas", "ta:" + key)
+
+    percents = spec.get("toning_percents", list(DEFAULT_CATALOG.toning_percents))
+    if not isinstance(percents, list) or not percents:
+        _fail("toning_percents", "must be a non-empty list")
+    for i, p in enumerate(percents):
+        _callback(f"toning_percents[{i}]", "tp:" + _text(f"toning_percents[{i}]", p))
+
+    upsells = []
+    for i, rule in enumerate(spec.get("upsells", [])):
+        where = f"upsells[{i}]"
+        if not isinstance(rule, dict):
+            _fail(where, "must be an object")
+        if rule.get("if") not in flows:
+            _fail(where + ".if", f"unknown service {rule.get('if')!r}")
+        upsells.append({
+            "if": rule["if"],
+            "service": _text(where + ".service", rule.get("service")),
+            "title": _text(where + ".title", rule.get("title")),
+            "reason": _text(where + ".reason", rule.get("reason")),
+            "unless_answer": dict(rule.get("unless_answer") or {}),
+        })
+
+    scoring = dict(SCORING, services=dict(SCORING["services"]))
+    for name, value in (spec.get("scoring") or {}).items():
+        if name not in SCORING:
+            _fail("scoring", f"unknown weight {name!r}")
+        if name == "services":
+            if not isinstance(value, dict) or not all(isinstance(v, (int, float)) for v in value.values()):
+                _fail("scoring.services", "must map service keys to numbers")
+            scoring["services"] = dict(value)
+        elif not isinstance(value, (int, float)) or isinstance(value, bool):
+            _fail(f"scoring.{name}", "must be a number")
+        else:
+            scoring[name] = value
+    if scoring["hot"] < scoring["warm"]:
+        _fail("scoring", "hot must not be below warm")
+
+    return Catalog(services, flows, areas, percents, upsells, scoring, version)
+
+def load_catalog(path):
+    """Read, validate and compile `path`; also builds the catalogue's keyboards."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    try:
+        spec = json.loads(raw)
+    except ValueError as e:
+        raise ValueError(f"{path}: not valid JSON: {e}") from None
+    catalog = compile_spec(spec, hashlib.sha256(raw).hexdigest()[:12])
+    for key, _ in catalog.services:
+        catalog.build_flow((key,))
+    keyboards.precompute_catalog(catalog)
+    return catalog
+
+def dump_spec(catalog):
+    """The inverse of compile_spec, for writing a catalogue out as a file."""
+    services = []
+    for key, label in catalog.services:
+        steps = []
+        for step in catalog.flows[key]:
+            out = dict(step)
+            heading = f"**{label}**\n"
+            if out["type"] != "info" and out["text"].startswith(heading):
+                out["text"] = out["text"][len(heading):]
+            steps.append(out)
+        services.append({"key": key, "label": label, "steps": steps})
+    return {
+        "services": services,
+        "toning_areas": [list(a) for a in catalog.toning_areas],
+        "toning_percents": list(catalog.toning_percents),
+        "upsells": [dict(u) for u in catalog.upsells],
+        "scoring": catalog.scoring,
+    }
+
+
+# -------------------- live swapping --------------------
+class CatalogStore:
+    """The current catalogue plus every version handed out in this process."""
+
+    def __init__(self, catalog, path=None):
+        self.current = catalog
+        self.path = path
+        self.stamp = _stamp(path) if path else None
+        self.versions = {catalog.version: catalog}
+
+    def get(self, version):
+        return self.versions.get(version)
+
+    def swap(self, catalog):
+        self.versions.setdefault(catalog.version, catalog)
+        self.current = self.versions[catalog.version]
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+async def watch(store, interval=POLL_SEC):
+    while True:
+        await asyncio.sleep(interval)
+        stamp = _stamp(store.path)
+        if stamp is None or stamp == store.stamp:
+            continue
+        store.stamp = stamp
+        try:
+            catalog = await asyncio.to_thread(load_catalog, store.path)
+        except Exception as e:
+            logger.error("Catalogue not reloaded, keeping %s: %s", store.current.version, e)
+            continue
+        if catalog.version == store.current.version:
+            continue
+        old = store.current.version
+        store.swap(catalog)
+        logger.info("Catalogue reloaded", extra={"version": catalog.version, "previous": old,
+                                                 "services": len(catalog.services)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Catalogue file tools")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("dump", help="print the built-in catalogue as a catalogue file")
+    check = sub.add_parser("check", help="validate a catalogue file")
+    check.add_argument("path")
+    args = parser.parse_args()
+
+    if args.cmd == "dump":
+        json.dump(dump_spec(DEFAULT_CATALOG), sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return
+    try:
+        catalog = load_catalog(args.path)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    steps = sum(len(s) for s in catalog.flows.values())
+    print(f"ok: version {catalog.version}, {len(catalog.services)} services, {steps} steps")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+"""
+Bulk import of leads collected before the bot, from a CSV or XLSX export.
+
+    python import_leads.py leads.csv
+    python import_leads.py leads.xlsx --sheet Заявки --rejects bad.csv
+    python import_leads.py leads.csv --column phone="Моб. телефон" --service "Тонировка стёкол=toning"
+
+The first row names the columns. Known headers (any case): имя/name,
+телефон/phone, авто/car, услуги/services, дата/date, комментарий/comment,
+tg id/tg_user_id, telegram/tg_username; --column maps any other header to
+one of these fields. Rows are read one at a time (XLSX in openpyxl's
+read-only mode; openpyxl has to be installed for .xlsx) and inserted with
+executemany, BATCH rows per transaction, so memory stays flat however long
+the file is and the bot can keep writing between batches.
+
+Every row needs a phone helpers.normalize_phone accepts. Services are
+SERVICE_LABEL keys or labels separated by commas or semicolons; --service
+maps other names. A row whose phone already has a lead on the same day, in
+the DB, in the archive (archive.py) or earlier in the file, is a duplicate
+and skipped, so importing the same file twice adds it once. A row without
+a date gets today's.
+
+Rejected rows go, with a "reason" column, to <file>.rejects.csv; fix them
+there and import that file.
+
+Imported leads get source "import". Without a Telegram id they are stored
+with tg_user_id 0 and get no broadcasts. They are history the CRM usually
+has already, so each batch moves the CRM sync cursor (crm.py) past its
+leads in the same transaction; --push-to-crm leaves the cursor alone and
+the sync pushes them like new leads. The cursor can only move while the
+sync has pushed every lead below the batch: if it is behind, the batch's
+leads are pushed too and the summary counts them as "to_crm".
+
+Leads dated more than ARCHIVE_AFTER_DAYS ago are moved to the archive by
+its next run, like any old lead: exports and broadcasts still find them,
+db.leads_for_service and a CRM sync that has not pushed them yet do not.
+The summary counts them as "to_archive" and warns; with --push-to-crm, run
+the CRM sync before the archive job.
+"""
+import os
+import re
+import sys
+import csv
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+from functools import lru_cache
+from operator import itemgetter
+
+import db
+from catalog import SERVICE_LABEL
+from crm import CURSOR as CRM_CURSOR
+from helpers import normalize_phone
+
+BATCH = 20000
+
+# field -> headers it is recognised by, lowercased
+COLUMNS = {
+    "name": ("name", "имя", "клиент", "фио"),
+    "phone": ("phone", "телефон", "тел", "номер"),
+    "car": ("car", "авто", "машина", "автомобиль"),
+    "services": ("services", "услуги", "услуга"),
+    "created_at": ("created_at", "date", "дата", "дата заявки"),
+    "comment": ("comment", "комментарий", "примечание"),
+    "tg_user_id": ("tg_user_id", "tg id", "telegram id"),
+    "tg_username": ("tg_username", "telegram", "tg", "username"),
+}
+
+# not "/": labels such as "Шлифовка/полировка стекла" contain it
+_SERVICES_SPLIT = re.compile(r"[,;\n]+")
+_RU_DATE = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{2}|\d{4})(?:\s+(\d{1,2}):(\d{2}))?$")
+_FIELDS = "created_at, tg_user_id, tg_username, name, phone, car, services_interest, comment_free, source"
+
+
+# -------------------- reading --------------------
+def _csv_rows(path, encoding):
+    with open(path, newline="", encoding=encoding) as f:
+        # Excel writes ";" with a Russian locale; the header row tells which one it is
+        header = f.readline()
+        delimiter = max(";,\t", key=header.count)
+        f.seek(0)
+        yield from csv.reader(f, delimiter=delimiter)
+
+def _xlsx_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # phones and ids typed into a spreadsheet as numbers
+    return str(value)
+
+def _xlsx_rows(path, sheet):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise SystemExit("reading .xlsx needs openpyxl: pip install openpyxl") from None
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet] if sheet else wb.active
+        for row in ws.iter_rows(values_only=True):
+            yield [_xlsx_cell(v) for v in row]
+    finally:
+        wb.close()
+
+def read_rows(path, sheet=None, encoding="utf-8-sig"):
+    """Rows of the file as lists of strings, header first."""
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        return _xlsx_rows(path, sheet)
+    return _csv_rows(path, encoding)
+
+def header_map(header, overrides=None):
+    """{field: column index} for a header row; overrides: {field: header}."""
+    names = {str(h).strip().lower(): i for i, h in enumerate(header)}
+    cols = {}
+    for field, aliases in COLUMNS.items():
+        if overrides and field in overrides:
+            aliases = (overrides[field].strip().lower(),)
+        for alias in aliases:
+            if alias in names:
+                cols[field] = names[alias]
+                break
+    if "phone" not in cols:
+        raise ValueError("no phone column (use --column phone=<header>)")
+    return cols
+
+def service_map(extra=None):
+    """Lowercased service name or key -> SERVICE_LABEL key; extra: {name: key}."""
+    out = {key: key for key in SERVICE_LABEL}
+    out.update({label.lower(): key for key, label in SERVICE_LABEL.items()})
+    for name, key in (extra or {}).items():
+        if key not in SERVICE_LABEL:
+            raise ValueError(f"unknown service key {key!r}")
+        out[name.strip().lower()] = key
+    return out
+
+
+# -------------------- rows --------------------
+def row_picker(cols):
+    """row -> its cells for the fields of COLUMNS, in that order ("" where a column is missing)."""
+    width = max(cols.values()) + 1
+    # a missing field reads the empty cell appended at index `width`
+    get = itemgetter(*(cols.get(field, width) for field in COLUMNS))
+    pad = [""] * (width + 1)
+
+    def pick(row):
+        return get(row + pad[len(row):] if len(row) <= width else row)
+    return pick
+
+@lru_cache(maxsize=4096)  # a sheet has few distinct dates
+def _date(value):
+    m = _RU_DATE.match(value)
+    try:
+        if m:
+            day, month, year, hh, mm = m.groups()
+            year = int(year) + 2000 if len(year) == 2 else int(year)
+            return datetime(year, int(month), int(day), int(hh or 0), int(mm or 0)).isoformat()
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"bad date {value!r}") from None
+
+def parse_row(cells, services, today, source="import"):
+    """(leads row in _FIELDS order, service keys) from row_picker() cells;
+    ValueError says why the row is rejected."""
+    name, raw_phone, car, service_names, created, comment, tg_id, tg_username = cells
+    phone = normalize_phone(raw_phone)
+    if not phone:
+        raise ValueError(f"bad phone {raw_phone.strip()!r}" if raw_phone.strip() else "no phone")
+
+    keys = []
+    if service_names:
+        for label in _SERVICES_SPLIT.split(service_names.lower()):
+            label = label.strip()
+            if not label:
+                continue
+            key = services.get(label)
+            if key is None:
+                raise ValueError(f"unknown service {label!r}")
+            if key not in keys:
+                keys.append(key)
+
+    tg_id = tg_id.strip()
+    if tg_id and not tg_id.isdigit():
+        raise ValueError(f"bad tg id {tg_id!r}")
+    created = created.strip()
+
+    lead = (
+        _date(created) if created else today,
+        int(tg_id or 0),
+        tg_username.strip().lstrip("@") or None,
+        name.strip() or None,
+        phone,
+        car.strip() or None,
+        ",".join(keys) or None,
+        comment.strip() or None,
+        source,
+    )
+    return lead, keys
+
+
+class Rejects:
+    """CSV of rejected rows with a "reason" column, created on the first one."""
+
+    def __init__(self, path, header):
+        self.path = path
+        self.header = list(header)
+        self.count = 0
+        self._f = self._w = None
+
+    def add(self, row, reason):
+        if self._f is None:
+            self._f = open(self.path, "w", newline="", encoding="utf-8-sig")
+            self._w = csv.writer(self._f)
+            self._w.writerow(self.header + ["reason"])
+        self._w.writerow(list(row) + [""] * (len(self.header) - len(row)) + [reason])
+        self.count += 1
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+
+
+# -------------------- writing --------------------
+def _existing(conn, phones):
+    """(phone, day) of the leads already stored for these phones, hot or archived."""
+    found = set()
+    phones = list(phones)
+    for i in range(0, len(phones), 500):
+        chunk = phones[i:i + 500]
+        marks = ",".join("?" * len(chunk))
+        found.update(conn.execute(f"""
+        SELECT phone, substr(created_at, 1, 10) FROM leads WHERE phone IN ({marks})
+        UNION
+        SELECT phone, day FROM archived_phones WHERE phone IN ({marks})
+        """, chunk * 2))
+    return found
+
+def insert_batch(conn, batch, move_crm_cursor=True):
+    """Insert parsed rows in one transaction; (ids of the new leads,
+    duplicates skipped, whether the CRM cursor was moved past them)."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        seen = _existing(conn, {lead[4] for lead, _ in batch})
+        fresh = []
+        for lead, keys in batch:
+            day = (lead[4], lead[0][:10])
+            if day not in seen:
+                seen.add(day)
+                fresh.append((lead, keys))
+        # in date order, so the created_at indexes are written in runs and ids follow the dates
+        fresh.sort(key=lambda item: item[0][0])
+        # the write lock is ours, so the new leads are exactly the ids above this
+        last = conn.execute("SELECT IFNULL(MAX(id), 0) FROM leads").fetchone()[0]
+        conn.executemany(
+            f"INSERT INTO leads ({_FIELDS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [lead for lead, _ in fresh],
+        )
+        ids = [r[0] for r in conn.execute("SELECT id FROM leads WHERE id > ? ORDER BY id", (last,))]
+        conn.executemany(
+            "INSERT INTO lead_services (lead_id, service_key, created_at) VALUES (?, ?, ?)",
+            [(lead_id, key, lead[0]) for lead_id, (lead, keys) in zip(ids, fresh) for key in keys],
+        )
+        # only while the sync is caught up: moving it past unsent bot leads would lose them
+        moved = move_crm_cursor and bool(ids) and db.get_cursor(conn, CRM_CURSOR) >= last
+        if moved:
+            db.set_cursor(conn, CRM_CURSOR, ids[-1])
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return ids, len(batch) - len(fresh), moved
+
+def import_rows(db_path, rows, cols, services, rejects, batch_size=BATCH, source="import", archive_after_days=0,
+                push_to_crm=False):
+    """Parse and insert `rows` (the header already consumed); returns counters."""
+    stats = {
+        "read": 0, "imported": 0, "duplicates": 0, "rejected": 0, "to_archive": 0, "to_crm": 0,
+        "first_id": None, "last_id": None,
+    }
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
+    conn = db._connect(db_path)
+    conn.execute("PRAGMA synchronous = NORMAL")  # a power cut may lose the last batch; a re-run adds it
+    conn.execute("PRAGMA cache_size = -65536")  # 64 MB: the index pages a batch touches stay cached
+    try:
+        pick = row_picker(cols)
+        batch = []
+        for row in rows:
+            if not "".join(row).strip():
+                continue
+            stats["read"] += 1
+            try:
+                batch.append(parse_row(pick(row), services, today, source))
+            except ValueError as e:
+                rejects.add(row, str(e))
+                stats["rejected"] += 1
+                continue
+            if len(batch) >= batch_size:
+                _flush(conn, batch, stats, push_to_crm)
+                batch = []
+        if batch:
+            _flush(conn, batch, stats, push_to_crm)
+        if archive_after_days > 0 and stats["first_id"] is not None:
+            cutoff = (datetime.utcnow() - timedelta(days=archive_after_days)).isoformat()
+            stats["to_archive"] = conn.execute(
+                "SELECT COUNT(*) FROM leads WHERE id BETWEEN ? AND ? AND source = ? AND created_at < ?",
+                (stats["first_id"], stats["last_id"], source, cutoff),
+            ).fetchone()[0]
+    finally:
+        conn.close()
+    return stats
+
+def _flush(conn, batch, stats, push_to_crm):
+    ids, duplicates, moved = insert_batch(conn, batch, not push_to_crm)
+    stats["imported"] += len(ids)
+    stats["duplicates"] += duplicates
+    if not moved:
+        stats["to_crm"] += len(ids)
+    if ids:
+        if stats["first_id"] is None:
+            stats["first_id"] = ids[0]
+        stats["last_id"] = ids[-1]
+
+
+def _pairs(items, what):
+    out = {}
+    for item in items:
+        name, sep, value = item.partition("=")
+        if not sep or not name.strip() or not value.strip():
+            raise SystemExit(f"{what} must look like NAME=VALUE: {item!r}")
+        out[name.strip()] = value.strip()
+    return out
+
+def main():
+    parser = argparse.ArgumentParser(description="Import leads from a CSV/XLSX file")
+    parser.add_argument("path")
+    parser.add_argument("--db", default=os.getenv("DB_PATH", "rks.db"))
+    parser.add_argument("--sheet", help="XLSX sheet (the active one by default)")
+    parser.add_argument("--encoding", default="utf-8-sig", help="CSV encoding; older Excel writes cp1251")
+    parser.add_argument("--rejects", help="where rejected rows go (default <path>.rejects.csv)")
+    parser.add_argument("--column", action="append", default=[], metavar="FIELD=HEADER",
+                        help=f"header of a field; fields: {', '.join(COLUMNS)}")
+    parser.add_argument("--service", action="append", default=[], metavar="NAME=KEY",
+                        help="another name for a service key")
+    parser.add_argument("--source", default="import")
+    parser.add_argument("--batch", type=int, default=BATCH, help="rows per transaction")
+    parser.add_argument("--archive-after-days", type=int, default=int(os.getenv("ARCHIVE_AFTER_DAYS", "180")),
+                        help="only counted: leads older than this go to the archive on its next run")
+    parser.add_argument("--push-to-crm", action="store_true",
+                        help="let the CRM sync push the imported leads (by default its cursor skips them)")
+    args = parser.parse_args()
+
+    columns = _pairs(args.column, "--column")
+    unknown = set(columns) - set(COLUMNS)
+    if unknown:
+        parser.error(f"unknown fields: {', '.join(sorted(unknown))}")
+
+    started = time.perf_counter()
+    db.init_db(args.db)
+    rows = read_rows(args.path, args.sheet, args.encoding)
+    try:
+        header = next(rows, None)
+    except (OSError, UnicodeDecodeError) as e:
+        parser.error(str(e))
+    if header is None:
+        parser.error(f"{args.path} is empty")
+    try:
+        cols = header_map(header, columns)
+        services = service_map(_pairs(args.service, "--service"))
+    except ValueError as e:
+        parser.error(str(e))
+
+    rejects = Rejects(args.rejects or os.path.splitext(args.path)[0] + ".rejects.csv", header)
+    try:
+        stats = import_rows(
+            args.db, rows, cols, services, rejects, args.batch, args.source, args.archive_after_days,
+            args.push_to_crm,
+        )
+    finally:
+        rejects.close()
+    stats["rejects_file"] = rejects.path if rejects.count else None
+    stats["seconds"] = round(time.perf_counter() - started, 2)
+    print(json.dumps(stats, ensure_ascii=False))
+    if stats["rejected"]:
+        print(f"{stats['rejected']} rows rejected, see {rejects.path}", file=sys.stderr)
+    if stats["to_archive"]:
+        print(f"{stats['to_archive']} leads are older than {args.archive_after_days} days "
+              "and move to the archive on its next run", file=sys.stderr)
+    if stats["to_crm"] and not args.push_to_crm:
+        print(f"{stats['to_crm']} imported leads will be pushed to the CRM: "
+              "its sync had not sent every earlier lead yet, so its cursor was not moved", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+
+import archive
+import backup
+import hotreload
+from crm import CrmSync
+
+logger = logging.getLogger("rks_bot.jobs")
+
+# -------------------- BACKGROUND JOBS --------------------
+# Periodic maintenance runs in worker threads so it never blocks the loop.
+# build_app() wires start_jobs/stop_jobs as post_init/post_stop; modes that
+# drive the Application by hand (tenants, shards) call them directly.
+# In sharded mode every worker runs its own Application on the same
+# database: archival, backups, the CRM sync and resuming broadcasts run in
+# worker 0 only, the catalogue watcher in every worker.
+
+ARCHIVE_EVERY_SEC = 24 * 3600
+FIRST_RUN_DELAY_SEC = 60
+
+
+async def _every(name, first_delay, interval, fn, *args):
+    await asyncio.sleep(first_delay)
+    while True:
+        try:
+            result = await asyncio.to_thread(fn, *args)
+            logger.info("Job %s done: %s", name, result)
+        except Exception:
+            logger.exception("Job %s failed", name)
+        await asyncio.sleep(interval)
+
+
+async def start_jobs(app):
+    config = app.bot_data["config"]
+    leader = app.bot_data.get("worker", 0) == 0
+    tasks = []
+    store = app.bot_data.get("catalogs")
+    if store is not None and store.path:
+        tasks.append(asyncio.create_task(hotreload.watch(store, config.catalog_poll_sec)))
+    if not leader:
+        app.bot_data["jobs"] = tasks
+        return
+    if config.archive_after_days > 0:
+        tasks.append(asyncio.create_task(_every(
+            "archive", FIRST_RUN_DELAY_SEC, ARCHIVE_EVERY_SEC,
+            archive.archive_leads, config.db_path, config.archive_dir, config.archive_after_days,
+        )))
+    if config.backup_every_hours > 0:
+        tasks.append(asyncio.create_task(_every(
+            "backup", FIRST_RUN_DELAY_SEC, config.backup_every_hours * 3600,
+            backup.backup_db, config.db_path, backup.LocalStore(config.backup_dir), config.backup_keep,
+        )))
+    tasks.append(asyncio.create_task(app.bot_data["broadcaster"].run()))
+    if config.crm_url:
+        sync = CrmSync(config.crm_url, config.db_path, config.crm_token, config.crm_batch, config.crm_interval_sec)
+        app.bot_data["crm"] = sync
+        tasks.append(asyncio.create_task(sync.run()))
+    app.bot_data["jobs"] = tasks
+
+
+async def stop_jobs(app):
+    tasks = app.bot_data.pop("jobs", [])
+    for task in tasks:
+        task.cancel()
+    # let the CRM task close its HTTP client and the broadcaster release its lease
+    await asyncio.gather(*tasks, return_exceptions=True)
+    app.bot_data.pop("crm", None)
+    # a broadcast confirmed in a worker without the resume loop runs there too
+    await app.bot_data["broadcaster"].close()
+    sessions = app.bot_data.get("sessions")
+    if sessions is not None:
+        await sessions.close()  # evicted forms still queued for the DB
+    recorder = app.bot_data.get("recorder")
+    if recorder is not None:
+        await asyncio.to_thread(recorder.close)  # updates still queued for the file
@@ -1,96 +1,139 @@
-
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
-
-SEGMENTS = [
-    ("😕 Уставшая (тусклая/матовая)", "SEG_TIRED"),
-    ("✨ Новая (хочу сохранить)", "SEG_NEW"),
-    ("🚗 Много езжу (трасса/реагенты)", "SEG_MILEAGE"),
-    ("😬 Стыдно за салон/вид", "SEG_SHAME"),
-    ("💸 На продажу", "SEG_SELL"),
-]
-
-PAINS = [
-    ("Тусклый кузов / нет блеска", "PAIN_DULL"),
-    ("Царапины / паутинка", "PAIN_SCRATCH"),
-    ("Салон грязный / запах", "PAIN_INTERIOR"),
-    ("Мутные фары", "PAIN_LIGHTS"),
-    ("Стекла в царапинах", "PAIN_GLASS"),
-    ("Водный камень / пятна", "PAIN_WATERSPOTS"),
-    ("Всё сразу 😤", "PAIN_ALL"),
-]
-
-SERVICES = [
-    ("Полировка кузова", "SRV_POLISH"),
-    ("Защита (керамика/воск/стекло)", "SRV_PROTECT"),
-    ("Химчистка салона / кожа", "SRV_CLEAN"),
-    ("Тонировка по ГОСТ", "SRV_TINT"),
-    ("Фары (восстановление)", "SRV_HEADLIGHTS"),
-    ("Стекла (шлифовка/полировка)", "SRV_GLASS"),
-    ("Водный камень + антидождь", "SRV_WATER_ANTIRAIN"),
-]
-
-READY = [
-    ("Сегодня–завтра", "READY_NOW"),
-    ("В течение недели", "READY_WEEK"),
-    ("В течение месяца", "READY_MONTH"),
-    ("Пока просто смотрю", "READY_LOOK"),
-]
-
-CONTACT_METHODS = [
-    ("Звонок", "CALL"),
-    ("WhatsApp", "WA"),
-    ("Telegram", "TG"),
-]
-
-
-def start_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Начать диагностику", callback_data="START_FLOW")]
+from functools import lru_cache
+
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    ReplyKeyboardMarkup,
+    KeyboardButton,
+)
+
+from catalog import DEFAULT_CATALOG
+
+# Markups are immutable, so each distinct keyboard is built once and shared.
+# precompute() warms the caches while the app is being built, before the
+# first update arrives. Catalogue keyboards are keyed by the catalogue's
+# contents, and every reload of the file is a new key, so those caches are
+# bounded.
+
+CACHE_SIZE = 1024
+
+def _multi_select_kb(items, selected, prefix, done_data, reset_data):
+    rows = []
+    for key, label in items:
+        mark = "✅ " if key in selected else "☐ "
+        rows.append([InlineKeyboardButton(mark + label, callback_data=prefix + key)])
+    rows.append(
+        [
+            InlineKeyboardButton("Готово ✅", callback_data=done_data),
+            InlineKeyboardButton("Сбросить ↩️", callback_data=reset_data),
         ]
     )
+    return InlineKeyboardMarkup(rows)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _services_kb(services, selected):
+    return _multi_select_kb(services, selected, "svc:", "svc_done", "svc_reset")
 
+def services_keyboard(selected, catalog=DEFAULT_CATALOG):
+    return _services_kb(catalog.services, frozenset(selected))
 
-def segments_kb() -> InlineKeyboardMarkup:
-    kb = InlineKeyboardMarkup(row_width=1)
-    for text, code in SEGMENTS:
-        kb.add(InlineKeyboardButton(text=text, callback_data=f"SEG:{code}"))
-    return kb
+@lru_cache(maxsize=CACHE_SIZE)
+def _toning_areas_kb(areas, selected):
+    return _multi_select_kb(areas, selected, "ta:", "ta_done", "ta_reset")
 
+def toning_areas_kb(selected, catalog=DEFAULT_CATALOG):
+    return _toning_areas_kb(catalog.toning_areas, frozenset(selected))
+
+@lru_cache(maxsize=CACHE_SIZE)
+def yes_no_kb(prefix):
+    return InlineKeyboardMarkup(
+        [[
+            InlineKeyboardButton("Да", callback_data=prefix + ":yes"),
+            InlineKeyboardButton("Нет", callback_data=prefix + ":no"),
+        ]]
+    )
+
+@lru_cache(maxsize=1)
+def contact_kb():
+    return ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton("Отправить контакт ☎️", request_contact=True)],
+            [KeyboardButton("Написать номер текстом")],
+            [KeyboardButton("Оставлю Telegram, можно сюда")],
+        ],
+        resize_keyboard=True,
+        one_time_keyboard=True,
+    )
 
-def pains_kb() -> InlineKeyboardMarkup:
-    kb = InlineKeyboardMarkup(row_width=1)
-    for text, code in PAINS:
-        kb.add(InlineKeyboardButton(text=text, callback_data=f"PAIN:{code}"))
-    return kb
+@lru_cache(maxsize=CACHE_SIZE)
+def channel_kb(works_channel_url):
+    return InlineKeyboardMarkup(
+        [
+            [InlineKeyboardButton("Наши работы (TG канал)", url=works_channel_url)],
+            [InlineKeyboardButton("Пройти заново", callback_data="restart")],
+        ]
+    )
 
+@lru_cache(maxsize=CACHE_SIZE)
+def _choice_kb(prefix, options):
+    rows = []
+    for idx, opt in enumerate(options):
+        rows.append([InlineKeyboardButton(opt, callback_data=f"{prefix}:{idx}")])
+    return InlineKeyboardMarkup(rows)
 
-def services_kb(selected: set) -> InlineKeyboardMarkup:
-    kb = InlineKeyboardMarkup(row_width=1)
-    for text, code in SERVICES:
-        mark = "✅ " if code in selected else ""
-        kb.add(InlineKeyboardButton(text=f"{mark}{text}", callback_data=f"SRV:{code}"))
-    kb.add(InlineKeyboardButton(text="Готово ✅", callback_data="SRV:DONE"))
-    return kb
+def choice_kb(prefix, options):
+    return _choice_kb(prefix, tuple(options))
 
+@lru_cache(maxsize=CACHE_SIZE)
+def _toning_percent_kb(percents):
+    rows = [[InlineKeyboardButton(p, callback_data="tp:" + p)] for p in percents]
+    return InlineKeyboardMarkup(rows)
 
-def ready_kb() -> InlineKeyboardMarkup:
-    kb = InlineKeyboardMarkup(row_width=1)
-    for text, code in READY:
-        kb.add(InlineKeyboardButton(text=text, callback_data=f"READY:{code}"))
-    return kb
+def toning_percent_kb(catalog=DEFAULT_CATALOG):
+    return _toning_percent_kb(catalog.toning_percents)
 
+@lru_cache(maxsize=None)
+def photos_kb(has_photos):
+    label = "Готово ✅" if has_photos else "Пропустить ➡️"
+    return InlineKeyboardMarkup([[InlineKeyboardButton(label, callback_data="ph_done")]])
 
-def phone_request_kb() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="Отправить контакт", request_contact=True)]],
-        resize_keyboard=True,
-        one_time_keyboard=True
+@lru_cache(maxsize=1)
+def resume_kb():
+    return InlineKeyboardMarkup(
+        [
+            [InlineKeyboardButton("Продолжить ▶️", callback_data="resume")],
+            [InlineKeyboardButton("Начать заново", callback_data="restart")],
+        ]
     )
 
-
-def contact_method_kb() -> InlineKeyboardMarkup:
-    kb = InlineKeyboardMarkup(row_width=1)
-    for text, code in CONTACT_METHODS:
-        kb.add(InlineKeyboardButton(text=text, callback_data=f"CM:{code}"))
-    return kb
\ No newline at end of file
+# lead cards carry the lead id, so these are built per card
+def claim_kb(lead_id):
+    return InlineKeyboardMarkup([[InlineKeyboardButton("Взять в работу", callback_data=f"claim:{lead_id}")]])
+
+def close_kb(lead_id):
+    return InlineKeyboardMarkup([[InlineKeyboardButton("Закрыть заявку ✅", callback_data=f"close:{lead_id}")]])
+
+def broadcast_kb(broadcast_id):
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("Отправить", callback_data=f"bcast:go:{broadcast_id}"),
+        InlineKeyboardButton("Отмена", callback_data=f"bcast:cancel:{broadcast_id}"),
+    ]])
+
+def precompute_catalog(catalog):
+    toning_percent_kb(catalog)
+    services_keyboard((), catalog)
+    toning_areas_kb((), catalog)
+    for steps in catalog.flows.values():
+        for step in steps:
+            if step["type"] == "choice":
+                choice_kb("ch:" + step["key"], step["options"])
+            elif step["type"] == "yesno":
+                yes_no_kb(step["kb_prefix"])
+
+def precompute(catalog, works_channel_url):
+    contact_kb()
+    photos_kb(False)
+    photos_kb(True)
+    resume_kb()
+    channel_kb(works_channel_url)
+    precompute_catalog(catalog)
@@ -0,0 +1,162 @@
+"""
+Handler latency against the fake Bot API.
+
+Serves fakeapi over HTTP, in a separate process, with a fixed delay per call (standing in for the
+round trip to api.telegram.org), builds the app with the production
+transport (transport.api_request / polling_request) pointed at it, and
+drives --clients chats through the whole form at once, timing every
+app.process_update(). Prints p50/p95/p99 per kind of update and overall,
+and how many TCP connections the fake API accepted:
+
+    python latency_bench.py --latency 0.05 --clients 30
+    python latency_bench.py --pool 1              # every call through one connection
+    python latency_bench.py --p99-budget 800      # exit 1 when p99 is above 800 ms
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import multiprocessing as mp
+from dataclasses import replace
+
+import fakeapi
+
+MANAGERS = (9001, 9002)
+
+
+def _script(chat_id):
+    m, c = fakeapi.message_update, fakeapi.callback_update
+    return [
+        m(chat_id, "/start"),
+        m(chat_id, "Иван"),
+        m(chat_id, "Toyota Camry 2018"),
+        c(chat_id, 5, "svc:toning"),
+        c(chat_id, 5, "svc:glass_polish"),
+        c(chat_id, 5, "svc_done"),
+        c(chat_id, 6, "ta:windshield"),
+        c(chat_id, 6, "ta_done"),
+        c(chat_id, 6, "tp:5%"),
+        c(chat_id, 6, "toning_old:no"),
+        c(chat_id, 6, "ch:glass_polish_problem:1"),
+        c(chat_id, 6, "glass_chips:no"),
+        m(chat_id, photo=f"AgACAgIAAxkBAAI{chat_id}"),
+        c(chat_id, 7, "ph_done"),
+        m(chat_id, "завтра 12:00"),
+        m(chat_id, contact="+7 916 123-45-67"),
+    ]
+
+def _kind(update):
+    if "callback_query" in update:
+        return "cb:" + update["callback_query"]["data"].split(":")[0]
+    msg = update["message"]
+    if "contact" in msg:
+        return "contact"
+    if "photo" in msg:
+        return "photo"
+    return msg["text"] if msg["text"].startswith("/") else "text"
+
+def _serve(latency, conn):
+    # a process of its own: in-process the server's threads would compete
+    # with the bot for the GIL and show up as handler latency
+    api = fakeapi.FakeBotAPI(latency=latency)
+    server = fakeapi.serve(api)
+    conn.send(server.server_port)
+    conn.recv()
+    conn.send({"api_calls": len(api.calls), "connections": api.connections})
+    server.shutdown()
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+async def _run(args, db_path, base_url):
+    from telegram import Update
+
+    import config as config_mod
+    import handlers
+
+    os.environ.setdefault("BOT_TOKEN", "123456:latency-bench")
+    config = replace(
+        config_mod.load_config(),
+        db_path=db_path, api_base_url=base_url, manager_ids=MANAGERS,
+        api_pool_size=args.pool, catalog_file="", crm_url="", record_updates="",
+    )
+    app = handlers.build_app(config)
+    samples = []
+
+    async def client(chat_id):
+        for raw in _script(chat_id):
+            await asyncio.sleep(random.uniform(0, args.think))
+            raw = dict(raw, update_id=chat_id * 100 + len(samples))
+            update = Update.de_json(raw, app.bot)
+            t = time.perf_counter()
+            await app.process_update(update)
+            samples.append((_kind(raw), (time.perf_counter() - t) * 1000))
+
+    async with app:
+        await app.start()
+        try:
+            await asyncio.gather(*(client(10_000 + i) for i in range(args.clients)))
+        finally:
+            await app.stop()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Handler latency against the fake Bot API")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per Bot API call")
+    parser.add_argument("--clients", type=int, default=30, help="chats filling the form at once")
+    parser.add_argument("--think", type=float, default=1.0, help="max pause between a chat's updates, s")
+    parser.add_argument("--pool", type=int, default=256, help="API_POOL_SIZE")
+    parser.add_argument("--p99-budget", type=float, help="ms; exit 1 when p99 is above it")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    random.seed(1)
+    conn, child_conn = mp.Pipe()
+    server = mp.Process(target=_serve, args=(args.latency, child_conn), daemon=True)
+    server.start()
+    try:
+        port = conn.recv()
+        with tempfile.TemporaryDirectory() as tmp:
+            samples = asyncio.run(_run(args, os.path.join(tmp, "bench.db"), f"http://127.0.0.1:{port}/bot"))
+        conn.send("stop")
+        stats = conn.recv()
+    finally:
+        server.join(5)
+        if server.is_alive():
+            server.kill()
+
+    by_kind = {}
+    for kind, ms in samples:
+        by_kind.setdefault(kind, []).append(ms)
+    by_kind["all"] = [ms for _, ms in samples]
+
+    print(f"{'update':<16}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    result = dict(stats, latency_sec=args.latency, clients=args.clients, pool=args.pool, kinds={})
+    for kind, values in by_kind.items():
+        row = {"n": len(values), "p50_ms": round(_pct(values, 0.5), 1),
+               "p95_ms": round(_pct(values, 0.95), 1), "p99_ms": round(_pct(values, 0.99), 1)}
+        result["kinds"][kind] = row
+        print(f"{kind:<16}{row['n']:>6}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+    print(f"\n{stats['api_calls']} API calls over {stats['connections']} connections")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    p99 = result["kinds"]["all"]["p99_ms"]
+    if args.p99_budget is not None and p99 > args.p99_budget:
+        print(f"FAIL: p99 {p99} ms > {args.p99_budget} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import re
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import functools
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# -------------------- STRUCTURED LOGGING --------------------
+# Records are put on a queue by the event loop and written as JSON lines by
+# a listener thread, so log I/O never blocks a handler. Every record carries
+# the update being processed (update_id, chat_id, conversation state,
+# handler name) from a context variable set per update. Anything that may be
+# a phone number is masked on the listener side, DEBUG records are sampled
+# per update. Handlers never log what a client typed, only its length.
+
+_ctx = contextvars.ContextVar("rks_log_ctx", default={})
+
+# any run of 7+ digits, grouped by spaces, hyphens or brackets: phones of
+# every country, written any way. Ids go in extra keys ending in "_id",
+# which are not masked.
+_PHONE_RE = re.compile(r"\+?\d(?:[ \-()\u00a0]{0,3}\d){6,}")
+
+_STD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+_CTX_KEYS = ("update_id", "chat_id", "state", "handler")
+
+_listener = None
+
+
+def redact(text):
+    def _mask(m):
+        digits = re.sub(r"\D", "", m.group(0))
+        return ("+" if m.group(0).startswith("+") else "") + "*" * (len(digits) - 2) + digits[-2:]
+    return _PHONE_RE.sub(_mask, text)
+
+
+class ContextFilter(logging.Filter):
+    """Copies the per-update context onto the record (runs on the loop side)."""
+
+    def filter(self, record):
+        for key, value in _ctx.get().items():
+            setattr(record, key, value)
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """Keeps all DEBUG records of a sampled update and drops the rest."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self._every = max(1, round(1 / rate)) if rate > 0 else 0
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        if not self._every:
+            return False
+        update_id = getattr(record, "update_id", None)
+        if update_id is None:
+            return random.random() < self.rate
+        return update_id % self._every == 0
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record):
+        # only the message is rendered on the loop; JSON and redaction happen
+        # on the listener thread
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        out = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": redact(record.getMessage()),
+        }
+        for key in _CTX_KEYS:
+            value = getattr(record, key, None)
+            if value is not None:
+                out[key] = value
+        for key, value in vars(record).items():
+            if key not in _STD_ATTRS and key not in out:
+                # ids are kept as they are, even when passed as strings
+                out[key] = redact(value) if isinstance(value, str) and not key.endswith("_id") else value
+        if record.exc_text:
+            out["exc"] = redact(record.exc_text)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+def setup_logging(level=logging.INFO, debug_sample=0.1):
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+
+    q = queue.SimpleQueue()
+    handler = _QueueHandler(q)
+    handler.addFilter(ContextFilter())
+    handler.addFilter(DebugSampler(debug_sample))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    # httpx logs every request URL, and Bot API URLs contain the token
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = QueueListener(q, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+# -------------------- per-update context --------------------
+async def bind_update(update, context):
+    """TypeHandler callback (group -2): start the log context of an update."""
+    chat = update.effective_chat
+    _ctx.set({"update_id": update.update_id, "chat_id": chat.id if chat else None})
+    logging.getLogger("rks_bot.updates").debug("update received")
+
+
+def traced(callback, state):
+    """Wrap a handler callback so its records carry the state and handler name."""
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        _ctx.set({**_ctx.get(), "state": state, "handler": callback.__name__})
+        return await callback(update, context)
+    return wrapper
@@ -0,0 +1,380 @@
+"""
+Microbenchmarks for the pure functions on the customer path.
+
+Every benchmark runs its function over a fixed list of generated inputs
+(seeded, shaped like what customers actually send) and reports the time
+per call and the memory it allocates per call (tracemalloc peak above the
+starting point). Times are also expressed relative to a small calibration
+loop timed in between the rounds of the same benchmark, which is what the
+stored baseline compares, so a baseline taken on a laptop still means
+something on a CI runner. Both are the best of REPEAT rounds, and what is
+reported is the median over PROCESSES fresh interpreters.
+
+A benchmark fails when its relative time grows by more than its
+`time_tol` or its allocation by more than `alloc_tol` over
+bench_baseline.json in RETRIES + 1 measurements in a row. Exit status 1
+on any failure; CI runs it on every push.
+
+Every baseline entry names the commit it was measured on. Only the
+benchmarks a change is about should be re-recorded (-k), so a baseline
+never absorbs a regression from elsewhere, and --update-baseline refuses
+to run with uncommitted changes to Python files: commit the code, then
+record and commit the new numbers.
+
+    python microbench.py                      # compare against the baseline
+    python microbench.py --json bench.json    # also export results
+    python microbench.py --update-baseline    # accept the current numbers
+    python microbench.py -k phone             # only benchmarks matching "phone"
+"""
+import os
+import sys
+import json
+import time
+import gc
+import random
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, "bench_baseline.json")
+SEED = 20261019
+N_INPUTS = 400
+REPEAT = 25
+PROCESSES = 5  # fresh interpreters per measurement; the median of them is reported
+RETRIES = 2  # a failing benchmark is measured again this many times before it counts
+
+
+# -------------------- generated inputs --------------------
+def _phones(rnd):
+    def digits(n):
+        return "".join(rnd.choice("0123456789") for _ in range(n))
+
+    shapes = [
+        lambda: "+7" + digits(10),
+        lambda: "8" + digits(10),
+        lambda: f"+7 ({digits(3)}) {digits(3)}-{digits(2)}-{digits(2)}",
+        lambda: f"8 {digits(3)} {digits(3)} {digits(2)} {digits(2)}",
+        lambda: f"8-{digits(3)}-{digits(3)}-{digits(4)}",
+        lambda: digits(10),
+        lambda: f"мой номер 8{digits(10)}, звоните после 18",
+        lambda: f"+{digits(11)}",
+        lambda: digits(rnd.randint(3, 8)),
+        lambda: "можно сюда в телеграм",
+        lambda: "",
+    ]
+    return [(rnd.choice(shapes)(),) for _ in range(N_INPUTS)]
+
+def _dates(rnd):
+    def hm():
+        return f"{rnd.randint(0, 23)}{rnd.choice(':.')}{rnd.randint(0, 59):02d}"
+
+    shapes = [
+        lambda: "сегодня " + hm(),
+        lambda: "завтра " + hm(),
+        lambda: "Завтра в " + hm(),
+        lambda: "послезавтра " + hm(),
+        lambda: f"{rnd.randint(1, 28)}.{rnd.randint(1, 12):02d} {hm()}",
+        lambda: f"{rnd.randint(1, 28)}.{rnd.randint(1, 12):02d}.2026 {hm()}",
+        lambda: "в субботу утром",
+        lambda: "вчера " + hm(),
+        lambda: hm(),
+        lambda: "как можно скорее",
+    ]
+    return [(rnd.choice(shapes)(),) for _ in range(N_INPUTS)]
+
+def _forms(rnd, catalog):
+    """Finished forms in the LeadDraft.to_data() shape."""
+    now = datetime(2026, 10, 19, 12, 0)
+    forms = []
+    for _ in range(N_INPUTS):
+        keys = [k for k, _ in catalog.services]
+        selected = catalog.ordered(rnd.sample(keys, rnd.choice([1, 1, 2, 2, 3, 4])))
+        answers = {}
+        for step in catalog.build_flow(selected):
+            if step["type"] == "choice":
+                answers[step["key"]] = rnd.choice(step["options"])
+            elif step["type"] == "yesno":
+                answers[step["key"]] = rnd.choice(["Да", "Нет"])
+            elif step["type"] == "toning_percent":
+                answers[step["key"]] = rnd.choice(["5%", "15%", "Не знаю"])
+            elif step["type"] == "toning_areas":
+                answers[step["key"]] = rnd.sample(["Лобовое", "Боковые перед", "Заднее стекло"], 2)
+        by_phone = rnd.random() < 0.7
+        forms.append({
+            "name": rnd.choice(["Иван", "Ольга", "Алексей", "Marina"]),
+            "car": rnd.choice(["Toyota Camry 2018", "Kia Rio 2021", "BMW X5 2015"]),
+            "services_selected": selected,
+            "services_answers": answers,
+            "visit_dt": now + timedelta(hours=rnd.randint(1, 240)),
+            "phone": "+7916" + str(rnd.randint(1000000, 9999999)) if by_phone else None,
+            "contact_method": "phone" if by_phone else "telegram",
+        })
+    return forms
+
+
+# -------------------- benchmarks --------------------
+class Bench:
+    def __init__(self, name, fn, inputs, time_tol=0.30, alloc_tol=0.15):
+        self.name = name
+        self.fn = fn
+        self.inputs = inputs
+        self.time_tol = time_tol
+        self.alloc_tol = alloc_tol
+
+
+def build_benches():
+    import helpers
+    import keyboards
+    from catalog import DEFAULT_CATALOG, build_service_flow, lead_card_text, lead_temperature
+    from draft import LeadDraft
+
+    catalog = DEFAULT_CATALOG
+    rnd = random.Random(SEED)
+    forms = _forms(rnd, catalog)
+    selections = [tuple(f["services_selected"]) for f in forms]
+
+    cards = []
+    for f in forms:
+        cards.append((f, catalog, "@client", "123456789", lead_temperature(f), catalog.compute_upsells(f)))
+
+    drafts = []
+    for f in forms:
+        d = LeadDraft()
+        d.name, d.car, d.phone, d.contact_method, d.visit_dt = f["name"], f["car"], f["phone"], f["contact_method"], f["visit_dt"]
+        for key in f["services_selected"]:
+            d.toggle_service(catalog, key)
+        d.flow_i = 3
+        for key, value in f["services_answers"].items():
+            if isinstance(value, str):
+                d.answer(key, value)
+        drafts.append((d,))
+
+    return [
+        Bench("normalize_phone", helpers.normalize_phone, _phones(rnd)),
+        Bench("parse_datetime_ru", helpers.parse_datetime_ru, _dates(rnd)),
+        Bench("lead_temperature", lead_temperature, [(f,) for f in forms]),
+        Bench("compute_upsells", catalog.compute_upsells, [(f,) for f in forms]),
+        Bench("build_service_flow", build_service_flow, [(s,) for s in selections]),
+        Bench("services_keyboard", keyboards.services_keyboard, [(set(s), catalog) for s in selections]),
+        Bench("lead_card_text", lead_card_text, cards),
+        Bench("draft_to_bytes", LeadDraft.to_bytes, drafts),
+        Bench("draft_from_bytes", LeadDraft.from_bytes, [(d.to_bytes(),) for (d,) in drafts]),
+    ]
+
+
+# -------------------- measuring --------------------
+def _calibration_work():
+    # plain interpreter work: string ops, dict and list churn
+    d = {}
+    for i in range(2000):
+        k = "k%d" % (i % 97)
+        d[k] = d.get(k, 0) + len(k.upper())
+    return sorted(d.items())
+
+def _timed(fn, *args):
+    t = time.perf_counter_ns()
+    fn(*args)
+    return time.perf_counter_ns() - t
+
+def _run_inputs(fn, inputs):
+    for args in inputs:
+        fn(*args)
+
+def _time_per_call(fn, inputs, repeat):
+    """(best ns per call, best calibration ns), rounds of the two interleaved.
+
+    Timing the calibration loop right next to every round means a slower
+    stretch of the machine (another process, frequency scaling) shows up in
+    both, and the minimum over many rounds keeps the undisturbed ones."""
+    for args in inputs[:50]:
+        fn(*args)  # warm caches the way a running bot has them warm
+    best = calibration = float("inf")
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            calibration = min(calibration, _timed(_calibration_work))
+            best = min(best, _timed(_run_inputs, fn, inputs))
+    finally:
+        gc.enable()
+    return best / len(inputs), calibration
+
+def _alloc_per_call(fn, inputs):
+    tracemalloc.start()
+    try:
+        total = 0
+        for args in inputs:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            fn(*args)
+            total += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return total / len(inputs)
+
+def _measure(b, repeat):
+    ns, calibration = _time_per_call(b.fn, b.inputs, repeat)
+    return {
+        "ns_per_call": round(ns, 1),
+        "rel": round(ns / calibration * 1000, 4),
+        "calibration_ns": calibration,
+        "alloc_bytes": round(_alloc_per_call(b.fn, b.inputs), 1),
+        "inputs": len(b.inputs),
+    }
+
+def _best(a, b):
+    out = dict(min(a, b, key=lambda r: r["rel"]))
+    out["alloc_bytes"] = min(a["alloc_bytes"], b["alloc_bytes"])
+    return out
+
+def run(benches, repeat=REPEAT):
+    return {b.name: _measure(b, repeat) for b in benches}
+
+def run_in_processes(names, repeat=REPEAT, processes=PROCESSES):
+    """Results for the benchmarks `names`, each the median of `processes`
+    child interpreters. How one process lays out its heap and string
+    hashes can move a benchmark by 15% for that process's whole life, so
+    one process alone says little; every child gets its own hash seed."""
+    runs = []
+    for seed in range(processes):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", ",".join(names), "--repeat", str(repeat)],
+            capture_output=True, text=True, check=True, env=dict(os.environ, PYTHONHASHSEED=str(seed)),
+        ).stdout
+        runs.append(json.loads(out))
+    results = {}
+    for name in names:
+        rs = sorted((r[name] for r in runs), key=lambda r: r["rel"])
+        results[name] = dict(rs[len(rs) // 2], alloc_bytes=min(r["alloc_bytes"] for r in rs))
+    return results
+
+
+# -------------------- baseline --------------------
+def load_baseline(path=BASELINE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("benches", {})
+
+def check(benches, results, baseline):
+    """Attach baseline numbers and a status to every result; returns the failures."""
+    failed = []
+    for b in benches:
+        r = results[b.name]
+        base = baseline.get(b.name)
+        if not base:
+            r["status"] = "new"
+            continue
+        r["baseline_rel"] = base["rel"]
+        r["baseline_alloc_bytes"] = base["alloc_bytes"]
+        reasons = []
+        if r["rel"] > base["rel"] * (1 + b.time_tol):
+            reasons.append(f"time +{r['rel'] / base['rel'] - 1:.0%} (limit {b.time_tol:.0%})")
+        # a few bytes of jitter on tiny allocations are not a regression
+        if r["alloc_bytes"] > base["alloc_bytes"] * (1 + b.alloc_tol) + 64:
+            reasons.append(f"alloc {base['alloc_bytes']:.0f} -> {r['alloc_bytes']:.0f} B (limit +{b.alloc_tol:.0%})")
+        if reasons and base.get("commit"):
+            reasons.append(f"baseline from {base['commit']}")
+        r["status"] = "FAIL: " + "; ".join(reasons) if reasons else "ok"
+        if reasons:
+            failed.append(b.name)
+    return failed
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", "-C", HERE, *args], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _git_commit():
+    return _git("rev-parse", "--short", "HEAD")
+
+def _uncommitted_code():
+    """Python files that differ from HEAD (None outside a git checkout)."""
+    out = _git("status", "--porcelain", "--untracked-files=no", "--", "*.py")
+    return None if out is None else out.splitlines()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the hot-path functions")
+    parser.add_argument("-k", dest="match", help="only benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--retries", type=int, default=RETRIES)
+    parser.add_argument("--json", help="write results here")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--processes", type=int, default=PROCESSES)
+    parser.add_argument("--child", help=argparse.SUPPRESS)  # names to measure, results as JSON on stdout
+    args = parser.parse_args()
+
+    if args.update_baseline:
+        dirty = _uncommitted_code()
+        if dirty:
+            parser.error("commit these first, so the baseline names the code it was measured on:\n"
+                         + "\n".join(dirty))
+
+    if args.child:
+        names = args.child.split(",")
+        print(json.dumps(run([b for b in build_benches() if b.name in names], args.repeat)))
+        return
+
+    benches = [b for b in build_benches() if not args.match or args.match in b.name]
+    results = run_in_processes([b.name for b in benches], args.repeat, args.processes)
+    baseline = load_baseline(args.baseline)
+    failed = check(benches, results, baseline)
+    for _ in range(args.retries):
+        if not failed:
+            break
+        # a real regression shows up every time, a noisy stretch does not
+        again = run_in_processes(failed, args.repeat, args.processes)
+        for name in failed:
+            results[name] = _best(results[name], again[name])
+        failed = check(benches, results, baseline)
+    calibration = min(r["calibration_ns"] for r in results.values())
+
+    print(f"{'benchmark':<20} {'ns/call':>10} {'rel':>9} {'alloc B':>9}  status")
+    for name, r in results.items():
+        print(f"{name:<20} {r['ns_per_call']:>10.0f} {r['rel']:>9.3f} {r['alloc_bytes']:>9.0f}  {r['status']}")
+
+    report = {
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "calibration_ns": calibration,
+        "benches": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.update_baseline:
+        keep = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                keep = json.load(f).get("benches", {})
+        keep.update({
+            name: {
+                "rel": r["rel"], "alloc_bytes": r["alloc_bytes"], "ns_per_call": r["ns_per_call"],
+                "commit": report["commit"],
+            }
+            for name, r in results.items()
+        })
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "commit": report["commit"], "python": report["python"],
+                "calibration_ns": calibration, "benches": keep,
+            }, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline written to {args.baseline}")
+        return
+
+    if failed:
+        print(f"{len(failed)} benchmark(s) regressed: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
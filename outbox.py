@@ -0,0 +1,225 @@
+import html
+import asyncio
+import itertools
+import logging
+import functools
+import contextvars
+
+from telegram.constants import ParseMode
+from telegram.error import BadRequest
+from telegram.helpers import escape_markdown
+
+# -------------------- OUTBOUND COALESCING --------------------
+# Within one handler invocation consecutive texts for the same chat are
+# merged into a single send. A keyboard belongs under the text it was sent
+# with, so a text is only merged into one without a reply_markup; the merged
+# message keeps the keyboard of the later text, if it has one.
+#
+# Calls passed to pipelined() (answering the callback query, removing an
+# answered keyboard) do not affect what the handler does next, so they are
+# started at once and run while the handler goes on; the handler returns
+# only after all of them and the merged replies are done.
+
+MAX_TEXT_LEN = 4096
+SEPARATOR = "\n\n"
+
+_current = contextvars.ContextVar("rks_outbox", default=None)
+
+logger = logging.getLogger("rks_bot.outbox")
+
+
+def _escape(text, parse_mode):
+    if parse_mode == ParseMode.MARKDOWN:
+        return escape_markdown(text, version=1)
+    if parse_mode == ParseMode.MARKDOWN_V2:
+        return escape_markdown(text, version=2)
+    if parse_mode == ParseMode.HTML:
+        return html.escape(text)
+    return text
+
+
+class _Pending:
+    __slots__ = ("message", "text", "parse_mode", "reply_markup")
+
+    def __init__(self, message, text, parse_mode, reply_markup):
+        self.message = message
+        self.text = text
+        self.parse_mode = parse_mode
+        self.reply_markup = reply_markup
+
+
+class Outbox:
+    def __init__(self):
+        self._queue = []
+        self._calls = []
+
+    def add(self, message, text, parse_mode=None, reply_markup=None):
+        item = _Pending(message, text, parse_mode, reply_markup)
+        if self._queue and self._merge(self._queue[-1], item):
+            return
+        self._queue.append(item)
+
+    @staticmethod
+    def _merge(last, item):
+        if last.message.chat_id != item.message.chat_id:
+            return False
+        if last.reply_markup is not None:
+            return False
+
+        # plain text can join a formatted one if it is escaped for that mode
+        if last.parse_mode == item.parse_mode:
+            mode, a, b = last.parse_mode, last.text, item.text
+        elif item.parse_mode is None:
+            mode, a, b = last.parse_mode, last.text, _escape(item.text, last.parse_mode)
+        elif last.parse_mode is None:
+            mode, a, b = item.parse_mode, _escape(last.text, item.parse_mode), item.text
+        else:
+            return False
+
+        text = a + SEPARATOR + b
+        if len(text) > MAX_TEXT_LEN:
+            return False
+
+        last.text = text
+        last.parse_mode = mode
+        if item.reply_markup is not None:
+            last.reply_markup = item.reply_markup
+        return True
+
+    def start(self, call):
+        self._calls.append(asyncio.ensure_future(call))
+
+    async def _send(self, queue):
+        for item in queue:
+            await item.message.reply_text(
+                item.text,
+                parse_mode=item.parse_mode,
+                reply_markup=item.reply_markup,
+            )
+
+    async def flush(self):
+        queue, self._queue = self._queue, []
+        calls, self._calls = self._calls, []
+        # replies go out in order; the pipelined calls are for other messages
+        for result in await asyncio.gather(*calls, self._send(queue), return_exceptions=True):
+            if isinstance(result, BaseException):
+                raise result
+
+
+async def reply(message, text, parse_mode=None, reply_markup=None):
+    """Reply to `message`, buffered when called inside a coalesced handler."""
+    box = _current.get()
+    if box is None:
+        return await message.reply_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+    box.add(message, text, parse_mode=parse_mode, reply_markup=reply_markup)
+    return None
+
+
+async def pipelined(call):
+    """Await a Bot API call whose result is not needed; inside a coalesced
+    handler it is only started here and awaited when the handler exits."""
+    box = _current.get()
+    if box is None:
+        await call
+        return
+    box.start(call)
+
+
+def coalesce(func):
+    """Handler decorator: collect reply() calls and send them merged on exit,
+    and wait for the pipelined() calls started meanwhile."""
+    @functools.wraps(func)
+    async def wrapper(update, context):
+        box = Outbox()
+        token = _current.set(box)
+        try:
+            result = await func(update, context)
+        except BaseException:
+            _current.reset(token)
+            # still send what the handler got out before failing, but a failed
+            # send must not hide the handler's own error
+            try:
+                await box.flush()
+            except Exception:
+                logger.exception("flushing replies of a failed handler")
+            raise
+        _current.reset(token)
+        await box.flush()
+        return result
+    return wrapper
+
+
+# -------------------- DEBOUNCED KEYBOARD EDITS --------------------
+# Multi-select keyboards (services, toning areas) change on every tap. The
+# session is updated at once, but the edit of the message is delayed for a
+# short window and then done once with the keyboard of the last tap. Every
+# slot has its own timer token, so a timer left over from a slot that was
+# flushed early never fires the edit of a newer one.
+
+EDIT_DEBOUNCE_SEC = 0.4
+# the replayer switches the timers off and flushes between updates itself,
+# so how fast a replay runs never changes what gets sent
+AUTO_FLUSH = True
+
+# keyed by bot too: tenants share this module and may edit the same chat/message ids
+_pending_edits = {}
+_tokens = itertools.count()
+
+
+def _edit_key(message):
+    return (message.get_bot().id, message.chat_id, message.message_id)
+
+
+class _EditSlot:
+    __slots__ = ("message", "markup", "token")
+
+    def __init__(self, message, markup):
+        self.message = message
+        self.markup = markup
+        self.token = next(_tokens)
+
+
+async def _apply_edit(slot):
+    if slot.markup == slot.message.reply_markup:
+        return
+    try:
+        await slot.message.edit_reply_markup(reply_markup=slot.markup)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+
+
+async def _fire_edit(key, token, delay):
+    await asyncio.sleep(delay)
+    slot = _pending_edits.get(key)
+    if slot is None or slot.token != token:
+        return
+    del _pending_edits[key]
+    await _apply_edit(slot)
+
+
+def schedule_markup_edit(context, message, markup, delay=EDIT_DEBOUNCE_SEC):
+    """Edit `message` keyboard to `markup` once the tap window closes."""
+    key = _edit_key(message)
+    slot = _pending_edits.get(key)
+    if slot is not None:
+        slot.markup = markup
+        return
+    slot = _pending_edits[key] = _EditSlot(message, markup)
+    if AUTO_FLUSH:
+        context.application.create_task(_fire_edit(key, slot.token, delay))
+
+
+async def flush_markup_edit(message):
+    """Apply a pending keyboard edit for `message` right now, if there is one."""
+    # the timer task still fires later and, its slot gone, does nothing
+    slot = _pending_edits.pop(_edit_key(message), None)
+    if slot is not None:
+        await _apply_edit(slot)
+
+
+async def flush_all_markup_edits():
+    """Apply every pending keyboard edit now (used by the replayer between updates)."""
+    while _pending_edits:
+        slot = _pending_edits.pop(next(iter(_pending_edits)))
+        await _apply_edit(slot)
@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+# -------------------- SAMPLING PROFILER --------------------
+# A background thread looks at the event loop thread's stack every few ms
+# (sys._current_frames) and counts whole stacks. Nothing is hooked into the
+# interpreter, so the bot runs at full speed and stops paying anything the
+# moment the sampler thread exits. Output: a top-functions table and the
+# collapsed-stack format ("a;b;c 42") that flamegraph.pl / speedscope read.
+
+INTERVAL = 0.005
+
+# leaf frames where the loop is waiting for I/O, not working
+_IDLE = {("selectors.py", "select"), ("selectors.py", "poll")}
+
+
+def _frame_key(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, thread_id, interval=INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.idle = 0
+        self.started = self.stopped = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run, name="rks-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.stopped = time.time()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        keys = {}  # code object -> label, so each function is formatted once
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            self.samples += 1
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in _IDLE:
+                self.idle += 1
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = keys.get(code)
+                if label is None:
+                    label = keys[code] = _frame_key(code)
+                stack.append(label)
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+
+    # ---------- output ----------
+    def collapsed(self):
+        return "".join(f"{';'.join(stack)} {n}\n" for stack, n in self.stacks.most_common())
+
+    def report(self, limit=15):
+        busy = self.samples - self.idle
+        duration = (self.stopped or time.time()) - self.started
+        lines = [
+            f"Профиль за {duration:.0f} с: {self.samples} сэмплов, "
+            f"цикл занят {busy / self.samples:.0%}" if self.samples else "Сэмплов нет.",
+        ]
+        if not busy:
+            return "\n".join(lines)
+
+        own, total = Counter(), Counter()
+        for stack, n in self.stacks.items():
+            own[stack[-1]] += n
+            for func in set(stack):
+                total[func] += n
+
+        lines.append("")
+        lines.append("self%   total%  function")
+        for func, n in own.most_common(limit):
+            lines.append(f"{n / busy:>5.1%}  {total[func] / busy:>6.1%}  {func}")
+        return "\n".join(lines)
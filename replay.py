@@ -0,0 +1,410 @@
+"""
+Record real update streams and replay them offline.
+
+With RECORD_UPDATES=updates.jsonl the bot appends every incoming update to
+that file, anonymized: customer ids become stable pseudonyms, profile names
+are dropped, phone digits are replaced (prefix, length and separators are
+kept, so normalize_phone sees the same shapes) and the reply to "Как тебя
+зовут?" keeps only its letter pattern. Each line also carries the local
+time it arrived at.
+
+The replayer feeds such a file through handlers.build_app() against the
+fake Bot API (fakeapi.py) with helpers.now_local frozen at each update's
+recorded time and a fresh database, then writes one line per update with
+the outgoing calls it caused and the time it took. Keyboard edits that
+are debounced in production are flushed wherever the recorded gap was
+longer than the debounce window, so the output never depends on speed.
+
+    python replay.py run updates.jsonl --out new.jsonl
+    python replay.py diff old.jsonl new.jsonl
+    python replay.py compare origin/main updates.jsonl   # needs git; REF must have fakeapi.FakeRequest
+"""
+import os
+import re
+import sys
+import hmac
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import argparse
+import difflib
+import tempfile
+import threading
+import subprocess
+from queue import SimpleQueue
+from datetime import datetime
+
+FORMAT_VERSION = 1
+
+
+# -------------------- anonymization --------------------
+_PHONE_RE = re.compile(r"\+?\d[\d\-\s()]{8,}\d")
+
+
+class Anonymizer:
+    def __init__(self, keep_ids=(), salt=None):
+        self.keep = set(keep_ids)
+        self.salt = salt or os.urandom(16)
+
+    def _hash(self, value):
+        return hmac.new(self.salt, str(value).encode("utf-8"), hashlib.sha256).digest()
+
+    def user_id(self, uid):
+        if uid is None or uid in self.keep:
+            return uid
+        return 10 ** 11 + int.from_bytes(self._hash(uid)[:6], "big") % 10 ** 11
+
+    def phone(self, text):
+        """Replace every digit but the first of each phone-like run."""
+        def _mask(m):
+            run = m.group(0)
+            digest = self._hash(re.sub(r"\D", "", run))
+            out, seen = [], 0
+            for ch in run:
+                if ch.isdigit():
+                    out.append(ch if seen == 0 else str(digest[seen % len(digest)] % 10))
+                    seen += 1
+                else:
+                    out.append(ch)
+            return "".join(out)
+        return _PHONE_RE.sub(_mask, text)
+
+    @staticmethod
+    def letters(text):
+        """Keep only the shape of a text: letters become а/a, case kept."""
+        out = []
+        for ch in text:
+            if "а" <= ch.lower() <= "я" or ch.lower() == "ё":
+                out.append("А" if ch.isupper() else "а")
+            elif ch.isascii() and ch.isalpha():
+                out.append("A" if ch.isupper() else "a")
+            else:
+                out.append(ch)
+        return "".join(out)
+
+    def _user(self, u):
+        uid = self.user_id(u.get("id"))
+        if u.get("is_bot") or u.get("id") in self.keep:
+            return dict(u)
+        out = {"id": uid, "is_bot": False, "first_name": "Клиент"}
+        if u.get("username"):
+            out["username"] = f"u{uid}"
+        if u.get("language_code"):
+            out["language_code"] = u["language_code"]
+        return out
+
+    def _chat(self, c):
+        return {"id": self.user_id(c.get("id")), "type": c.get("type", "private")}
+
+    def _walk(self, obj):
+        if isinstance(obj, list):
+            return [self._walk(x) for x in obj]
+        if not isinstance(obj, dict):
+            return obj
+        out = {}
+        for key, value in obj.items():
+            if key in ("from", "user") and isinstance(value, dict):
+                out[key] = self._user(value)
+            elif key in ("chat", "sender_chat") and isinstance(value, dict):
+                out[key] = self._chat(value)
+            elif key == "contact":
+                out[key] = {
+                    "phone_number": self.phone(value.get("phone_number", "")),
+                    "first_name": "Клиент",
+                    "user_id": self.user_id(value.get("user_id")),
+                }
+            elif key in ("text", "caption") and isinstance(value, str):
+                out[key] = self.phone(value)
+            elif key == "user_id":
+                out[key] = self.user_id(value)
+            else:
+                out[key] = self._walk(value)
+        return out
+
+    def update(self, raw, name_expected=False):
+        out = self._walk(raw)
+        msg = out.get("message")
+        if name_expected and msg and msg.get("text") and not msg["text"].startswith("/"):
+            msg["text"] = self.letters(msg["text"])
+        cq = out.get("callback_query")
+        if cq and isinstance(cq.get("message"), dict):
+            # our own text, but it may quote the client ("Иван, заявка ...")
+            cq["message"]["text"] = "…"
+            cq["message"].pop("entities", None)
+        return out
+
+
+# -------------------- recording --------------------
+class Recorder:
+    """TypeHandler callback (group -3) appending anonymized updates to a JSONL file.
+
+    Like the log records in logs.py, updates are only put on a queue by the
+    event loop; a thread anonymizes and writes them. close() (called on
+    stop) writes what is queued and closes the file."""
+
+    def __init__(self, path, manager_ids=()):
+        import helpers
+
+        self._now = lambda: helpers.now_local()
+        self.anon = Anonymizer(keep_ids=manager_ids)
+        self._t0 = time.monotonic()
+        self._f = open(path, "a", encoding="utf-8")
+        self._queue = SimpleQueue()
+        self._thread = threading.Thread(target=self._drain, name="rks-recorder", daemon=True)
+        self._thread.start()
+        self._queue.put({"header": {
+            "version": FORMAT_VERSION,
+            "manager_ids": list(manager_ids),
+            "started": self._now().isoformat(),
+        }})
+
+    def _drain(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if "update" in item:
+                item["update"] = self.anon.update(item["update"], name_expected=item.pop("name_expected"))
+            self._f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            if self._queue.empty():
+                self._f.flush()
+        self._f.close()
+
+    async def __call__(self, update, context):
+        # the first text of a form is the client's name
+        draft = context.user_data if update.effective_user else None
+        self._queue.put({
+            "t": round(time.monotonic() - self._t0, 3),
+            "now": self._now().isoformat(),
+            "update": update.to_dict(),
+            "name_expected": draft is not None and not draft,
+        })
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+# -------------------- replay --------------------
+def read_records(path):
+    header, records = {}, []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            if "header" in rec:
+                header = rec["header"]
+                continue
+            records.append(rec)
+    return header, records
+
+def _kind(update):
+    if "callback_query" in update:
+        return "cb:" + str(update["callback_query"].get("data", ""))[:24]
+    msg = update.get("message") or {}
+    if "contact" in msg:
+        return "contact"
+    if "photo" in msg:
+        return "photo"
+    text = msg.get("text") or ""
+    return text.split()[0][:24] if text.startswith("/") else "text"
+
+async def _flush_edits(outbox):
+    flush = getattr(outbox, "flush_all_markup_edits", None)
+    if flush is not None:
+        await flush()
+        return
+    # trees from before the replayer existed
+    pending = getattr(outbox, "_pending_edits", {})
+    while pending:
+        await outbox._apply_edit(pending.pop(next(iter(pending))))
+
+async def _replay(header, records, db_path):
+    from dataclasses import replace
+
+    from telegram import Update
+
+    import config as config_mod
+    import fakeapi
+    import handlers
+    import helpers
+    import outbox
+
+    os.environ.setdefault("BOT_TOKEN", "123456:replay")
+    os.environ.pop("RECORD_UPDATES", None)
+    config = config_mod.load_config()
+    config = replace(config, db_path=db_path,
+                     manager_ids=tuple(header.get("manager_ids") or config.manager_ids))
+
+    api = fakeapi.FakeBotAPI()
+    app = handlers.build_app(config, request=fakeapi.FakeRequest(api),
+                             get_updates_request=fakeapi.FakeRequest(api))
+    outbox.AUTO_FLUSH = False
+    real_now = helpers.now_local
+    results = []
+
+    def _calls_since(n):
+        return [[method, params] for _, method, params in api.calls[n:]]
+
+    try:
+        async with app:
+            prev_t = None
+            for i, rec in enumerate(records):
+                if prev_t is not None and rec["t"] - prev_t >= outbox.EDIT_DEBOUNCE_SEC:
+                    n = len(api.calls)
+                    await _flush_edits(outbox)
+                    results[-1]["calls"] += _calls_since(n)
+                prev_t = rec["t"]
+
+                frozen = datetime.fromisoformat(rec["now"])
+                helpers.now_local = lambda: frozen
+                update = Update.de_json(rec["update"], app.bot)
+                n = len(api.calls)
+                start = time.perf_counter()
+                await app.process_update(update)
+                elapsed = time.perf_counter() - start
+                results.append({
+                    "i": i,
+                    "update_id": rec["update"].get("update_id"),
+                    "kind": _kind(rec["update"]),
+                    "ms": round(elapsed * 1000, 3),
+                    "calls": _calls_since(n),
+                })
+            if results:
+                n = len(api.calls)
+                await _flush_edits(outbox)
+                results[-1]["calls"] += _calls_since(n)
+    finally:
+        helpers.now_local = real_now
+        outbox.AUTO_FLUSH = True
+    return results
+
+def replay(path):
+    """Replay a recording; returns one result dict per update."""
+    header, records = read_records(path)
+    with tempfile.TemporaryDirectory() as tmp:
+        return asyncio.run(_replay(header, records, os.path.join(tmp, "replay.db")))
+
+
+# -------------------- reports --------------------
+def _pct(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def timing_summary(results):
+    ms = [r["ms"] for r in results]
+    return {
+        "updates": len(ms),
+        "calls": sum(len(r["calls"]) for r in results),
+        "total_ms": round(sum(ms), 2),
+        "p50_ms": round(_pct(ms, 0.5), 3),
+        "p95_ms": round(_pct(ms, 0.95), 3),
+        "max_ms": round(max(ms, default=0.0), 3),
+    }
+
+def write_results(results, out):
+    for r in results:
+        out.write(json.dumps(r, ensure_ascii=False, sort_keys=True) + "\n")
+
+def load_results(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def diff_results(old, new, out, slower=0.25, show=10):
+    """Print behavioural and timing differences; returns True when there are any."""
+    changed = []
+    if len(old) != len(new):
+        out.write(f"different number of updates: {len(old)} vs {len(new)}\n")
+    for a, b in zip(old, new):
+        if a["calls"] != b["calls"]:
+            changed.append((a, b))
+
+    for a, b in changed[:show]:
+        out.write(f"--- update #{a['i']} ({a['kind']}): outgoing calls differ\n")
+        left = json.dumps(a["calls"], ensure_ascii=False, indent=1, sort_keys=True).splitlines()
+        right = json.dumps(b["calls"], ensure_ascii=False, indent=1, sort_keys=True).splitlines()
+        for line in difflib.unified_diff(left, right, "old", "new", lineterm="", n=2):
+            out.write(line + "\n")
+    if len(changed) > show:
+        out.write(f"... and {len(changed) - show} more updates with different calls\n")
+
+    sa, sb = timing_summary(old), timing_summary(new)
+    out.write(f"\n{'':<10}{'old':>12}{'new':>12}\n")
+    for key in ("updates", "calls", "total_ms", "p50_ms", "p95_ms", "max_ms"):
+        out.write(f"{key:<10}{sa[key]:>12}{sb[key]:>12}\n")
+    regressed = sa["p95_ms"] > 0 and sb["p95_ms"] > sa["p95_ms"] * (1 + slower)
+    if regressed:
+        out.write(f"p95 is more than {slower:.0%} slower\n")
+
+    out.write(f"\n{len(changed)} of {min(len(old), len(new))} updates changed behaviour\n")
+    return bool(changed) or len(old) != len(new) or regressed
+
+
+# -------------------- CLI --------------------
+def _run_cmd(args):
+    if args.code:
+        # replay another checkout's modules with this replayer
+        sys.path.insert(0, os.path.abspath(args.code))
+    logging.basicConfig(level=logging.WARNING)
+    results = replay(args.records)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            write_results(results, f)
+    summary = timing_summary(results)
+    print(json.dumps(summary), file=sys.stderr)
+    slowest = sorted(results, key=lambda r: r["ms"], reverse=True)[:args.top]
+    for r in slowest:
+        print(f"#{r['i']:<6} {r['kind']:<28} {r['ms']:>9.3f} ms  {len(r['calls'])} calls", file=sys.stderr)
+
+def _compare_cmd(args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp:
+        tree = os.path.join(tmp, "tree")
+        subprocess.run(["git", "-C", here, "worktree", "add", "--detach", tree, args.ref], check=True,
+                       capture_output=True)
+        try:
+            old, new = os.path.join(tmp, "old.jsonl"), os.path.join(tmp, "new.jsonl")
+            me = os.path.abspath(__file__)
+            subprocess.run([sys.executable, me, "run", args.records, "--out", old, "--code", tree], check=True)
+            subprocess.run([sys.executable, me, "run", args.records, "--out", new], check=True)
+            return diff_results(load_results(old), load_results(new), sys.stdout, slower=args.slower)
+        finally:
+            subprocess.run(["git", "-C", here, "worktree", "remove", "--force", tree], capture_output=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded updates against the fake Bot API")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    run = sub.add_parser("run", help="replay a recording")
+    run.add_argument("records")
+    run.add_argument("--out", help="write per-update results (JSONL) here")
+    run.add_argument("--code", help="import the bot from this directory instead")
+    run.add_argument("--top", type=int, default=5, help="slowest updates to print")
+
+    diff = sub.add_parser("diff", help="compare two result files")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    diff.add_argument("--slower", type=float, default=0.25, help="allowed p95 slowdown")
+
+    cmp_ = sub.add_parser("compare", help="replay on git REF and on this tree, then diff")
+    cmp_.add_argument("ref")
+    cmp_.add_argument("records")
+    cmp_.add_argument("--slower", type=float, default=0.25, help="allowed p95 slowdown")
+
+    args = parser.parse_args()
+    if args.cmd == "run":
+        _run_cmd(args)
+    elif args.cmd == "diff":
+        sys.exit(1 if diff_results(load_results(args.old), load_results(args.new), sys.stdout, args.slower) else 0)
+    else:
+        sys.exit(1 if _compare_cmd(args) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import sys
+import time
+import pickle
+import asyncio
+import logging
+import resource
+from collections import OrderedDict
+
+from telegram import Update
+from telegram.ext import CallbackContext
+
+import db
+
+logger = logging.getLogger("rks_bot.sessions")
+
+# -------------------- SESSION STORE --------------------
+# Holds what handlers see as context.user_data (through SessionContext, the
+# bot's context type) in place of PTB's Application.user_data, a defaultdict
+# that never shrinks, so the number of conversations kept in memory is
+# bounded. The least recently used ones are serialized into the `sessions`
+# table (LeadDraft.to_bytes in the bot, pickle by default) and loaded back
+# the next time the user writes; an unknown user still gets a fresh
+# factory() object, like with defaultdict.
+# The mapping itself never touches SQLite: evicted sessions are queued and
+# written by a background flush through db.writer, and prefetch() (a
+# TypeHandler ahead of every other group) brings a spilled session back
+# before any handler reads context.user_data. A busy database (an import,
+# a backup) then delays those tasks, not the event loop. The session of the
+# update being processed is never evicted: it is serialized when spilled,
+# and the handler may still be changing it.
+
+
+class SessionStore(OrderedDict):
+    def __init__(self, db_path, capacity=1000, max_age=None, factory=dict,
+                 dumps=pickle.dumps, loads=pickle.loads):
+        super().__init__()
+        self.db_path = db_path
+        self.capacity = max(1, capacity)
+        self.max_age = max_age
+        self.factory = factory
+        self.dumps = dumps
+        self.loads = loads
+        self.spilled = 0
+        self.loaded = 0
+        self._on_disk = set()  # users with a spilled session, queued or written
+        self._listed = False  # whether the ones left by a previous run were read in
+        self._outgoing = {}  # evicted, not written yet
+        self._tasks = set()
+        self._current = None  # user of the update being processed
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self):
+        items, self._outgoing = self._outgoing, {}
+        try:
+            await db.writer.run(self.db_path, db.put_sessions, list(items.items()))
+        except Exception:
+            logger.exception("Failed to spill %s sessions", len(items))
+
+    async def prefetch(self, update, context):
+        """TypeHandler callback: load the user's spilled session, if any."""
+        user = update.effective_user
+        self._current = user.id if user else None
+        if user is None or user.id in self:
+            return
+        if not self._listed:
+            # spilled leftovers of conversations from a previous run
+            self._listed = True
+            older_than = time.time() - self.max_age if self.max_age else None
+            self._on_disk.update(await db.writer.run(self.db_path, db.session_ids, older_than))
+        if user.id not in self._on_disk:
+            return
+        self._on_disk.discard(user.id)
+        blob = self._outgoing.pop(user.id, None)
+        if blob is None:
+            blob = await db.writer.run(self.db_path, db.take_session, user.id)
+        if blob is None or user.id in self:
+            return
+        try:
+            value = self.loads(blob)
+        except Exception:
+            logger.warning("Dropped an unreadable spilled session")
+            return
+        self.loaded += 1
+        self[user.id] = value
+
+    def __getitem__(self, user_id):
+        value = super().__getitem__(user_id)
+        self.move_to_end(user_id)
+        return value
+
+    def __missing__(self, user_id):
+        value = self.factory()
+        self[user_id] = value
+        return value
+
+    def __setitem__(self, user_id, value):
+        super().__setitem__(user_id, value)
+        self.move_to_end(user_id)
+        keep = (user_id, self._current)
+        while len(self) > self.capacity:
+            old_id = next((k for k in self if k not in keep), None)
+            if old_id is None:
+                break  # capacity 1: the new session and the current one stay
+            old = OrderedDict.pop(self, old_id)
+            if old:
+                if not self._outgoing:
+                    self._spawn(self._flush())
+                self._outgoing[old_id] = self.dumps(old)
+                self._on_disk.add(old_id)
+                self.spilled += 1
+
+    def pop(self, user_id, default=None):
+        # the form is over or expired: forget the user on both sides
+        self._outgoing.pop(user_id, None)
+        if user_id in self._on_disk or not self._listed:
+            self._on_disk.discard(user_id)
+            self._spawn(db.writer.run(self.db_path, db.delete_session, user_id))
+        return super().pop(user_id, default)
+
+    def on_disk(self):
+        return len(self._on_disk)
+
+    async def close(self):
+        """Wait for the queued writes (the bot calls this on stop)."""
+        if self._outgoing:
+            self._spawn(self._flush())
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+class SessionContext(CallbackContext):
+    """CallbackContext whose user_data is the user's entry in the
+    SessionStore kept in bot_data["sessions"]."""
+
+    def __init__(self, application, chat_id=None, user_id=None):
+        super().__init__(application, chat_id, user_id)
+        self.session_user = user_id
+
+    @classmethod
+    def from_update(cls, update, application):
+        self = super().from_update(update, application)
+        user = update.effective_user if isinstance(update, Update) else None
+        self.session_user = user.id if user else None
+        return self
+
+    @classmethod
+    def from_job(cls, job, application):
+        self = super().from_job(job, application)
+        self.session_user = job.user_id
+        return self
+
+    @property
+    def user_data(self):
+        if self.session_user is None:
+            return None
+        return self.bot_data["sessions"][self.session_user]
+
+
+# -------------------- MEMORY REPORT --------------------
+def deep_sizeof(obj, seen):
+    """Size of obj and everything it references that is not in `seen` yet."""
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(x, seen) for x in obj)
+    elif hasattr(type(obj), "__slots__"):
+        size += sum(deep_sizeof(getattr(obj, name, None), seen) for name in type(obj).__slots__)
+    return size
+
+def memory_report(store, shared=()):
+    """Bytes held per in-memory session. Objects reachable from `shared`
+    (catalogue, cached keyboards) are not billed to any session."""
+    seen = set()
+    for obj in shared:
+        deep_sizeof(obj, seen)
+    sizes = [deep_sizeof(data, seen) for data in dict.values(store) if data]
+    return {
+        "in_memory": len(store),
+        "active": len(sizes),
+        "capacity": store.capacity,
+        "on_disk": store.on_disk(),
+        "spilled": store.spilled,
+        "loaded": store.loaded,
+        "bytes_total": sum(sizes),
+        "bytes_avg": sum(sizes) // len(sizes) if sizes else 0,
+        "bytes_max": max(sizes, default=0),
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
@@ -0,0 +1,242 @@
+"""
+Sharded mode: one ingress process, N worker processes.
+
+The ingress long-polls getUpdates and routes every update by chat id to a
+fixed worker over a multiprocessing queue. A chat therefore always lands on
+the same worker, which owns that chat's conversation state and handles its
+updates strictly one after another, so per-chat ordering is preserved while
+CPU work in different chats runs in parallel.
+
+Enabled by WORKERS=N (N > 1). A local end-to-end check against the fake
+Bot API:
+
+    python shard.py --smoke --workers 4 --chats 50
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import signal
+import argparse
+import tempfile
+import threading
+import subprocess
+import multiprocessing as mp
+from queue import Empty
+
+logger = logging.getLogger("rks_bot.shard")
+
+POLL_TIMEOUT = 25
+
+
+def shard_of(update, workers):
+    chat = update.effective_chat
+    user = update.effective_user
+    key = chat.id if chat else (user.id if user else update.update_id)
+    return key % workers
+
+
+# -------------------- worker --------------------
+def _worker_main(index, queue, config):
+    from bot import build_app  # also configures logging in the spawned process
+
+    logger.info("Worker %s started (pid %s)", index, os.getpid())
+    app = build_app(config)
+    app.bot_data["worker"] = index  # jobs.start_jobs runs the once-per-database jobs in worker 0
+    asyncio.run(_worker_loop(queue, app))
+
+
+def _next_raw(queue):
+    # wake up now and then so a worker never outlives a killed ingress
+    parent = mp.parent_process()
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Empty:
+            if parent is not None and not parent.is_alive():
+                return None
+
+
+async def _worker_loop(queue, app):
+    from telegram import Update
+
+    async with app:
+        await app.start()
+        # PTB calls post_init/post_stop only from run_polling/run_webhook
+        await app.post_init(app)
+        try:
+            while True:
+                raw = await asyncio.to_thread(_next_raw, queue)
+                if raw is None:
+                    break
+                await app.process_update(Update.de_json(json.loads(raw), app.bot))
+        finally:
+            await app.stop()
+            await app.post_stop(app)
+
+
+# -------------------- ingress --------------------
+class _Workers:
+    def __init__(self, config):
+        self._ctx = mp.get_context("spawn")
+        self.config = config
+        self.queues = [self._ctx.Queue() for _ in range(config.workers)]
+        self.procs = [None] * config.workers
+
+    def _spawn(self, i):
+        p = self._ctx.Process(
+            target=_worker_main, args=(i, self.queues[i], self.config),
+            name=f"rks-worker-{i}", daemon=True,
+        )
+        p.start()
+        self.procs[i] = p
+
+    def start(self):
+        for i in range(len(self.procs)):
+            self._spawn(i)
+
+    def supervise(self):
+        # a dead worker loses its in-memory conversations, but its queue
+        # (and so the chats routed to it) is picked up by the replacement
+        for i, p in enumerate(self.procs):
+            if not p.is_alive():
+                logger.warning("Worker %s exited with %s, restarting", i, p.exitcode)
+                self._spawn(i)
+
+    def stop(self, timeout=10):
+        for q in self.queues:
+            q.put(None)
+        for p in self.procs:
+            p.join(timeout)
+            if p.is_alive():
+                p.terminate()
+
+
+async def _ingress(config, workers):
+    from telegram import Bot, Update
+    from telegram.error import Conflict, NetworkError
+
+    from transport import polling_request
+
+    bot = Bot(config.bot_token, base_url=config.api_base_url,
+              get_updates_request=polling_request(config.api_keepalive_sec))
+    async with bot:
+        await bot.delete_webhook(drop_pending_updates=True)
+        offset = None
+        while True:
+            workers.supervise()
+            try:
+                updates = await bot.get_updates(
+                    offset=offset, timeout=POLL_TIMEOUT, allowed_updates=Update.ALL_TYPES,
+                )
+            except Conflict:
+                logger.warning("Conflict (another getUpdates). Retry in 5 seconds...")
+                await asyncio.sleep(5)
+                continue
+            except NetworkError:
+                logger.warning("getUpdates failed, retry in 1 second", exc_info=True)
+                await asyncio.sleep(1)
+                continue
+
+            for update in updates:
+                i = shard_of(update, config.workers)
+                workers.queues[i].put(json.dumps(update.to_dict()))
+                offset = update.update_id + 1
+
+
+def _raise_exit(signum, frame):
+    raise SystemExit(0)
+
+
+def run_sharded(config):
+    import db
+
+    signal.signal(signal.SIGTERM, _raise_exit)
+    # migrations (one of them a VACUUM) run once here, not in every worker at once
+    db.init_db(config.db_path)
+    workers = _Workers(config)
+    workers.start()
+    logger.info("Sharded mode: %s workers", config.workers)
+    try:
+        asyncio.run(_ingress(config, workers))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        workers.stop()
+
+
+# -------------------- local smoke run --------------------
+def smoke(workers, chats, timeout=60.0):
+    import fakeapi
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    api = fakeapi.FakeBotAPI()
+    script = ["/start", "Иван", "Toyota Camry 2018"]
+    expected = ["Привет!", "Отлично.", "Выбери услуги"]
+    chat_ids = [900000 + i for i in range(chats)]
+    done = threading.Event()
+    replies = {c: [] for c in chat_ids}
+
+    def on_call(method, params):
+        if method == "deleteWebhook":
+            # interleave chats so every worker sees concurrent conversations
+            for text in script:
+                for c in chat_ids:
+                    api.push_update(fakeapi.message_update(c, text))
+        elif method == "sendMessage" and params.get("chat_id") in replies:
+            replies[params["chat_id"]].append(params.get("text", ""))
+            if all(len(r) >= len(expected) for r in replies.values()):
+                done.set()
+
+    api.on_call(on_call)
+    server = fakeapi.serve(api)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.setdefault("BOT_TOKEN", "123456:shard-smoke")
+        env.update(
+            WORKERS=str(workers),
+            BOT_API_BASE_URL=f"http://127.0.0.1:{server.server_port}/bot",
+            PORT="0",
+            DB_PATH=os.path.join(tmp, "smoke.db"),
+        )
+        t0 = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, os.path.join(here, "bot.py")], cwd=tmp, env=env)
+        try:
+            finished = done.wait(timeout)
+            elapsed = time.perf_counter() - t0
+        finally:
+            proc.terminate()
+            proc.wait(15)
+    server.shutdown()
+
+    def in_order(texts):
+        got = texts[:len(expected)]
+        return len(got) == len(expected) and all(t.startswith(e) for t, e in zip(got, expected))
+
+    out_of_order = [c for c, texts in replies.items() if not in_order(texts)]
+    print(json.dumps({
+        "workers": workers,
+        "chats": chats,
+        "finished": finished,
+        "elapsed_sec": round(elapsed, 3),
+        "out_of_order_chats": out_of_order,
+    }, indent=2))
+    return 0 if finished and not out_of_order else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded mode tools")
+    parser.add_argument("--smoke", action="store_true", help="run the local end-to-end check")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--chats", type=int, default=50)
+    args = parser.parse_args()
+    if not args.smoke:
+        parser.error("nothing to do (use --smoke, or run bot.py with WORKERS=N)")
+    return smoke(args.workers, args.chats)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Cold start benchmark.
+
+Measures two things against the local fake Bot API (fakeapi.py):
+
+* import: time to `import bot`, and that it does not drag in telegram;
+* first update: wall time from spawning `python bot.py` to the bot
+  answering the first /start it receives.
+
+Exits with status 1 when a budget is exceeded, so CI can gate on it:
+
+    python startup_bench.py --import-budget 0.3 --budget 4
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import fakeapi
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CHAT_ID = 424242
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _env(**extra):
+    env = dict(os.environ)
+    env.setdefault("BOT_TOKEN", "123456:startup-bench")
+    env.update(extra)
+    return env
+
+
+def measure_import():
+    code = (
+        "import sys, time\n"
+        "t = time.perf_counter()\n"
+        "import bot\n"
+        "print(time.perf_counter() - t, 'telegram' in sys.modules)\n"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=HERE, env=_env(), check=True,
+        capture_output=True, text=True,
+    ).stdout.split()
+    return float(out[0]), out[1] == "True"
+
+
+def measure_first_update(timeout=30.0):
+    api = fakeapi.FakeBotAPI()
+    answered = threading.Event()
+
+    def on_call(method, params):
+        # run_polling drops pending updates first, so queue /start only after that
+        if method == "deleteWebhook":
+            api.push_update(fakeapi.message_update(CHAT_ID, "/start"))
+        elif method == "sendMessage" and params.get("chat_id") == CHAT_ID:
+            answered.set()
+
+    api.on_call(on_call)
+    server = fakeapi.serve(api)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = _env(
+            BOT_API_BASE_URL=f"http://127.0.0.1:{server.server_port}/bot",
+            PORT=str(_free_port()),
+            DB_PATH=os.path.join(tmp, "bench.db"),
+        )
+        t0 = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, "bot.py")], cwd=tmp, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            ok = answered.wait(timeout)
+            elapsed = time.perf_counter() - t0
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    server.shutdown()
+    return elapsed if ok else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark")
+    parser.add_argument("--import-budget", type=float, default=0.3, help="seconds for `import bot`")
+    parser.add_argument("--budget", type=float, default=4.0, help="seconds to first handled update")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    import_times, loads_telegram = [], False
+    for _ in range(args.runs):
+        sec, tg = measure_import()
+        import_times.append(sec)
+        loads_telegram = loads_telegram or tg
+
+    first_update = [measure_first_update() for _ in range(args.runs)]
+
+    result = {
+        "import_sec": min(import_times),
+        "import_loads_telegram": loads_telegram,
+        "first_update_sec": min((x for x in first_update if x is not None), default=None),
+        "first_update_runs": first_update,
+    }
+    print(json.dumps(result, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    failures = []
+    if loads_telegram:
+        failures.append("`import bot` loads telegram")
+    if result["import_sec"] > args.import_budget:
+        failures.append(f"import {result['import_sec']:.3f}s > {args.import_budget}s")
+    if result["first_update_sec"] is None:
+        failures.append("bot never answered /start")
+    elif result["first_update_sec"] > args.budget:
+        failures.append(f"first update {result['first_update_sec']:.3f}s > {args.budget}s")
+
+    for f in failures:
+        print("FAIL:", f, file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
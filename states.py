@@ -1,16 +0,0 @@
-from aiogram.dispatcher.filters.state import StatesGroup, State
-
-
-class LeadForm(StatesGroup):
-    name = State()
-    car = State()
-    segment = State()
-    pain = State()
-    services = State()
-    ready_time = State()
-    phone = State()
-    contact_method = State()
-
-
-class ManagerAuth(StatesGroup):
-    password = State()
\ No newline at end of file
@@ -0,0 +1,140 @@
+"""
+Multi-tenant mode: several studio bots in one process.
+
+TENANTS_FILE points at a JSON file like
+
+    {
+      "tenants": [
+        {
+          "name": "rks",
+          "studio_name": "RKS studio",
+          "bot_token_env": "RKS_BOT_TOKEN",
+          "manager_ids": [327140660],
+          "works_channel_url": "https://t.me/+7nQ-MkqFk_BmZTZi"
+        },
+        {
+          "name": "north",
+          "bot_token_env": "NORTH_BOT_TOKEN",
+          "manager_ids": [111, 222],
+          "services": ["toning", "body_polish", ["ceramic", "Керамика 9H"]],
+          "crm_url": "https://north.example.amocrm.ru/api/leads",
+          "crm_token_env": "NORTH_CRM_TOKEN"
+        }
+      ]
+    }
+
+Every tenant gets its own Application, catalogue, managers and database
+file (<name>.db next to DB_PATH unless "db_path" is given); its archive
+and backups go to a <name> subdirectory of ARCHIVE_DIR and BACKUP_DIR, and
+its manager cards are headed with "studio_name" (the tenant name if unset). The catalogue
+is the tenant's "services" list, its "catalog_file" (reloaded on change,
+see hotreload.py), or else CATALOG_FILE. All of them run on one event
+loop and share one HTTP connection pool for Bot API calls and the pooled
+DB writer, so an extra studio costs a few MB, not a process.
+"""
+import os
+import json
+import signal
+import asyncio
+import logging
+from dataclasses import dataclass, replace
+
+from catalog import Catalog, DEFAULT_CATALOG
+from config import Config
+
+logger = logging.getLogger("rks_bot.tenants")
+
+POOL_PER_TENANT = 4
+
+
+@dataclass(frozen=True)
+class Tenant:
+    name: str
+    config: Config
+    catalog: Catalog
+
+
+def load_tenants(base: Config) -> list[Tenant]:
+    with open(base.tenants_file, encoding="utf-8") as f:
+        spec = json.load(f)
+
+    db_dir = os.path.dirname(base.db_path)
+    tenants, names, tokens = [], set(), set()
+    for item in spec["tenants"]:
+        name = item["name"]
+        token = item.get("bot_token") or os.getenv(item.get("bot_token_env", ""), "")
+        if not token:
+            raise RuntimeError(f"tenant {name!r}: bot token not set")
+        if name in names or token in tokens:
+            raise RuntimeError(f"tenant {name!r}: duplicate name or token")
+        names.add(name)
+        tokens.add(token)
+
+        config = replace(
+            base,
+            bot_token=token,
+            manager_ids=tuple(item.get("manager_ids") or base.manager_ids),
+            works_channel_url=item.get("works_channel_url", base.works_channel_url),
+            studio_name=item.get("studio_name", name),
+            db_path=item.get("db_path") or os.path.join(db_dir, f"{name}.db"),
+            # partitions and snapshots are named by month and DB basename only
+            archive_dir=os.path.join(base.archive_dir, name),
+            backup_dir=os.path.join(base.backup_dir, name),
+            crm_url=item.get("crm_url", base.crm_url),
+            crm_token=os.getenv(item["crm_token_env"], "") if "crm_token_env" in item else base.crm_token,
+            # a tenant's own "services" list wins over the shared CATALOG_FILE
+            catalog_file=item.get("catalog_file", "" if "services" in item else base.catalog_file),
+        )
+        catalog = Catalog.from_spec(item["services"]) if "services" in item else DEFAULT_CATALOG
+        tenants.append(Tenant(name=name, config=config, catalog=catalog))
+    return tenants
+
+
+async def _run(tenants):
+    from telegram import Update
+
+    import db
+    from handlers import build_app
+    from transport import SharedHTTPXRequest, api_request, polling_request
+
+    base = tenants[0].config
+    shared = api_request(POOL_PER_TENANT * len(tenants), base.api_keepalive_sec, base.api_http2,
+                         cls=SharedHTTPXRequest)
+    apps = []
+    for t in tenants:
+        # long polling holds its connection open, so it gets a private one
+        app = build_app(
+            t.config, t.catalog,
+            request=shared,
+            get_updates_request=polling_request(base.api_keepalive_sec),
+        )
+        apps.append((t, app))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        for t, app in apps:
+            await app.initialize()
+            await app.updater.start_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+            await app.start()
+            await app.post_init(app)
+            logger.info("Tenant %s started as @%s", t.name, app.bot.username)
+        await stop.wait()
+    finally:
+        for t, app in apps:
+            if app.updater.running:
+                await app.updater.stop()
+            if app.running:
+                await app.stop()
+                await app.post_stop(app)
+            await app.shutdown()
+        db.writer.close()
+
+
+def run_tenants(base):
+    tenants = load_tenants(base)
+    logger.info("Multi-tenant mode: %s", ", ".join(t.name for t in tenants))
+    asyncio.run(_run(tenants))
@@ -0,0 +1,71 @@
+import sqlite3
+
+import archive
+import db
+
+
+def _lead(user_id, created_at, services=("ceramic",), phone=None):
+    return {
+        "tg_user_id": user_id, "name": "Клиент", "created_at": created_at,
+        "phone": phone or f"+7916000{user_id:04d}", "services": {key: {} for key in services},
+    }
+
+
+def _db(tmp_path, leads):
+    path = str(tmp_path / "t.db")
+    db.init_db(path)
+    conn = db._connect(path)
+    for lead in leads:
+        db.insert_lead(conn, lead)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_new_database_has_incremental_auto_vacuum(tmp_path):
+    path = _db(tmp_path, [])
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert db.schema_version(conn) == len(db.MIGRATIONS)
+
+
+def test_migration_switches_auto_vacuum_on_for_an_old_file(tmp_path):
+    path = _db(tmp_path, [_lead(1, "2024-01-01T00:00:00")])
+    # a file from before migration 11
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA auto_vacuum = NONE")
+    conn.execute("VACUUM")
+    conn.execute(f"PRAGMA user_version = {db.MIGRATIONS.index(db._m11_incremental_vacuum)}")
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+    conn.close()
+
+    db.init_db(path)
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert db.schema_version(conn) == len(db.MIGRATIONS)
+    assert conn.execute("SELECT phone FROM leads").fetchall() == [("+79160000001",)]
+
+
+def test_archive_moves_old_leads_and_frees_their_pages(tmp_path):
+    leads = [_lead(i, f"2024-0{i % 3 + 1}-10T10:00:00") for i in range(1, 301)]
+    leads.append(_lead(999, "2099-01-01T00:00:00"))
+    path = _db(tmp_path, leads)
+    archive_dir = str(tmp_path / "arc")
+
+    moved = archive.archive_leads(path, archive_dir, 180)
+    assert moved == {"2024-01": 100, "2024-02": 100, "2024-03": 100}
+    assert archive.list_months(archive_dir) == ["2024-01", "2024-02", "2024-03"]
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT tg_user_id FROM leads").fetchall() == [(999,)]
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    conn.close()
+
+    rows = list(archive.iter_leads(path, archive_dir, "2024-01-01"))
+    assert len(rows) == 301
+    assert rows[0]["created_at"] < rows[-1]["created_at"]
+    feb = list(archive.iter_leads(path, archive_dir, "2024-02-01", "2024-03-01", "ceramic"))
+    assert len(feb) == 100
+
+    # a rerun finds nothing left to move
+    assert archive.archive_leads(path, archive_dir, 180) == {}
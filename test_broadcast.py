@@ -0,0 +1,123 @@
+import time
+import asyncio
+from types import SimpleNamespace
+
+import broadcast
+import db
+import handlers
+from test_archive import _db, _lead
+
+
+class FakeBot:
+    def __init__(self, on_send=None):
+        self.sent = []
+        self.on_send = on_send
+
+    async def send_message(self, chat_id, text):
+        self.sent.append(chat_id)
+        if self.on_send is not None:
+            await self.on_send(len(self.sent))
+
+
+def _running(tmp_path, clients):
+    path = _db(tmp_path, [_lead(u, "2026-10-01T12:00:00") for u in range(1, clients + 1)])
+    conn = db._connect(path)
+    broadcast_id = db.create_broadcast(conn, 99, None, "Скидка")
+    db.set_broadcast_status(conn, broadcast_id, "running", ("draft",))
+    conn.commit()
+    conn.close()
+    return path, broadcast_id
+
+
+def test_lease_is_taken_over_only_once_it_expires(tmp_path):
+    path, broadcast_id = _running(tmp_path, 1)
+    conn = db._connect(path)
+    now = time.time()
+    assert db.claim_broadcast(conn, broadcast_id, "a", now + 60)
+    assert not db.claim_broadcast(conn, broadcast_id, "b", now + 60)
+    assert db.claim_broadcast(conn, broadcast_id, "a", now + 120)  # renewing our own
+
+    conn.execute("UPDATE broadcasts SET lease_until = ? WHERE id = ?", (now - 1, broadcast_id))
+    assert db.claim_broadcast(conn, broadcast_id, "b", now + 60)
+    # the old runner learns it lost the broadcast at its next save
+    assert db.save_broadcast_progress(conn, broadcast_id, "a", now + 60, 1, 1, 0, 0) is None
+    assert db.save_broadcast_progress(conn, broadcast_id, "b", now + 60, 1, 1, 0, 0) == "running"
+    conn.close()
+
+
+def test_start_refuses_a_broadcast_leased_by_another_runner(tmp_path):
+    path, broadcast_id = _running(tmp_path, 1)
+    conn = db._connect(path)
+    db.claim_broadcast(conn, broadcast_id, "other", time.time() + 60)
+    conn.commit()
+    conn.close()
+
+    async def run():
+        broadcaster = broadcast.Broadcaster(FakeBot(), path, rate=1000)
+        started = await broadcaster.start(broadcast_id)
+        await broadcaster.resume()
+        return started, broadcaster.busy
+
+    assert asyncio.run(run()) == (False, False)
+
+
+def test_pause_and_resume_send_everyone_once(tmp_path):
+    path, broadcast_id = _running(tmp_path, 25)
+
+    async def pause_after_first_window(count):
+        if count == broadcast.WINDOW:
+            await db.writer.run(path, db.set_broadcast_status, broadcast_id, "paused", ("running",))
+
+    async def run():
+        bot = FakeBot(pause_after_first_window)
+        broadcaster = broadcast.Broadcaster(bot, path, rate=1000)
+        assert await broadcaster.start(broadcast_id)
+        await broadcaster._task
+        paused = await db.writer.run(path, db.get_broadcast, broadcast_id)
+
+        assert await db.writer.run(path, db.set_broadcast_status, broadcast_id, "running", ("paused",))
+        assert await broadcaster.start(broadcast_id)
+        await broadcaster._task
+        done = await db.writer.run(path, db.get_broadcast, broadcast_id)
+        return bot.sent, paused, done
+
+    sent, paused, done = asyncio.run(run())
+    assert (paused["status"], paused["last_user_id"], paused["sent"]) == ("paused", broadcast.WINDOW, broadcast.WINDOW)
+    assert sent == list(range(1, 26))
+    assert (done["status"], done["sent"], done["last_user_id"]) == ("done", 25, 25)
+
+
+def _start(path, broadcast_id, broadcaster):
+    context = SimpleNamespace(bot_data={"config": SimpleNamespace(db_path=path), "broadcaster": broadcaster})
+    stats = SimpleNamespace(chat_id=99, message_id=5)
+    return asyncio.run(handlers._start_broadcast(context, broadcast_id, ("draft",), stats))
+
+
+def test_confirming_while_the_last_one_is_stopping_is_refused(tmp_path):
+    path, _ = _running(tmp_path, 1)
+    conn = db._connect(path)
+    db.set_broadcast_status(conn, 1, "paused", ("running",))
+    broadcast_id = db.create_broadcast(conn, 99, None, "Ещё")
+    conn.commit()
+    conn.close()
+
+    error = _start(path, broadcast_id, SimpleNamespace(busy=True))
+    assert "останавливается" in error
+    assert asyncio.run(db.writer.run(path, db.get_broadcast, broadcast_id))["status"] == "draft"
+
+
+def test_manager_is_told_when_the_broadcast_is_queued(tmp_path):
+    path, _ = _running(tmp_path, 1)
+    conn = db._connect(path)
+    db.set_broadcast_status(conn, 1, "done", ("running",))
+    broadcast_id = db.create_broadcast(conn, 99, None, "Ещё")
+    conn.commit()
+    conn.close()
+
+    async def start(broadcast_id):
+        return False  # worker 0 claimed it first
+
+    error = _start(path, broadcast_id, SimpleNamespace(busy=False, start=start))
+    assert "в очереди" in error
+    row = asyncio.run(db.writer.run(path, db.get_broadcast, broadcast_id))
+    assert (row["status"], row["stats_message_id"]) == ("running", 5)
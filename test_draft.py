@@ -0,0 +1,61 @@
+from datetime import datetime
+
+import pytest
+
+from catalog import DEFAULT_CATALOG
+from draft import _HEAD, _LEN, LeadDraft
+
+
+def _filled():
+    d = LeadDraft()
+    d.name, d.car, d.phone, d.contact_method = "Иван", "Toyota Camry 2018", "+79161234567", "phone"
+    d.toggle_service(DEFAULT_CATALOG, "toning")
+    d.toggle_area(DEFAULT_CATALOG, "windshield")
+    d.flow_i = 2
+    d.answer("toning_percent", "5%")
+    d.visit_dt = datetime(2026, 10, 20, 12, 0)
+    d.catalog_version = "v1"
+    d.add_photo("AgACAgIAAxkBAAI")
+    d.add_photo("AgACAgIAAxkBAAJ")
+    return d
+
+
+def _slots(d):
+    return {name: getattr(d, name) for name in LeadDraft.__slots__}
+
+
+def test_round_trip_keeps_every_saved_field():
+    d = _filled()
+    d.photo_group = "album"
+    back = LeadDraft.from_bytes(d.to_bytes())
+    assert _slots(back) == {**_slots(d), "photo_group": None}
+
+
+def test_empty_draft_round_trips_to_a_cleared_one():
+    assert _slots(LeadDraft.from_bytes(LeadDraft().to_bytes())) == _slots(LeadDraft())
+
+
+def _old_blob(version, strings):
+    out = [_HEAD.pack(version, 1, 0, 3, 1, 0, 0)]
+    for s in strings:
+        raw = s.encode("utf-8")
+        out.append(_LEN.pack(len(raw)) + raw)
+    return b"".join(out)
+
+
+@pytest.mark.parametrize("version, strings, catalog_version", [
+    (1, ["Иван", "Lada", "+79161234567"], None),
+    (2, ["Иван", "Lada", "+79161234567", "v7"], "v7"),
+])
+def test_older_formats_still_load(version, strings, catalog_version):
+    d = LeadDraft.from_bytes(_old_blob(version, strings))
+    assert (d.name, d.car, d.phone, d.contact_method) == ("Иван", "Lada", "+79161234567", "phone")
+    assert d.catalog_version == catalog_version
+    assert d.photos is None and d.answers is None and d.flow_i == 3
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        LeadDraft.from_bytes(b"\x09" + bytes(_HEAD.size))
+    with pytest.raises(ValueError):
+        LeadDraft.from_bytes(b"")
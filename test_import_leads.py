@@ -0,0 +1,78 @@
+import sqlite3
+
+import archive
+import db
+import import_leads
+from crm import CURSOR
+from test_archive import _db, _lead
+
+HEADER = ["Имя", "Телефон", "Услуги", "Дата"]
+ROWS = [
+    ["Анна", "8 916 111-22-33", "Тонировка", "01.02.2024"],
+    ["Олег", "+7 (916) 444-55-66", "", "2024-02-03"],
+    ["Анна", "89161112233", "", "01.02.2024 15:00"],  # same phone and day
+    ["Ира", "12", "", ""],
+]
+
+
+def _import(path, tmp_path, rows=ROWS, **kwargs):
+    rejects = import_leads.Rejects(str(tmp_path / "rejects.csv"), HEADER)
+    try:
+        return import_leads.import_rows(
+            path, iter(rows), import_leads.header_map(HEADER), import_leads.service_map(), rejects, **kwargs,
+        )
+    finally:
+        rejects.close()
+
+
+def _cursor(path):
+    conn = sqlite3.connect(path)
+    try:
+        return db.get_cursor(conn, CURSOR)
+    finally:
+        conn.close()
+
+
+def test_import_skips_duplicates_and_rejects_bad_rows(tmp_path):
+    path = _db(tmp_path, [])
+    stats = _import(path, tmp_path)
+    assert (stats["read"], stats["imported"], stats["duplicates"], stats["rejected"]) == (4, 2, 1, 1)
+    assert _import(path, tmp_path)["duplicates"] == 3
+
+
+def test_archived_leads_still_count_as_duplicates(tmp_path):
+    path = _db(tmp_path, [])
+    assert _import(path, tmp_path)["imported"] == 2
+    archive.archive_leads(path, str(tmp_path / "arc"), 180)
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM leads").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM archived_phones").fetchone()[0] == 2
+    conn.close()
+
+    stats = _import(path, tmp_path)
+    assert (stats["imported"], stats["duplicates"]) == (0, 3)
+
+
+def test_crm_cursor_moves_past_imported_leads(tmp_path):
+    path = _db(tmp_path, [])
+    stats = _import(path, tmp_path)
+    assert (_cursor(path), stats["to_crm"]) == (stats["last_id"], 0)
+
+    conn = db._connect(path)
+    assert db.leads_after_cursor(conn, CURSOR, 10) == []
+    conn.close()
+
+
+def test_crm_cursor_is_kept_while_the_sync_is_behind(tmp_path):
+    path = _db(tmp_path, [_lead(1, "2026-10-01T12:00:00")])  # a bot lead not pushed yet
+    stats = _import(path, tmp_path)
+    assert (_cursor(path), stats["to_crm"]) == (0, 2)
+
+
+def test_push_to_crm_leaves_the_cursor_alone(tmp_path):
+    path = _db(tmp_path, [])
+    stats = _import(path, tmp_path, push_to_crm=True)
+    assert (_cursor(path), stats["to_crm"]) == (0, 2)
+    conn = db._connect(path)
+    assert [lead["id"] for lead in db.leads_after_cursor(conn, CURSOR, 10)] == [1, 2]
+    conn.close()
@@ -0,0 +1,15 @@
+import keyboards
+from catalog import SERVICES, Catalog
+
+
+def test_keyboards_are_shared():
+    assert keyboards.services_keyboard({"toning"}) is keyboards.services_keyboard(["toning"])
+    assert keyboards.choice_kb("ch:x", ["a", "b"]) is keyboards.choice_kb("ch:x", ("a", "b"))
+
+
+def test_catalogue_reloads_do_not_grow_the_caches_without_bound():
+    keyboards._services_kb.cache_clear()
+    for version in range(keyboards.CACHE_SIZE + 50):
+        catalog = Catalog([*SERVICES, (f"extra_{version}", f"Услуга {version}")])
+        keyboards.services_keyboard((), catalog)
+    assert keyboards._services_kb.cache_info().currsize == keyboards.CACHE_SIZE
@@ -0,0 +1,37 @@
+import json
+import logging
+
+import pytest
+
+import logs
+
+
+@pytest.mark.parametrize("text, masked", [
+    ("+7 916 123-45-67", "+*********67"),
+    ("8 (916) 123-45-67", "*********67"),
+    ("89161234567", "*********67"),
+    ("моб 9161234567", "моб ********67"),
+    ("+375 29 123-45-67", "+**********67"),
+    ("+380501234567", "+**********67"),
+    ("звоните 123-45-67", "звоните *****67"),
+])
+def test_phones_of_any_shape_are_masked(text, masked):
+    assert logs.redact(text) == masked
+
+
+@pytest.mark.parametrize("text", ["заявка 123456", "2 фото", "12:30", "v1.2.3"])
+def test_short_numbers_are_kept(text):
+    assert logs.redact(text) == text
+
+
+def _format(msg, **extra):
+    record = logging.makeLogRecord({"msg": msg, "levelno": logging.INFO, "levelname": "INFO", **extra})
+    return json.loads(logs.JsonFormatter().format(record))
+
+
+def test_formatter_masks_message_and_free_text_extras_but_not_ids():
+    out = _format("client wrote +375291234567", comment="тел 9161234567", tg_user_id="123456789", lead_id=1234567)
+    assert "+375291234567" not in out["msg"]
+    assert out["comment"] == "тел ********67"
+    assert out["tg_user_id"] == "123456789"
+    assert out["lead_id"] == 1234567
@@ -0,0 +1,180 @@
+import asyncio
+
+import pytest
+from telegram.constants import ParseMode
+
+import outbox
+
+
+class FakeMessage:
+    def __init__(self, chat_id=1, sent=None, fail=None):
+        self.chat_id = chat_id
+        self.sent = [] if sent is None else sent
+        self.fail = fail
+
+    async def reply_text(self, text, parse_mode=None, reply_markup=None):
+        if self.fail is not None:
+            raise self.fail
+        self.sent.append((text, parse_mode, reply_markup))
+
+
+def _send(*items):
+    box = outbox.Outbox()
+    for item in items:
+        box.add(*item)
+    asyncio.run(box.flush())
+
+
+def test_plain_texts_merge():
+    msg = FakeMessage()
+    _send((msg, "a"), (msg, "b"))
+    assert msg.sent == [("a\n\nb", None, None)]
+
+
+def test_later_keyboard_goes_under_merged_text():
+    msg = FakeMessage()
+    _send((msg, "a"), (msg, "b", None, "kb"))
+    assert msg.sent == [("a\n\nb", None, "kb")]
+
+
+def test_earlier_keyboard_is_not_moved_under_later_text():
+    msg = FakeMessage()
+    _send((msg, "a", None, "kb"), (msg, "b"))
+    assert msg.sent == [("a", None, "kb"), ("b", None, None)]
+
+
+def test_both_keyboards_are_kept():
+    msg = FakeMessage()
+    _send((msg, "a", None, "kb1"), (msg, "b", None, "kb2"))
+    assert msg.sent == [("a", None, "kb1"), ("b", None, "kb2")]
+
+
+def test_plain_text_is_escaped_for_the_formatted_one():
+    msg = FakeMessage()
+    _send((msg, "*Итог*", ParseMode.MARKDOWN), (msg, "под_чёркивание"))
+    assert msg.sent == [("*Итог*\n\nпод\\_чёркивание", ParseMode.MARKDOWN, None)]
+
+    msg = FakeMessage()
+    _send((msg, "a < b"), (msg, "<b>жирный</b>", ParseMode.HTML))
+    assert msg.sent == [("a &lt; b\n\n<b>жирный</b>", ParseMode.HTML, None)]
+
+
+def test_different_parse_modes_are_not_merged():
+    msg = FakeMessage()
+    _send((msg, "*a*", ParseMode.MARKDOWN), (msg, "<b>b</b>", ParseMode.HTML))
+    assert msg.sent == [("*a*", ParseMode.MARKDOWN, None), ("<b>b</b>", ParseMode.HTML, None)]
+
+
+def test_other_chat_and_long_texts_are_not_merged():
+    sent = []
+    one, other = FakeMessage(1, sent), FakeMessage(2, sent)
+    _send((one, "a"), (other, "b"), (one, "c"))
+    assert [t for t, _, _ in sent] == ["a", "b", "c"]
+
+    msg = FakeMessage()
+    long = "x" * (outbox.MAX_TEXT_LEN - 2)
+    _send((msg, long), (msg, "y"))
+    assert msg.sent == [(long, None, None), ("y", None, None)]
+
+
+def test_flush_raises_the_first_error_after_everything_ran():
+    done = []
+
+    async def call(name, error=None):
+        done.append(name)
+        if error is not None:
+            raise error
+
+    async def run():
+        box = outbox.Outbox()
+        box.start(call("a", KeyError("first")))
+        box.start(call("b", ValueError("second")))
+        box.add(FakeMessage(fail=RuntimeError("send")), "text")
+        await box.flush()
+
+    with pytest.raises(KeyError):
+        asyncio.run(run())
+    assert done == ["a", "b"]
+
+
+def test_coalesce_keeps_the_handler_error_when_the_flush_fails():
+    msg = FakeMessage(fail=RuntimeError("send"))
+
+    @outbox.coalesce
+    async def handler(update, context):
+        await outbox.reply(msg, "text")
+        raise ValueError("handler")
+
+    with pytest.raises(ValueError):
+        asyncio.run(handler(None, None))
+
+
+def test_coalesce_sends_on_exit_and_reply_is_direct_outside():
+    msg = FakeMessage()
+
+    @outbox.coalesce
+    async def handler(update, context):
+        await outbox.reply(msg, "a")
+        await outbox.reply(msg, "b")
+        assert msg.sent == []
+        return "state"
+
+    assert asyncio.run(handler(None, None)) == "state"
+    assert msg.sent == [("a\n\nb", None, None)]
+    asyncio.run(outbox.reply(msg, "c"))
+    assert msg.sent[-1] == ("c", None, None)
+
+
+class FakeBot:
+    id = 7
+
+
+class EditedMessage:
+    def __init__(self, edits, message_id=10):
+        self.chat_id = 1
+        self.message_id = message_id
+        self.reply_markup = None
+        self.edits = edits
+
+    def get_bot(self):
+        return FakeBot()
+
+    async def edit_reply_markup(self, reply_markup=None):
+        self.reply_markup = reply_markup
+        self.edits.append(reply_markup)
+
+
+class FakeContext:
+    class application:
+        create_task = staticmethod(asyncio.ensure_future)
+
+
+def test_taps_in_one_window_make_one_edit_with_the_last_keyboard():
+    async def run():
+        edits = []
+        msg = EditedMessage(edits)
+        for markup in ("kb1", "kb2", "kb3"):
+            outbox.schedule_markup_edit(FakeContext, msg, markup, delay=0.02)
+        await asyncio.sleep(0.05)
+        return edits
+
+    assert asyncio.run(run()) == ["kb3"]
+
+
+def test_stale_timer_does_not_fire_a_newer_slot():
+    # toggle -> flush -> toggle: the first timer must leave the second slot alone
+    async def run():
+        edits = []
+        msg = EditedMessage(edits)
+        outbox.schedule_markup_edit(FakeContext, msg, "kb1", delay=0.05)
+        await outbox.flush_markup_edit(msg)
+        outbox.schedule_markup_edit(FakeContext, msg, "kb2", delay=0.3)
+        await asyncio.sleep(0.1)
+        early = list(edits)
+        await asyncio.sleep(0.3)
+        return early, edits
+
+    early, edits = asyncio.run(run())
+    assert early == ["kb1"]
+    assert edits == ["kb1", "kb2"]
+    assert not outbox._pending_edits
@@ -0,0 +1,40 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from telegram import Update
+
+import fakeapi
+from replay import Anonymizer, Recorder, read_records
+
+
+def test_anonymizer_keeps_shapes_and_managers():
+    anon = Anonymizer(keep_ids=[500], salt=b"s")
+    out = anon.update(fakeapi.message_update(7, "звоните +7 (916) 123-45-67"))
+    text = out["message"]["text"]
+    assert text.startswith("звоните +7 (") and len(text) == len("звоните +7 (916) 123-45-67")
+    assert "123-45-67" not in text
+    assert out["message"]["from"]["id"] == out["message"]["chat"]["id"] == anon.user_id(7) != 7
+    assert anon.update(fakeapi.message_update(500, "/broadcast"))["message"]["from"]["id"] == 500
+    assert anon.update(fakeapi.message_update(7, "Иван"), name_expected=True)["message"]["text"] == "Аааа"
+
+
+def test_recorder_writes_off_the_loop_and_closes(tmp_path):
+    path = tmp_path / "updates.jsonl"
+    recorder = Recorder(str(path), manager_ids=[500])
+    raw = [{"update_id": i, **fakeapi.message_update(7, text)} for i, text in enumerate(["/start", "Иван"])]
+    drafts = [{}, {}]
+
+    async def run():
+        for update, draft in zip(raw, drafts):
+            await recorder(Update.de_json(update, None), SimpleNamespace(user_data=draft))
+
+    asyncio.run(run())
+    recorder.close()
+    assert recorder._f.closed
+
+    header, records = read_records(str(path))
+    assert header["manager_ids"] == [500]
+    assert [r["update"]["message"]["text"] for r in records] == ["/start", "Аааа"]
+    assert all(set(r) == {"t", "now", "update"} for r in records)
+    assert all(json.dumps(r, ensure_ascii=False).count("Иван") == 0 for r in records)
@@ -0,0 +1,102 @@
+import asyncio
+from types import SimpleNamespace
+
+import db
+from sessions import SessionStore, memory_report
+
+
+def _update(user_id):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id))
+
+
+def _store(tmp_path, capacity):
+    path = str(tmp_path / "t.db")
+    db.init_db(path)
+    return SessionStore(path, capacity=capacity)
+
+
+def test_least_recent_sessions_are_spilled_and_loaded_back(tmp_path):
+    async def run():
+        store = _store(tmp_path, 2)
+        for user_id in (1, 2, 3):
+            await store.prefetch(_update(user_id), None)
+            store[user_id]["name"] = f"client {user_id}"
+        assert list(store) == [2, 3]
+        assert store.on_disk() == 1 and store.spilled == 1
+        await store.close()
+
+        # a new store (a restart) finds it in the database
+        store = SessionStore(store.db_path, capacity=2)
+        await store.prefetch(_update(1), None)
+        assert store[1] == {"name": "client 1"}
+        assert store.loaded == 1 and store.on_disk() == 0
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_empty_sessions_are_dropped_not_spilled(tmp_path):
+    async def run():
+        store = _store(tmp_path, 1)
+        store[1]
+        store[2]
+        assert list(store) == [2] and store.on_disk() == 0
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_session_of_the_current_update_is_not_evicted(tmp_path):
+    async def run():
+        store = _store(tmp_path, 2)
+        await store.prefetch(_update(1), None)
+        draft = store[1]
+        draft["name"] = "client 1"
+        # other sessions are touched while the handler of user 1 waits
+        store[2]["name"] = "client 2"
+        store[3]["name"] = "client 3"
+        draft["car"] = "Lada"
+        assert list(store) == [1, 3]
+        assert store[1] == {"name": "client 1", "car": "Lada"}
+        await store.close()
+
+        store = SessionStore(store.db_path, capacity=2)
+        await store.prefetch(_update(2), None)
+        assert store[2] == {"name": "client 2"}
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_pop_forgets_a_spilled_session(tmp_path):
+    async def run():
+        store = _store(tmp_path, 1)
+        store[1]["name"] = "client 1"
+        store[2]["name"] = "client 2"
+        store.pop(1)
+        await store.close()
+        assert store.on_disk() == 0
+        store = SessionStore(store.db_path, capacity=1)
+        await store.prefetch(_update(1), None)
+        return store
+
+    store = asyncio.run(run())
+    assert 1 not in store
+
+
+def test_memory_report(tmp_path):
+    async def run():
+        store = _store(tmp_path, 2)
+        shared = {"catalogue": "x" * 1000}
+        store[1]["name"] = "client 1"
+        store[2]["catalogue"] = shared["catalogue"]
+        store[3]
+        await store.close()
+        return store, memory_report(store, shared=[shared])
+
+    store, report = asyncio.run(run())
+    assert report["in_memory"] == 2 and report["active"] == 1
+    assert report["capacity"] == 2 and report["on_disk"] == 1 and report["spilled"] == 1
+    # the shared string is billed to nobody
+    assert 0 < report["bytes_max"] < 1000
+    assert report["bytes_total"] == report["bytes_avg"] == report["bytes_max"]
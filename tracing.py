@@ -0,0 +1,123 @@
+import time
+import logging
+import functools
+import contextvars
+
+# -------------------- PER-UPDATE TRACING --------------------
+# While tracing is on, every handler call collects spans for the Bot API
+# requests (transport.TracedRequest) and DB writes (db.Writer) it makes and
+# logs them as one "Update trace" record. Off, span() is a context-variable
+# lookup returning a shared no-op, so instrumented code costs next to nothing.
+# Tracing is on permanently with TRACE=1 and for the length of a /profile run.
+
+logger = logging.getLogger("rks_bot.trace")
+
+_trace = contextvars.ContextVar("rks_trace", default=None)
+
+_users = 0
+_stats = {}  # span name -> [count, total seconds, max seconds]
+
+
+class _Noop:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP = _Noop()
+
+
+class _Span:
+    __slots__ = ("_spans", "_name", "_start")
+
+    def __init__(self, spans, name):
+        self._spans = spans
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._spans.append((self._name, self._start, time.perf_counter() - self._start))
+        return False
+
+
+def enable():
+    global _users
+    _users += 1
+
+def disable():
+    global _users
+    _users = max(0, _users - 1)
+
+def enabled():
+    return _users > 0
+
+
+def span(name):
+    spans = _trace.get()
+    if spans is None:
+        return _NOOP
+    return _Span(spans, name)
+
+
+def _record(name, seconds):
+    s = _stats.get(name)
+    if s is None:
+        _stats[name] = [1, seconds, seconds]
+    else:
+        s[0] += 1
+        s[1] += seconds
+        s[2] = max(s[2], seconds)
+
+def traced(callback):
+    """Wrap a handler callback so its Bot API and DB calls are traced as one update."""
+    name = "handler." + callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        if not _users:
+            return await callback(update, context)
+        spans = []
+        token = _trace.set(spans)
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            total = time.perf_counter() - start
+            _trace.reset(token)
+            # spans of tasks the handler started may still land in the list;
+            # only those finished by now belong to this update
+            done = list(spans)
+            children = sum(d for _, _, d in done)
+            _record(name, total)
+            _record("self." + callback.__name__, max(0.0, total - children))
+            for span_name, _, d in done:
+                _record(span_name, d)
+            logger.info("Update trace", extra={
+                "total_ms": round(total * 1000, 2),
+                "self_ms": round(max(0.0, total - children) * 1000, 2),
+                "spans": [
+                    {"name": n, "at_ms": round((s - start) * 1000, 2), "ms": round(d * 1000, 2)}
+                    for n, s, d in done
+                ],
+            })
+    return wrapper
+
+
+def reset_stats():
+    _stats.clear()
+
+def format_stats(limit=20):
+    """Aggregated span timings since the last reset, slowest total first."""
+    if not _stats:
+        return "Спанов нет (за время замера не было апдейтов)."
+    rows = sorted(_stats.items(), key=lambda kv: kv[1][1], reverse=True)[:limit]
+    lines = [f"{'span':<32} {'n':>5} {'avg ms':>8} {'max ms':>8}"]
+    for name, (count, total, peak) in rows:
+        lines.append(f"{name[:32]:<32} {count:>5} {total / count * 1000:>8.1f} {peak * 1000:>8.1f}")
+    return "\n".join(lines)
@@ -0,0 +1,92 @@
+import logging
+import importlib.util
+
+from telegram.request import BaseRequest, HTTPXRequest
+
+import tracing
+
+logger = logging.getLogger("rks_bot.transport")
+
+# -------------------- POOLS --------------------
+# getUpdates holds its connection for the whole long poll, so polling gets
+# a pool of its own and a reply never waits for that connection (nor a poll
+# for a busy send pool). The pool for every other call is sized by
+# API_POOL_SIZE and keeps idle connections for API_KEEPALIVE_SEC: httpx
+# drops them after 5 s by default, and a reply after a pause then pays for
+# a new TCP + TLS handshake. With API_HTTP2=1 (needs the h2 package) the
+# calls are multiplexed over one connection instead.
+
+KEEPALIVE_SEC = 60
+
+
+def _http_version(http2):
+    if not http2:
+        return "1.1"
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("API_HTTP2=1 but h2 is not installed (pip install httpx[http2]); using HTTP/1.1")
+        return "1.1"
+    return "2"
+
+def _limits(size, keepalive_sec):
+    import httpx
+
+    return httpx.Limits(max_connections=size, max_keepalive_connections=size, keepalive_expiry=keepalive_sec)
+
+def api_request(pool_size, keepalive_sec=KEEPALIVE_SEC, http2=False, cls=HTTPXRequest):
+    """Request object for every Bot API call but getUpdates."""
+    return cls(
+        connection_pool_size=pool_size,
+        http_version=_http_version(http2),
+        httpx_kwargs={"limits": _limits(pool_size, keepalive_sec)},
+    )
+
+def polling_request(keepalive_sec=KEEPALIVE_SEC):
+    """A single connection for getUpdates (PTB adds the poll timeout to read_timeout)."""
+    return HTTPXRequest(connection_pool_size=1, httpx_kwargs={"limits": _limits(1, keepalive_sec)})
+
+
+# -------------------- SHARED POOL --------------------
+# Bot API URLs carry the token, so one HTTP connection pool can serve any
+# number of bots. Each Bot initializes and shuts down its request object,
+# hence the reference count: the pool closes with its last user.
+
+class SharedHTTPXRequest(HTTPXRequest):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._users = 0
+
+    async def initialize(self):
+        self._users += 1
+        await super().initialize()
+
+    async def shutdown(self):
+        self._users = max(0, self._users - 1)
+        if self._users == 0:
+            await super().shutdown()
+
+
+# -------------------- TRACED REQUESTS --------------------
+class TracedRequest(BaseRequest):
+    """Wraps any request object and records each Bot API call as a tracing span."""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    @property
+    def read_timeout(self):
+        return self.inner.read_timeout
+
+    async def initialize(self):
+        await self.inner.initialize()
+
+    async def shutdown(self):
+        await self.inner.shutdown()
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        with tracing.span("api." + url.rsplit("/", 1)[-1]):
+            return await self.inner.do_request(
+                url, method, request_data=request_data, read_timeout=read_timeout,
+                write_timeout=write_timeout, connect_timeout=connect_timeout, pool_timeout=pool_timeout,
+            )